@@ -0,0 +1,225 @@
+import os, time, asyncio, threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from . import metrics
+
+# Admission control for the ask endpoints.
+#
+# A request first takes one of ADMIT_MAX_ACTIVE slots. When none is free it
+# waits in a bounded queue (ADMIT_MAX_QUEUE, else 503) that is served round
+# robin across users, and one user may hold at most ADMIT_PER_USER slots plus
+# queue entries (else 429), so a single tenant's script cannot starve the rest.
+# Inside the request, the embedding, retrieval and LLM stages have their own
+# concurrency limits. Every request carries a deadline (ASK_DEADLINE, or less
+# via the X-Request-Timeout header) in a context variable. Each stage checks
+# it before starting and waits for its slot no longer than the time left, so
+# work that can no longer finish in time is dropped (504) instead of finished.
+
+ADMIT_MAX_ACTIVE = int(os.getenv("ADMIT_MAX_ACTIVE", "64"))        # 0 disables admission control
+ADMIT_MAX_QUEUE = int(os.getenv("ADMIT_MAX_QUEUE", "256"))
+ADMIT_PER_USER = int(os.getenv("ADMIT_PER_USER", "8"))             # active + queued per user
+ADMIT_RETRY_AFTER = int(os.getenv("ADMIT_RETRY_AFTER", "2"))       # seconds, sent with 429/503
+ASK_DEADLINE = float(os.getenv("ASK_DEADLINE", "30"))              # seconds per ask request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))       # question embeddings in flight
+RETRIEVE_CONCURRENCY = int(os.getenv("RETRIEVE_CONCURRENCY", "16"))
+# Don't start an LLM call with less than this many seconds left
+LLM_MIN_SECONDS = float(os.getenv("LLM_MIN_SECONDS", "1.0"))
+
+
+class Rejected(Exception):
+    """Shed before doing the work; main.py turns it into an HTTP error with Retry-After."""
+
+    def __init__(self, status: int, detail: str, retry_after: Optional[int] = ADMIT_RETRY_AFTER):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Rejected):
+    def __init__(self, stage: str):
+        super().__init__(504, f"Request deadline exceeded before {stage}", retry_after=None)
+
+
+# --------------------------- deadlines ---------------------------
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def start_deadline(seconds: Optional[float] = None) -> float:
+    """Set this request's deadline (monotonic), capped at ASK_DEADLINE."""
+    budget = ASK_DEADLINE if seconds is None or seconds <= 0 else min(seconds, ASK_DEADLINE)
+    deadline = time.monotonic() + budget
+    _deadline.set(deadline)
+    return deadline
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request; None outside a request (ingest workers)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(stage: str, need: float = 0.0):
+    left = remaining()
+    if left is not None and left <= need:
+        metrics.set_path("shed")
+        raise DeadlineExceeded(stage)
+
+
+def timeout(default: float) -> float:
+    """A per-call timeout that does not outlive the request."""
+    left = remaining()
+    return default if left is None else max(0.001, min(default, left))
+
+
+# --------------------------- stage limits ---------------------------
+
+_stage_sems = {"embed": threading.BoundedSemaphore(EMBED_CONCURRENCY),
+               "retrieve": threading.BoundedSemaphore(RETRIEVE_CONCURRENCY)}
+
+
+@contextmanager
+def stage(name: str):
+    """Blocking stage (runs on a worker thread): deadline check, then a slot of that stage's limit."""
+    check(name)
+    sem = _stage_sems[name]
+    left = remaining()
+    if not sem.acquire(timeout=left if left is not None else None):
+        metrics.set_path("shed")
+        raise DeadlineExceeded(name)
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+@asynccontextmanager
+async def async_stage(name: str, sem: asyncio.Semaphore, need: float = 0.0):
+    """Async stage (the LLM call): like stage(), for a semaphore owned by the caller."""
+    check(name, need)
+    try:
+        await asyncio.wait_for(sem.acquire(), remaining())
+    except asyncio.TimeoutError:
+        metrics.set_path("shed")
+        raise DeadlineExceeded(name)
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+# --------------------------- request admission ---------------------------
+
+class Admission:
+    """In-flight request slots with a bounded, per-user round-robin wait queue (event-loop only)."""
+
+    def __init__(self, max_active: int, max_queue: int, per_user: int):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.active = 0
+        self.queued = 0
+        self.by_user: Dict[int, int] = {}  # active + queued
+        self.waiting: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": self.queued, "users_waiting": len(self.waiting)}
+
+    async def enter(self, user_id: int):
+        if self.max_active <= 0:
+            return
+        if self.by_user.get(user_id, 0) >= self.per_user:
+            raise Rejected(429, "Too many concurrent requests for this account")
+        if self.active < self.max_active and not self.queued:
+            self._take(user_id)
+            return
+        if self.queued >= self.max_queue:
+            raise Rejected(503, "Server busy, try again shortly")
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user_id, deque()).append(fut)
+        self.queued += 1
+        self.by_user[user_id] = self.by_user.get(user_id, 0) + 1
+        try:
+            await asyncio.wait_for(fut, remaining())
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                self.leave(user_id)  # admitted just as we gave up: hand the slot on
+            else:
+                self._unqueue(user_id, fut)
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded("admission") from None
+            raise
+
+    def leave(self, user_id: int):
+        if self.max_active <= 0:
+            return
+        self.active -= 1
+        self._release_user(user_id)
+        self._dispatch()
+
+    def _take(self, user_id: int):
+        self.active += 1
+        self.by_user[user_id] = self.by_user.get(user_id, 0) + 1
+
+    def _release_user(self, user_id: int):
+        n = self.by_user.get(user_id, 0) - 1
+        if n > 0:
+            self.by_user[user_id] = n
+        else:
+            self.by_user.pop(user_id, None)
+
+    def _unqueue(self, user_id: int, fut: asyncio.Future):
+        q = self.waiting.get(user_id)
+        if q is not None and fut in q:
+            q.remove(fut)
+            self.queued -= 1
+            self._release_user(user_id)
+            if not q:
+                del self.waiting[user_id]
+
+    def _dispatch(self):
+        # one request per waiting user in turn; a user with more waiting goes to the back of the line
+        while self.active < self.max_active and self.waiting:
+            user_id, q = next(iter(self.waiting.items()))
+            fut = q.popleft()
+            self.queued -= 1
+            if q:
+                self.waiting.move_to_end(user_id)
+            else:
+                del self.waiting[user_id]
+            if fut.done():  # timed out or cancelled while waiting; whoever dequeues it releases the count
+                self._release_user(user_id)
+                continue
+            self.active += 1  # by_user already counts it from the queue
+            fut.set_result(None)
+
+
+controller = Admission(ADMIT_MAX_ACTIVE, ADMIT_MAX_QUEUE, ADMIT_PER_USER)
+
+
+async def enter(user_id: int):
+    t0 = time.perf_counter()
+    try:
+        await controller.enter(user_id)
+    except Rejected:
+        metrics.set_path("shed")
+        raise
+    metrics.record("queue", time.perf_counter() - t0)
+
+
+def leave(user_id: int):
+    controller.leave(user_id)
+
+
+@asynccontextmanager
+async def admitted(user_id: int):
+    await enter(user_id)
+    try:
+        yield
+    finally:
+        leave(user_id)
@@ -0,0 +1,94 @@
+import os
+from typing import Optional, Tuple
+import numpy as np
+
+# Inverted-file (IVF) approximate search for large tenants, pure NumPy.
+# Embeddings are normalized, so clustering is spherical k-means on dot products.
+
+ANN_ENABLED = os.getenv("ANN_ENABLED", "0") == "1"
+# Below this many live chunks we always do exact search
+ANN_MIN_SIZE = int(os.getenv("ANN_MIN_SIZE", "20000"))
+# Lists probed per query: higher = better recall, slower
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_DIR = os.getenv("ANN_DIR", os.path.join(os.getenv("STORAGE_DIR", "./storage"), "ann"))
+
+_TRAIN_SAMPLE = 50_000
+_BLOCK = 8192
+
+
+def nlist_for(n: int) -> int:
+    return int(min(4096, max(16, 4 * np.sqrt(n))))
+
+
+def nearest_centroid(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(len(x), dtype=np.int32)
+    for s in range(0, len(x), _BLOCK):
+        out[s: s + _BLOCK] = np.argmax(x[s: s + _BLOCK] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(x: np.ndarray, nlist: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if len(x) > _TRAIN_SAMPLE:
+        x = x[rng.choice(len(x), _TRAIN_SAMPLE, replace=False)]
+    nlist = min(nlist, len(x))
+    c = x[rng.choice(len(x), nlist, replace=False)].astype(np.float32, copy=True)
+    for _ in range(iters):
+        a = nearest_centroid(x, c)
+        order = np.argsort(a, kind="stable")
+        counts = np.bincount(a, minlength=nlist)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        c[nonempty] = sums
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            c[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+        c /= np.maximum(np.linalg.norm(c, axis=1, keepdims=True), 1e-12)
+    return c
+
+
+class IVF:
+    """Coarse quantizer only; list assignments live alongside the rows in UserIndex."""
+
+    def __init__(self, centroids: np.ndarray, trained_on: int):
+        self.centroids = centroids
+        self.trained_on = trained_on
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def assign(self, x: np.ndarray) -> np.ndarray:
+        return nearest_centroid(np.asarray(x, dtype=np.float32), self.centroids)
+
+    def probe(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        sims = self.centroids @ q
+        nprobe = min(max(nprobe, 1), self.nlist)
+        return np.argpartition(-sims, nprobe - 1)[:nprobe]
+
+
+def _path(user_id: int) -> str:
+    return os.path.join(ANN_DIR, f"{user_id}.ivf.npz")
+
+
+def save(user_id: int, ivf: IVF, chunk_ids: np.ndarray, lists: np.ndarray):
+    os.makedirs(ANN_DIR, exist_ok=True)
+    tmp = _path(user_id) + ".tmp.npz"
+    np.savez(tmp, centroids=ivf.centroids, trained_on=ivf.trained_on, chunk_ids=chunk_ids, lists=lists)
+    os.replace(tmp, _path(user_id))
+
+
+def load(user_id: int) -> Optional[Tuple[IVF, np.ndarray, np.ndarray]]:
+    try:
+        with np.load(_path(user_id)) as z:
+            return IVF(z["centroids"], int(z["trained_on"])), z["chunk_ids"], z["lists"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def remove(user_id: int):
+    try:
+        os.remove(_path(user_id))
+    except OSError:
+        pass
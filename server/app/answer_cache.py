@@ -0,0 +1,71 @@
+import os, re, json, hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+
+from .models import AnswerCache, User
+
+# LLM answers cached per user. The key covers the normalized question, the
+# retrieved chunk ids, the chat carry-over and the user's corpus_version,
+# which every upload/delete bumps, so an answer is never served from a
+# corpus that has since changed.
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_PER_USER = int(os.getenv("ANSWER_CACHE_MAX_PER_USER", "500"))
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_question(q: str) -> str:
+    return _WS.sub(" ", (q or "").lower()).strip(" ?!.")
+
+
+def make_key(question: str, chunk_ids: Sequence[int], corpus_version: int,
+             prev_context: Optional[str] = None, history: Optional[List[Dict]] = None) -> str:
+    blob = json.dumps({
+        "q": normalize_question(question),
+        "chunks": sorted(int(c) for c in chunk_ids),
+        "v": corpus_version,
+        "prev": (prev_context or "").strip(),
+        "history": history or [],
+    }, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def lookup(db: Session, user_id: int, key: str) -> Optional[dict]:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ANSWER_CACHE_TTL)
+    row = db.scalar(
+        select(AnswerCache)
+        .where(AnswerCache.user_id == user_id, AnswerCache.qhash == key, AnswerCache.created_at >= cutoff)
+        .order_by(AnswerCache.id.desc()).limit(1)
+    )
+    return json.loads(row.payload) if row else None
+
+
+def store(db: Session, user_id: int, key: str, payload: dict):
+    db.add(AnswerCache(user_id=user_id, qhash=key, payload=json.dumps(payload),
+                       created_at=datetime.now(timezone.utc)))
+    db.commit()
+    _evict(db, user_id)
+
+
+def _evict(db: Session, user_id: int):
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ANSWER_CACHE_TTL)
+    db.execute(delete(AnswerCache).where(AnswerCache.user_id == user_id, AnswerCache.created_at < cutoff))
+    keep = (select(AnswerCache.id).where(AnswerCache.user_id == user_id)
+            .order_by(AnswerCache.id.desc()).limit(ANSWER_CACHE_MAX_PER_USER))
+    db.execute(delete(AnswerCache).where(AnswerCache.user_id == user_id,
+                                         AnswerCache.id.not_in(keep.scalar_subquery())))
+    db.commit()
+
+
+def bump_corpus_version(db: Session, user_id: int):
+    """Invalidate the user's cached answers; caller commits."""
+    db.execute(update(User).where(User.id == user_id).values(corpus_version=User.corpus_version + 1))
+    db.execute(delete(AnswerCache).where(AnswerCache.user_id == user_id))
+
+
+def clear_user(db: Session, user_id: int):
+    db.execute(delete(AnswerCache).where(AnswerCache.user_id == user_id))
@@ -1,9 +1,79 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DB_URL = os.getenv("DB_URL", "sqlite:///./app.db")
+# SQLITE_PROFILE=tuned: WAL (readers don't block behind the ingest writer), synchronous=NORMAL,
+# a bigger page cache and memory-mapped reads. "default" leaves SQLite's settings alone.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default")
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+IS_POSTGRES = DB_URL.startswith("postgresql")
+# On Postgres chunk vectors live in a pgvector column and are searched in the
+# database (pgvec.py), unless VECTOR_STORE picks another store.
+PGVECTOR = IS_POSTGRES and os.getenv("VECTOR_STORE", "pgvector") == "pgvector"
+PGVECTOR_DIM = int(os.getenv("PGVECTOR_DIM", "384"))  # all-MiniLM-L6-v2
+# Postgres pool per API process. Each ask holds a connection for its retrieval
+# queries only (ASK_THREADS at most); ingest workers add INGEST_WORKERS more.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
 connect_args = {"check_same_thread": False} if DB_URL.startswith("sqlite") else {}
-engine = create_engine(DB_URL, echo=False, future=True, connect_args=connect_args)
+pool_args = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                 pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True) if IS_POSTGRES else {}
+engine = create_engine(DB_URL, echo=False, future=True, connect_args=connect_args, **pool_args)
+
+
+def tuned_pragmas(cache_mb: int = SQLITE_CACHE_MB, mmap_mb: int = SQLITE_MMAP_MB) -> list:
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA cache_size=-{cache_mb * 1024}",  # negative = KiB
+        f"PRAGMA mmap_size={mmap_mb * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    ]
+
+
+def apply_sqlite_profile(eng, profile: str = SQLITE_PROFILE):
+    """Run the profile's pragmas on every new connection of a SQLite engine."""
+    if eng.dialect.name != "sqlite" or profile != "tuned":
+        return
+
+    @event.listens_for(eng, "connect")
+    def _pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for stmt in tuned_pragmas():
+            cur.execute(stmt)
+        cur.close()
+
+
+apply_sqlite_profile(engine)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
+
+
+def ensure_columns(table: str, columns: dict):
+    """Add columns that create_all() won't add to an already existing table."""
+    insp = inspect(engine)
+    if table not in insp.get_table_names():
+        return
+    have = {c["name"] for c in insp.get_columns(table)}
+    with engine.begin() as conn:
+        for name, ddl in columns.items():
+            if name not in have:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def ensure_indexes(indexes: dict):
+    """{index_name: (table, column)}: create indexes missing from an already existing table."""
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    with engine.begin() as conn:
+        for name, (table, column) in indexes.items():
+            if table in tables:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
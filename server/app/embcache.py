@@ -0,0 +1,146 @@
+import os, re, hashlib, threading, unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics
+from .db import SessionLocal
+from .models import EmbeddingCacheEntry
+
+# Two-level embedding cache:
+#   - QueryLRU: in-process LRU for question vectors (repeated/rephrased chat questions)
+#   - PersistentEmbeddingCache: embedding_cache table keyed by (model, sha256(normalized text)),
+#     so re-uploaded revisions only embed the chunks that changed.
+
+EMB_CACHE_ENABLED = os.getenv("EMB_CACHE", "1") == "1"
+EMB_CACHE_MAX_ROWS = int(os.getenv("EMB_CACHE_MAX_ROWS", "200000"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+
+_WS = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+class QueryLRU:
+    def __init__(self, size: int = QUERY_CACHE_SIZE):
+        self.size = size
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            v = self._data.get(key)
+            if v is None:
+                metrics.EMB_CACHE_MISSES.labels("query").inc()
+                return None
+            self._data.move_to_end(key)
+            metrics.EMB_CACHE_HITS.labels("query").inc()
+            return v
+
+    def put(self, key: str, vec: np.ndarray):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = vec
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+class PersistentEmbeddingCache:
+    def __init__(self, max_rows: int = EMB_CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+
+    def get_many(self, model: str, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        out: Dict[str, np.ndarray] = {}
+        db = SessionLocal()
+        try:
+            uniq = list(set(keys))
+            for s in range(0, len(uniq), 500):
+                rows = db.execute(
+                    select(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.vector)
+                    .where(EmbeddingCacheEntry.model == model, EmbeddingCacheEntry.text_hash.in_(uniq[s: s + 500]))
+                ).all()
+                out.update({r.text_hash: np.frombuffer(r.vector, dtype=np.float32) for r in rows})
+            if out:
+                db.execute(
+                    update(EmbeddingCacheEntry)
+                    .where(EmbeddingCacheEntry.model == model, EmbeddingCacheEntry.text_hash.in_(list(out)))
+                    .values(last_used=datetime.now(timezone.utc))
+                )
+                db.commit()
+        finally:
+            db.close()
+        return out
+
+    def put_many(self, model: str, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        now = datetime.now(timezone.utc)
+        rows = [EmbeddingCacheEntry(model=model, text_hash=k, vector=np.asarray(v, dtype=np.float32).tobytes(),
+                                    last_used=now) for k, v in items.items()]
+        db = SessionLocal()
+        try:
+            try:
+                db.add_all(rows)
+                db.commit()
+            except IntegrityError:
+                # another worker cached some of these meanwhile; insert the rest one by one
+                db.rollback()
+                for r in rows:
+                    try:
+                        db.add(EmbeddingCacheEntry(model=r.model, text_hash=r.text_hash, vector=r.vector,
+                                                   last_used=now))
+                        db.commit()
+                    except IntegrityError:
+                        db.rollback()
+            self._evict(db)
+        finally:
+            db.close()
+
+    def _evict(self, db):
+        total = db.scalar(select(func.count(EmbeddingCacheEntry.id))) or 0
+        excess = total - self.max_rows
+        if excess <= 0:
+            return
+        oldest = select(EmbeddingCacheEntry.id).order_by(EmbeddingCacheEntry.last_used).limit(excess)
+        db.execute(delete(EmbeddingCacheEntry).where(EmbeddingCacheEntry.id.in_(oldest.scalar_subquery())))
+        db.commit()
+        metrics.EMB_CACHE_EVICTIONS.labels("chunks").inc(excess)
+
+
+query_cache = QueryLRU()
+chunk_cache = PersistentEmbeddingCache()
+
+
+def cached_encode(texts: List[str], model: str, encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+    """Look every text up in the persistent cache; encode only the misses, in one batch."""
+    keys = [text_key(t) for t in texts]
+    found = chunk_cache.get_many(model, keys)
+    miss_idx, seen = [], set()
+    for i, k in enumerate(keys):
+        if k not in found and k not in seen:
+            miss_idx.append(i)
+            seen.add(k)
+    misses = sum(1 for k in keys if k not in found)
+    metrics.EMB_CACHE_HITS.labels("chunks").inc(len(texts) - misses)
+    metrics.EMB_CACHE_MISSES.labels("chunks").inc(misses)
+    if miss_idx:
+        fresh = encode([texts[i] for i in miss_idx])
+        new = {keys[i]: fresh[j] for j, i in enumerate(miss_idx)}
+        chunk_cache.put_many(model, new)
+        found.update(new)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([found[k] for k in keys]).astype(np.float32, copy=False)
@@ -0,0 +1,137 @@
+import os, json, argparse
+from typing import List, Optional
+import numpy as np
+
+# Embedding backends, chosen with EMB_BACKEND:
+#   torch - sentence_transformers.SentenceTransformer (the reference)
+#   onnx  - the same model exported to ONNX and run with onnxruntime on CPU;
+#           EMB_ONNX_QUANTIZE=1 uses a dynamically int8-quantized copy.
+# Both return L2-normalized float32 rows, so vectors from either backend are
+# interchangeable with what is already stored (bench/embed_backends.py checks
+# the cosine agreement). Heavy libraries are imported when a backend loads.
+
+EMB_BACKEND = os.getenv("EMB_BACKEND", "torch")
+EMB_ONNX_QUANTIZE = os.getenv("EMB_ONNX_QUANTIZE", "0") == "1"
+EMB_ONNX_DIR = os.getenv("EMB_ONNX_DIR", os.path.join(os.getenv("STORAGE_DIR", "./storage"), "onnx"))
+EMB_ONNX_THREADS = int(os.getenv("EMB_ONNX_THREADS", "0"))  # 0 = onnxruntime's default
+EMB_MAX_SEQ = int(os.getenv("EMB_MAX_SEQ", "256"))  # all-MiniLM-L6-v2 truncates at 256 word pieces
+EMB_ONNX_BATCH = 64
+
+
+def hub_id(model_name: str) -> str:
+    """Short sentence-transformers names ('all-MiniLM-L6-v2') resolve under that org on the hub."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class TorchEmbedder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        embs = self.model.encode(texts, normalize_embeddings=True)  # cosine-ready
+        return np.array(embs, dtype=np.float32)
+
+
+def onnx_dir(model_name: str) -> str:
+    return os.path.join(EMB_ONNX_DIR, model_name.replace("/", "__"))
+
+
+def export_onnx(model_name: str, quantize: bool = False, out_dir: Optional[str] = None) -> str:
+    """
+    Export the model (and tokenizer) to out_dir/model.onnx; with quantize also
+    write model_int8.onnx. Needs `optimum[onnxruntime]` only for this step.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+    out_dir = out_dir or onnx_dir(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(out_dir, "model.onnx")):
+        ORTModelForFeatureExtraction.from_pretrained(hub_id(model_name), export=True).save_pretrained(out_dir)
+        AutoTokenizer.from_pretrained(hub_id(model_name)).save_pretrained(out_dir)
+        with open(os.path.join(out_dir, "pooling.json"), "w") as f:
+            json.dump({"mode": _pooling_mode(model_name)}, f)
+    if quantize and not os.path.exists(os.path.join(out_dir, "model_int8.onnx")):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(out_dir, "model.onnx"), os.path.join(out_dir, "model_int8.onnx"),
+                         weight_type=QuantType.QInt8)
+    return out_dir
+
+
+def _pooling_mode(model_name: str) -> str:
+    """'mean' or 'cls', from the sentence-transformers pooling config when the hub has one."""
+    try:
+        from huggingface_hub import hf_hub_download
+        with open(hf_hub_download(hub_id(model_name), "1_Pooling/config.json")) as f:
+            cfg = json.load(f)
+        return "cls" if cfg.get("pooling_mode_cls_token") else "mean"
+    except Exception:
+        return "mean"
+
+
+class OnnxEmbedder:
+    """Tokenizer + ONNX encoder + pooling + L2 normalization, mirroring SentenceTransformer.encode."""
+
+    def __init__(self, model_name: str, quantize: bool = EMB_ONNX_QUANTIZE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.quantized = quantize
+        path = onnx_dir(model_name)
+        model_file = os.path.join(path, "model_int8.onnx" if quantize else "model.onnx")
+        if not os.path.exists(model_file):
+            export_onnx(model_name, quantize=quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        try:
+            with open(os.path.join(path, "pooling.json")) as f:
+                self.pooling = json.load(f).get("mode", "mean")
+        except OSError:
+            self.pooling = "mean"
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if EMB_ONNX_THREADS > 0:
+            opts.intra_op_num_threads = EMB_ONNX_THREADS
+        self.session = ort.InferenceSession(model_file, opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        out = [self._encode_batch(texts[s: s + EMB_ONNX_BATCH]) for s in range(0, len(texts), EMB_ONNX_BATCH)]
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=EMB_MAX_SEQ, return_tensors="np")
+        feed = {k: v.astype(np.int64) for k, v in enc.items() if k in self._inputs}
+        hidden = self.session.run(None, feed)[0]  # (batch, seq, dim)
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = pooled.astype(np.float32)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+
+def cache_tag(model_name: str, backend: str = EMB_BACKEND) -> str:
+    """Model key for the embedding cache; int8 vectors differ slightly from the float model's, so they get their own."""
+    return f"{model_name}#int8" if backend == "onnx" and EMB_ONNX_QUANTIZE else model_name
+
+
+def load(model_name: str, backend: str = EMB_BACKEND):
+    if backend == "onnx":
+        return OnnxEmbedder(model_name)
+    if backend == "torch":
+        return TorchEmbedder(model_name)
+    raise ValueError(f"unknown EMB_BACKEND {backend!r} (torch | onnx)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(prog="python -m app.embedders")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("export", help="export EMB_MODEL to ONNX under EMB_ONNX_DIR")
+    e.add_argument("--model", default=os.getenv("EMB_MODEL", "all-MiniLM-L6-v2"))
+    e.add_argument("--quantize", action="store_true", help="also write the int8 model")
+    args = ap.parse_args()
+    if args.cmd == "export":
+        print(export_onnx(args.model, quantize=args.quantize))
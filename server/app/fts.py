@@ -0,0 +1,91 @@
+import os, re
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .db import engine
+
+# Keyword index over chunks.text: an FTS5 table with chunks as its external
+# content, kept in sync by triggers. Used for BM25 keyword retrieval (exact
+# invoice numbers, SKUs, dates). On databases without FTS5 (e.g. Postgres)
+# hybrid retrieval degrades to vector only.
+
+# Candidates taken from each ranking before fusion, and the RRF constant
+RRF_CANDIDATES = int(os.getenv("RRF_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+_available = False
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+_DDL = [
+    """CREATE VIRTUAL TABLE chunks_fts USING fts5(
+           text, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS chunks_fts_ai AFTER INSERT ON chunks BEGIN
+           INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS chunks_fts_ad AFTER DELETE ON chunks BEGIN
+           INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS chunks_fts_au AFTER UPDATE OF text ON chunks BEGIN
+           INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+           INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+       END""",
+]
+
+
+def available() -> bool:
+    return _available
+
+
+def ensure_fts():
+    """Create the FTS table and triggers (SQLite only), indexing existing chunks once."""
+    global _available
+    if engine.dialect.name != "sqlite":
+        return
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chunks_fts'")).first()
+            if not exists:
+                conn.execute(text(_DDL[0]))
+            for ddl in _DDL[1:]:
+                conn.execute(text(ddl))
+            if not exists:
+                conn.execute(text("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')"))
+        _available = True
+    except OperationalError:  # SQLite built without FTS5
+        _available = False
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def keyword_query(question: str, max_terms: int = 32) -> Optional[str]:
+    """FTS5 query matching any word of the question; BM25 weighs the rare ones."""
+    terms = list(dict.fromkeys(t.lower() for t in _TERM.findall(question or "")))[:max_terms]
+    return " OR ".join(_quote(t) for t in terms) or None
+
+
+def search(db: Session, user_id: int, question: str, limit: int) -> List[Tuple[float, int]]:
+    """[(bm25 score, chunk_id)] for the user's chunks, best first (higher is better)."""
+    q = keyword_query(question)
+    if not _available or not q:
+        return []
+    rows = db.execute(text(
+        "SELECT c.id, bm25(chunks_fts) AS rank FROM chunks_fts "
+        "JOIN chunks c ON c.id = chunks_fts.rowid JOIN documents d ON d.id = c.document_id "
+        "WHERE chunks_fts MATCH :q AND d.user_id = :uid ORDER BY rank LIMIT :n"
+    ), {"q": q, "uid": user_id, "n": limit}).all()
+    return [(-float(r.rank), int(r.id)) for r in rows]  # FTS5 bm25() is lower-is-better
+
+
+def rrf(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> Dict[int, float]:
+    """Reciprocal rank fusion of several best-first id lists."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    return fused
+
@@ -0,0 +1,551 @@
+import os, time, threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import Chunk, Document
+from . import ann, pgvec, quant, vecstore
+
+# Total bytes of embedding matrices kept in memory across all tenants
+INDEX_MAX_BYTES = int(os.getenv("INDEX_MAX_MB", "512")) * 1024 * 1024
+# Tenants untouched for this long are dropped even if we are under the cap
+INDEX_IDLE_SECONDS = int(os.getenv("INDEX_IDLE_SECONDS", "1800"))
+
+_NO_PAGE = -1
+_UNASSIGNED = -1
+# Compact tombstoned rows once they make up this share of a segment
+_COMPACT_RATIO = 0.25
+
+_ARRAYS = ("emb", "codes", "scales", "chunk_ids", "doc_ids", "pages", "alive", "lists")
+
+
+class Segment:
+    """
+    A block of rows: an embedding matrix plus parallel arrays of chunk id /
+    document id / page. In-memory segments grow in place (capacity doubles);
+    memmap segments from vecstore are read-only views over the file.
+
+    With a quantization codec the segment also keeps compact codes for the
+    first-pass scan. In-memory segments then drop the float32 matrix and
+    exact vectors are fetched from the DB for rescoring.
+    """
+
+    def __init__(self, dim: int, capacity: int = 64, emb: Optional[np.ndarray] = None,
+                 ids: Optional[np.ndarray] = None, codec: Optional[quant.Codec] = None):
+        self.dim = dim
+        self.codec = codec
+        if emb is None:
+            self.growable = True
+            self.n = 0
+            cap = max(capacity, 64)
+            self.emb = None if codec else np.zeros((cap, dim), dtype=np.float32)
+            self.chunk_ids = np.zeros(cap, dtype=np.int64)
+            self.doc_ids = np.zeros(cap, dtype=np.int64)
+            self.pages = np.zeros(cap, dtype=np.int32)
+        else:
+            self.growable = False
+            self.n = len(ids)
+            self.emb = emb
+            self.chunk_ids = ids[:, 0].copy()
+            self.doc_ids = ids[:, 1].copy()
+            self.pages = ids[:, 2].astype(np.int32)
+        size = len(self.chunk_ids)
+        self.codes = self.scales = None
+        if codec:
+            self.codes = np.zeros((size, codec.code_dim(dim)), dtype=codec.dtype)
+            self.scales = np.zeros(size, dtype=np.float32)
+            for s in range(0, self.n, 16384):
+                self.codes[s: s + 16384], self.scales[s: s + 16384] = codec.encode(np.asarray(emb[s: s + 16384]))
+        self.alive = np.zeros(size, dtype=bool)
+        self.alive[: self.n] = True
+        self.lists = np.full(size, _UNASSIGNED, dtype=np.int32)
+        self.n_dead = 0
+
+    def _names(self):
+        return [name for name in _ARRAYS if getattr(self, name) is not None]
+
+    @property
+    def nbytes(self) -> int:
+        # memmap pages belong to the OS page cache, not to this process
+        return sum(getattr(self, name).nbytes for name in self._names()
+                   if not isinstance(getattr(self, name), np.memmap))
+
+    def vectors(self, rows) -> np.ndarray:
+        """float32 rows: exact if we hold them, otherwise decoded from the codes."""
+        if self.emb is not None:
+            return np.asarray(self.emb[rows], dtype=np.float32)
+        return self.codec.decode(self.codes[rows], self.scales[rows])
+
+    def first_pass(self, q: np.ndarray, rows) -> np.ndarray:
+        if self.codec is not None:
+            return self.codec.score(self.codes[rows], self.scales[rows], q)
+        return self.emb[rows] @ q
+
+    def _reserve(self, extra: int):
+        need = self.n + extra
+        cap = len(self.chunk_ids)
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        for name in self._names():
+            old = getattr(self, name)
+            new = np.zeros((cap,) + old.shape[1:], dtype=old.dtype)
+            new[: self.n] = old[: self.n]
+            setattr(self, name, new)
+
+    def append(self, chunk_ids, doc_ids, pages, embs: np.ndarray, lists):
+        k = len(chunk_ids)
+        self._reserve(k)
+        s, e = self.n, self.n + k
+        if self.emb is not None:
+            self.emb[s:e] = embs
+        if self.codec is not None:
+            self.codes[s:e], self.scales[s:e] = self.codec.encode(embs)
+        self.chunk_ids[s:e] = chunk_ids
+        self.doc_ids[s:e] = doc_ids
+        self.pages[s:e] = [_NO_PAGE if p is None else p for p in pages]
+        self.alive[s:e] = True
+        self.lists[s:e] = lists
+        self.n = e
+
+    def kill(self, mask: np.ndarray) -> int:
+        hit = self.alive[: self.n] & mask
+        dead = int(hit.sum())
+        if dead:
+            self.alive[: self.n][hit] = False
+            self.n_dead += dead
+            if self.growable and self.n_dead > _COMPACT_RATIO * self.n:
+                self._compact()
+        return dead
+
+    def _compact(self):
+        keep = self.alive[: self.n].copy()
+        m = int(keep.sum())
+        for name in self._names():
+            arr = getattr(self, name)
+            arr[:m] = arr[: self.n][keep]
+        self.alive[m: self.n] = False
+        self.n, self.n_dead = m, 0
+
+
+class UserIndex:
+    """
+    One user's chunk embeddings for retrieval. Rows live in segments: a
+    contiguous in-memory float32 matrix (VECTOR_STORE=db) or memmapped
+    vecstore files (VECTOR_STORE=memmap). Deletes tombstone rows.
+    Large tenants get an IVF coarse quantizer (see ann.py) once ANN is enabled.
+    """
+
+    def __init__(self, dim: int, capacity: int = 0, user_id: Optional[int] = None):
+        self.dim = dim
+        self.user_id = user_id
+        self._capacity = capacity
+        self.codec = quant.get_codec()
+        self.segments: List[Segment] = []
+        self.ivf: Optional[ann.IVF] = None
+        self._training = False
+        self.last_used = time.monotonic()
+        self.lock = threading.RLock()
+
+    @property
+    def n(self) -> int:
+        return sum(s.n for s in self.segments)
+
+    @property
+    def live(self) -> int:
+        return sum(s.n - s.n_dead for s in self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self.segments)
+
+    def signature(self) -> Tuple[int, int]:
+        if not self.live:
+            return 0, 0
+        return self.live, max(int(s.chunk_ids[: s.n][s.alive[: s.n]].max())
+                              for s in self.segments if s.n - s.n_dead)
+
+    def contains(self, chunk_id: int) -> bool:
+        with self.lock:
+            return any(bool((s.chunk_ids[: s.n] == chunk_id).any()) for s in reversed(self.segments))
+
+    def _live_ids(self) -> np.ndarray:
+        return np.concatenate([s.chunk_ids[: s.n][s.alive[: s.n]] for s in self.segments] or [np.zeros(0, np.int64)])
+
+    def add(self, chunk_ids: Sequence[int], doc_ids: Sequence[int], pages: Sequence[Optional[int]],
+            embs: np.ndarray):
+        k = len(chunk_ids)
+        if not k:
+            return
+        embs = np.asarray(embs, dtype=np.float32).reshape(k, self.dim)
+        with self.lock:
+            if not self.segments or not self.segments[-1].growable:
+                self.segments.append(Segment(self.dim, capacity=max(self._capacity, k), codec=self.codec))
+            lists = self.ivf.assign(embs) if self.ivf is not None else _UNASSIGNED
+            self.segments[-1].append(chunk_ids, doc_ids, pages, embs, lists)
+            if self.ivf is not None:
+                self._save_ann()
+
+    def add_segment(self, emb: np.ndarray, ids: np.ndarray):
+        seg = Segment(emb.shape[1], emb=emb, ids=ids, codec=self.codec)
+        with self.lock:
+            if self.ivf is not None:
+                seg.lists[:] = self.ivf.assign(emb)
+            self.segments.append(seg)
+            if self.ivf is not None:
+                self._save_ann()
+
+    def remove_document(self, doc_id: int):
+        with self.lock:
+            for s in self.segments:
+                s.kill(s.doc_ids[: s.n] == doc_id)
+
+    def retain(self, chunk_ids: np.ndarray):
+        """Tombstone every row whose chunk id is not in chunk_ids."""
+        with self.lock:
+            for s in self.segments:
+                s.kill(~np.isin(s.chunk_ids[: s.n], chunk_ids))
+
+    # ---- ANN ----
+
+    def _use_ann(self) -> bool:
+        return ann.ANN_ENABLED and self.live >= ann.ANN_MIN_SIZE
+
+    def _maybe_train(self):
+        if self._training or (self.ivf is not None and self.live <= 2 * self.ivf.trained_on):
+            return
+        self._training = True
+        threading.Thread(target=self._train, daemon=True).start()
+
+    def _train(self):
+        try:
+            with self.lock:
+                sample = np.concatenate([s.vectors(np.flatnonzero(s.alive[: s.n])) for s in self.segments])
+            ivf = ann.IVF(ann.train_centroids(sample, ann.nlist_for(len(sample))), len(sample))
+            with self.lock:
+                for s in self.segments:
+                    s.lists[: s.n] = ivf.assign(s.vectors(slice(0, s.n)))
+                self.ivf = ivf
+                self._save_ann()
+        finally:
+            self._training = False
+
+    def attach_ann(self, loaded: Optional[Tuple["ann.IVF", np.ndarray, np.ndarray]]):
+        """Reuse persisted list assignments by chunk id; assign anything new."""
+        if loaded is None:
+            return
+        ivf, ids, lists = loaded
+        if ivf.centroids.shape[1] != self.dim or not len(ids):
+            return
+        with self.lock:
+            for s in self.segments:
+                cids = s.chunk_ids[: s.n]
+                pos = np.minimum(np.searchsorted(ids, cids), len(ids) - 1)
+                found = ids[pos] == cids
+                s.lists[: s.n] = np.where(found, lists[pos], _UNASSIGNED)
+                missing = np.flatnonzero(~found)
+                if len(missing):
+                    s.lists[missing] = ivf.assign(s.vectors(missing))
+            self.ivf = ivf
+
+    def _save_ann(self):
+        if self.user_id is None:
+            return
+        ids = self._live_ids()
+        lists = np.concatenate([s.lists[: s.n][s.alive[: s.n]] for s in self.segments])
+        order = np.argsort(ids)
+        ann.save(self.user_id, self.ivf, ids[order], lists[order])
+
+    # ---- search ----
+
+    def search(self, q: np.ndarray, top_k: int, nprobe: Optional[int] = None,
+               fetch_exact: Optional[Callable[[Sequence[int]], Dict[int, np.ndarray]]] = None
+               ) -> List[Tuple[float, int]]:
+        """
+        Return [(score, chunk_id)] best-first. Embeddings are normalized, so dot == cosine.
+        With a codec, the first pass scans the codes and the best INDEX_RESCORE
+        candidates are rescored exactly (fetch_exact supplies vectors we don't hold).
+        """
+        q = np.asarray(q, dtype=np.float32)
+        with self.lock:
+            self.last_used = time.monotonic()
+            if not self.live or top_k <= 0:
+                return []
+            probe = None
+            if self._use_ann():
+                self._maybe_train()
+                if self.ivf is not None:
+                    probe = np.zeros(self.ivf.nlist + 1, dtype=bool)
+                    probe[self.ivf.probe(q, nprobe or ann.ANN_NPROBE)] = True
+                    probe[_UNASSIGNED] = True
+            hits = self._scan(q, probe)
+            if probe is not None and len(hits[0]) < top_k:
+                hits = self._scan(q, None)
+            scores, ids = hits[0], hits[1]
+            if self.codec is not None:
+                scores, ids = self._rescore(q, *hits, max(quant.INDEX_RESCORE, top_k), fetch_exact)
+            k = min(top_k, len(scores))
+            if k < len(scores):
+                idx = np.argpartition(-scores, k - 1)[:k]
+            else:
+                idx = np.arange(len(scores))
+            idx = idx[np.argsort(-scores[idx], kind="stable")]
+            return [(float(scores[i]), int(ids[i])) for i in idx]
+
+    def score(self, q: np.ndarray, chunk_ids: Sequence[int],
+              fetch_exact: Optional[Callable[[Sequence[int]], Dict[int, np.ndarray]]] = None) -> Dict[int, float]:
+        """{chunk_id: cosine} for the given live chunks (e.g. keyword hits that the vector pass missed)."""
+        q = np.asarray(q, dtype=np.float32)
+        want = np.asarray(list(chunk_ids), dtype=np.int64)
+        out: Dict[int, float] = {}
+        with self.lock:
+            for s in self.segments:
+                rows = np.flatnonzero(np.isin(s.chunk_ids[: s.n], want) & s.alive[: s.n])
+                if not len(rows):
+                    continue
+                ids = s.chunk_ids[rows].tolist()
+                exact = fetch_exact(ids) if s.emb is None and fetch_exact is not None else {}
+                approx = s.vectors(rows) @ q
+                for cid, a in zip(ids, approx.tolist()):
+                    v = exact.get(cid)
+                    out[cid] = float(v @ q) if v is not None else a
+        return out
+
+    def vectors(self, chunk_ids: Sequence[int],
+                fetch_exact: Optional[Callable[[Sequence[int]], Dict[int, np.ndarray]]] = None
+                ) -> Dict[int, np.ndarray]:
+        """{chunk_id: float32 vector} for the given live chunks; exact where available, else decoded codes."""
+        want = np.asarray(list(chunk_ids), dtype=np.int64)
+        out: Dict[int, np.ndarray] = {}
+        with self.lock:
+            for s in self.segments:
+                rows = np.flatnonzero(np.isin(s.chunk_ids[: s.n], want) & s.alive[: s.n])
+                if not len(rows):
+                    continue
+                ids = s.chunk_ids[rows].tolist()
+                exact = fetch_exact(ids) if s.emb is None and fetch_exact is not None else {}
+                for cid, v in zip(ids, s.vectors(rows)):
+                    out[cid] = exact.get(cid, v)
+        return out
+
+    def _scan(self, q: np.ndarray, probe: Optional[np.ndarray]) -> Tuple[np.ndarray, ...]:
+        """(scores, chunk ids, segment no, row in segment) for every candidate row."""
+        all_scores, all_ids, all_seg, all_rows = [], [], [], []
+        for si, s in enumerate(self.segments):
+            n = s.n
+            if n == s.n_dead:
+                continue
+            if probe is not None:
+                rows = np.flatnonzero(probe[s.lists[:n]] & s.alive[:n])
+                scores = s.first_pass(q, rows)
+            elif s.n_dead:
+                rows = np.flatnonzero(s.alive[:n])
+                scores = s.first_pass(q, slice(0, n))[rows]
+            else:
+                rows = np.arange(n)
+                scores = s.first_pass(q, slice(0, n))
+            all_scores.append(np.asarray(scores, dtype=np.float32))
+            all_ids.append(s.chunk_ids[rows])
+            all_seg.append(np.full(len(rows), si, dtype=np.int32))
+            all_rows.append(rows)
+        if not all_scores:
+            return np.zeros(0, np.float32), np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int64)
+        return (np.concatenate(all_scores), np.concatenate(all_ids),
+                np.concatenate(all_seg), np.concatenate(all_rows))
+
+    def _rescore(self, q, scores, ids, segs, rows, n_cand, fetch_exact):
+        if n_cand < len(scores):
+            cand = np.argpartition(-scores, n_cand - 1)[:n_cand]
+            scores, ids, segs, rows = scores[cand], ids[cand], segs[cand], rows[cand]
+        exact = scores.copy()
+        need = []
+        for si in np.unique(segs):
+            seg = self.segments[si]
+            sel = np.flatnonzero(segs == si)
+            if seg.emb is not None:
+                exact[sel] = seg.vectors(rows[sel]) @ q
+            else:
+                need.append(sel)
+        if need and fetch_exact is not None:
+            sel = np.concatenate(need)
+            vecs = fetch_exact([int(c) for c in ids[sel]])
+            for i in sel:
+                v = vecs.get(int(ids[i]))
+                if v is not None:
+                    exact[i] = float(v @ q)
+        return exact, ids
+
+
+def _fetch_exact(db: Session, chunk_ids: Sequence[int]) -> Dict[int, np.ndarray]:
+    rows = db.execute(select(Chunk.id, Chunk.embedding).where(Chunk.id.in_(chunk_ids))).all()
+    return {r.id: np.frombuffer(r.embedding, dtype=np.float32) for r in rows if r.embedding}
+
+
+def _db_signature(db: Session, user_id: int) -> Tuple[int, int]:
+    cnt, mx = db.execute(
+        select(func.count(Chunk.id), func.max(Chunk.id))
+        .join(Document, Chunk.document_id == Document.id)
+        .where(Document.user_id == user_id)
+    ).one()
+    return int(cnt or 0), int(mx or 0)
+
+
+def _load_from_db(db: Session, user_id: int) -> Optional[UserIndex]:
+    rows = db.execute(
+        select(Chunk.id, Chunk.document_id, Chunk.page, Chunk.embedding)
+        .join(Document, Chunk.document_id == Document.id)
+        .where(Document.user_id == user_id)
+        .order_by(Chunk.id)
+    ).all()
+    if not rows:
+        return None
+    dim = len(rows[0].embedding) // 4
+    idx = UserIndex(dim, capacity=len(rows), user_id=user_id)
+    mat = np.frombuffer(b"".join(r.embedding for r in rows), dtype=np.float32).reshape(len(rows), dim)
+    idx.add([r.id for r in rows], [r.document_id for r in rows], [r.page for r in rows], mat)
+    return idx
+
+
+def _load_from_store(db: Session, user_id: int) -> Optional[UserIndex]:
+    segs, dead_docs = vecstore.open_segments(user_id)
+    if not segs:
+        return None
+    idx = UserIndex(segs[0][1].shape[1], user_id=user_id)
+    for _, emb, ids in segs:
+        idx.add_segment(emb, ids)
+    for doc_id in dead_docs:
+        idx.remove_document(int(doc_id))
+    # Drop rows whose chunk rows never committed or were deleted elsewhere
+    idx.retain(np.asarray(db.scalars(
+        select(Chunk.id).join(Document, Chunk.document_id == Document.id).where(Document.user_id == user_id)
+    ).all(), dtype=np.int64))
+    return idx
+
+
+def load_index(db: Session, user_id: int) -> Optional[UserIndex]:
+    idx = _load_from_store(db, user_id) if vecstore.enabled() else _load_from_db(db, user_id)
+    if idx is not None and ann.ANN_ENABLED:
+        idx.attach_ann(ann.load(user_id))
+    return idx
+
+
+class IndexRegistry:
+    """
+    Per-process LRU of UserIndex objects. Indexes are built lazily from the
+    chunks table (or the memmap vecstore) and rebuilt if the DB no longer
+    matches what we hold (e.g. another worker ingested or deleted documents).
+    With pgvector (pgvec.py) nothing is held here: queries go to Postgres.
+    """
+
+    def __init__(self, max_bytes: int = INDEX_MAX_BYTES, idle_seconds: int = INDEX_IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._lru: "OrderedDict[int, UserIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, db: Session, user_id: int) -> Optional[UserIndex]:
+        with self._lock:
+            idx = self._lru.get(user_id)
+        if idx is not None and idx.signature() != _db_signature(db, user_id):
+            idx = None
+        if idx is None:
+            idx = load_index(db, user_id)
+            with self._lock:
+                if idx is None:
+                    self._lru.pop(user_id, None)
+                    return None
+                self._lru[user_id] = idx
+        with self._lock:
+            self._lru.move_to_end(user_id)
+            idx.last_used = time.monotonic()
+            self._evict(keep=user_id)
+        return idx
+
+    def search(self, db: Session, user_id: int, q: np.ndarray, top_k: int) -> List[Tuple[float, int]]:
+        if pgvec.enabled():
+            return pgvec.search(db, user_id, q, top_k)
+        idx = self.get(db, user_id)
+        if idx is None:
+            return []
+        return idx.search(q, top_k, fetch_exact=lambda ids: _fetch_exact(db, ids))
+
+    def score(self, db: Session, user_id: int, q: np.ndarray, chunk_ids: Sequence[int]) -> Dict[int, float]:
+        if pgvec.enabled():
+            return pgvec.score(db, user_id, q, chunk_ids)
+        idx = self.get(db, user_id)
+        if idx is None or not len(chunk_ids):
+            return {}
+        return idx.score(q, chunk_ids, fetch_exact=lambda ids: _fetch_exact(db, ids))
+
+    def vectors(self, db: Session, user_id: int, chunk_ids: Sequence[int]) -> Dict[int, np.ndarray]:
+        if pgvec.enabled():
+            return pgvec.vectors(db, chunk_ids)
+        idx = self.get(db, user_id)
+        if idx is None or not len(chunk_ids):
+            return {}
+        return idx.vectors(chunk_ids, fetch_exact=lambda ids: _fetch_exact(db, ids))
+
+    def write_vectors(self, user_id: int, chunk_ids: Sequence[int], doc_id: int,
+                      pages: Sequence[Optional[int]], embs: np.ndarray) -> Optional[str]:
+        """
+        Persist new vectors to the memmap store (VECTOR_STORE=memmap) before the
+        chunk rows commit; returns the segment name for add_chunks.
+        """
+        if pgvec.enabled() or not vecstore.enabled() or not len(chunk_ids):
+            return None  # pgvector: written with the chunk rows; db: the rows hold the blobs
+        return vecstore.append(user_id, chunk_ids, [doc_id] * len(chunk_ids), pages, embs)
+
+    def add_chunks(self, user_id: int, chunk_ids: Sequence[int], doc_id: int,
+                   pages: Sequence[Optional[int]], embs: np.ndarray, segment: Optional[str] = None):
+        """
+        Add committed chunks to the tenant's index if loaded. Call only after the
+        commit: an index ahead of the DB fails get()'s signature check and is reloaded.
+        """
+        if pgvec.enabled() or not len(chunk_ids):
+            return
+        # Only update tenants we already hold; others get loaded on next ask.
+        with self._lock:
+            idx = self._lru.get(user_id)
+            if idx is None or idx.contains(chunk_ids[0]):
+                return  # not loaded, or (re)loaded after the commit and already has these rows
+            if segment is not None:
+                idx.add_segment(*vecstore.open_segment(user_id, segment))
+            else:
+                idx.add(chunk_ids, [doc_id] * len(chunk_ids), pages, embs)
+            self._evict(keep=user_id)
+
+    def drop_document(self, user_id: int, doc_id: int):
+        with self._lock:
+            idx = self._lru.get(user_id)
+        if idx is not None:
+            idx.remove_document(doc_id)
+        if vecstore.enabled():
+            vecstore.delete_documents(user_id, [doc_id])
+
+    def drop_user(self, user_id: int):
+        with self._lock:
+            self._lru.pop(user_id, None)
+        ann.remove(user_id)
+        vecstore.drop_user(user_id)
+
+    def _evict(self, keep: Optional[int] = None):
+        now = time.monotonic()
+        for uid in [u for u, i in self._lru.items() if u != keep and now - i.last_used > self.idle_seconds]:
+            self._lru.pop(uid, None)
+        total = sum(i.nbytes for i in self._lru.values())
+        while total > self.max_bytes and len(self._lru) > 1:
+            uid = next(iter(self._lru))
+            if uid == keep:
+                self._lru.move_to_end(uid)
+                uid = next(iter(self._lru))
+            total -= self._lru.pop(uid).nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tenants": len(self._lru), "bytes": sum(i.nbytes for i in self._lru.values())}
+
+
+user_indexes = IndexRegistry()
@@ -1,18 +1,33 @@
-import io, os, json
-from typing import Iterable, Tuple, Optional
+import io, os, json, time, threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from typing import Iterable, Iterator, Tuple, Optional, List, Union
 import numpy as np
-from pypdf import PdfReader
-import docx
-from sentence_transformers import SentenceTransformer
-import pytesseract
-from PIL import Image, ImageOps, ImageFilter
+
+from . import embcache, embedders, metrics
+
+# pypdf, python-docx, Pillow, pytesseract and sentence_transformers are imported
+# on first use, so importing this module (API start-up, extract pool workers)
+# stays cheap; the embedder is loaded ahead of the first request by warmup().
 
 TESSERACT_CMD_DEFAULT = "/opt/homebrew/bin/tesseract"
-if os.path.exists(TESSERACT_CMD_DEFAULT):
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_DEFAULT
 
 
-def _preprocess_image(img: Image.Image) -> Image.Image:
+def _tesseract():
+    import pytesseract
+    if os.path.exists(TESSERACT_CMD_DEFAULT):
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD_DEFAULT
+    return pytesseract
+
+
+def _pdf_reader(f):
+    from pypdf import PdfReader
+    return PdfReader(f)
+
+
+def _preprocess_image(img: "Image.Image") -> "Image.Image":
+    from PIL import ImageOps, ImageFilter
     g = ImageOps.grayscale(img)
     g = ImageOps.autocontrast(g)
     g = g.filter(ImageFilter.SHARPEN)
@@ -24,6 +39,7 @@ def _preprocess_image(img: Image.Image) -> Image.Image:
 
 
 def extract_text_image(path: str) -> str:
+    from PIL import Image
     try:
         img = Image.open(path)
     except Exception:
@@ -31,33 +47,59 @@ def extract_text_image(path: str) -> str:
     img = _preprocess_image(img)
     # LSTM engine, assume uniform block of text/table, preserve spaces
     cfg = "--oem 3 --psm 6 -c preserve_interword_spaces=1"
-    return pytesseract.image_to_string(img, config=cfg) or ""
+    return _tesseract().image_to_string(img, config=cfg) or ""
 
 
 EMB_MODEL_NAME = os.getenv("EMB_MODEL", "all-MiniLM-L6-v2")
 _embedder = None
+_embedder_lock = threading.Lock()
 
 
 def get_embedder():
+    """The EMB_BACKEND embedder (embedders.py) for EMB_MODEL, loaded once."""
     global _embedder
     if _embedder is None:
-        _embedder = SentenceTransformer(EMB_MODEL_NAME)
+        with _embedder_lock:  # warmup and a first request may race to load it
+            if _embedder is None:
+                _embedder = embedders.load(EMB_MODEL_NAME)
     return _embedder
 
 
+def embedder_loaded() -> bool:
+    return _embedder is not None
+
+
+def warmup():
+    """Load the embedder and run one encode so the first question doesn't pay for it."""
+    _encode(["warmup"])
+
+
 # -------- extractors --------
 
 def extract_text_pdf(path: str) -> Tuple[str, list]:
-    pages = []
-    with open(path, "rb") as f:
-        reader = PdfReader(f)
-        for i, p in enumerate(reader.pages):
-            pages.append((i + 1, p.extract_text() or ""))
+    pages = extract_pdf_pages(path)
     full = "\n\n".join(t for _, t in pages)
     return full, pages
 
 
+def pdf_page_count(path: str) -> int:
+    with open(path, "rb") as f:
+        return len(_pdf_reader(f).pages)
+
+
+def extract_pdf_pages(path: str, start: int = 0, end: Optional[int] = None) -> list:
+    """[(page_no, text)] for pages[start:end] (0-based, page_no 1-based)."""
+    pages = []
+    with open(path, "rb") as f:
+        reader = _pdf_reader(f)
+        stop = len(reader.pages) if end is None else min(end, len(reader.pages))
+        for i in range(start, stop):
+            pages.append((i + 1, reader.pages[i].extract_text() or ""))
+    return pages
+
+
 def extract_text_docx(path: str) -> str:
+    import docx
     d = docx.Document(path)
     return "\n".join([p.text for p in d.paragraphs])
 
@@ -67,8 +109,9 @@ def extract_text_plain(path: str) -> str:
         return f.read()
 
 
-def _preprocess_image(img: Image.Image) -> Image.Image:
+def _preprocess_image(img: "Image.Image") -> "Image.Image":
     # basic, fast pre-processing for better OCR
+    from PIL import ImageOps, ImageFilter
     g = ImageOps.grayscale(img)
     g = ImageOps.autocontrast(g)
     g = g.filter(ImageFilter.SHARPEN)
@@ -76,13 +119,14 @@ def _preprocess_image(img: Image.Image) -> Image.Image:
 
 
 def extract_text_image(path: str) -> str:
+    from PIL import Image
     try:
         img = Image.open(path)
     except Exception:
         return ""
     img = _preprocess_image(img)
     # You can pass lang="eng" explicitly if you have other languages
-    text = pytesseract.image_to_string(img)  # , lang="eng"
+    text = _tesseract().image_to_string(img)  # , lang="eng"
     return text or ""
 
 
@@ -99,12 +143,142 @@ def chunk_text(text: str, max_tokens: int = 900, overlap: int = 120) -> Iterable
         i += max(step, 1)
 
 
+def chunk_pages(pages: Iterable[Tuple[Optional[int], str]], max_tokens: int = 900,
+                overlap: int = 120) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+    """
+    The same windows chunk_text gives for "\n\n".join(page texts), produced as
+    pages arrive: (text, first page, last page). Only the text not yet fully
+    chunked is kept in memory.
+    """
+    size = max_tokens * 4
+    step = max(size - (overlap * 4), 1)
+    buf, base = "", 0   # buf == full_text[base:]
+    spans = []          # (page, start, end) in full-text offsets
+    i = total = 0
+    seen_text = False   # whitespace-only input becomes a placeholder chunk, as in chunk_extracted
+
+    def window(i):
+        piece = buf[i - base: i - base + size]
+        end = i + len(piece)
+        hit = [pg for pg, s, e in spans if pg is not None and s < end and e > i]
+        return piece, (hit[0] if hit else None), (hit[-1] if hit else None)
+
+    for n, (pg, text) in enumerate(pages):
+        if n:
+            buf += "\n\n"
+            total += 2
+        spans.append((pg, total, total + len(text)))
+        buf += text
+        total += len(text)
+        seen_text = seen_text or bool(text.strip())
+        if not seen_text:
+            continue
+        while i + size <= total:
+            yield window(i)
+            i += step
+        if i > base:
+            buf, base = buf[i - base:], i
+            spans = [sp for sp in spans if sp[2] > i]
+
+    if not seen_text:
+        yield "(No extractable text found)", None, None
+        return
+    while i < total:
+        yield window(i)
+        i += step
+
+
 # -------- embeddings --------
 
+def _encode(texts: List[str]) -> np.ndarray:
+    return get_embedder().encode(texts)  # normalized float32, cosine-ready
+
+
 def embed_texts(texts: Iterable[str]) -> np.ndarray:
-    model = get_embedder()
-    embs = model.encode(list(texts), normalize_embeddings=True)  # cosine-ready
-    return np.array(embs, dtype=np.float32)
+    texts = list(texts)
+    with metrics.stage("embed"):
+        if embcache.EMB_CACHE_ENABLED:
+            return embcache.cached_encode(texts, embedders.cache_tag(EMB_MODEL_NAME), _encode)
+        return _encode(texts)
+
+
+def embed_query(text: str) -> np.ndarray:
+    """One question vector, served from the in-process LRU when seen before."""
+    with metrics.stage("embed"):
+        key = embcache.text_key(text)
+        vec = embcache.query_cache.get(key)
+        if vec is None:
+            vec = query_batcher.encode(text)
+            embcache.query_cache.put(key, vec)
+    return vec
+
+
+# -------- micro-batching for concurrent queries --------
+
+EMB_BATCH_MAX = int(os.getenv("EMB_BATCH_MAX", "32"))
+EMB_BATCH_WAIT_MS = float(os.getenv("EMB_BATCH_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    """
+    Collects single-text encode requests arriving within max_wait_ms of each
+    other into one model.encode call and hands each caller its own row.
+    max_batch <= 1 disables batching (callers encode directly).
+    """
+
+    def __init__(self, encode=_encode, max_batch: int = EMB_BATCH_MAX, max_wait_ms: float = EMB_BATCH_WAIT_MS):
+        self._encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []  # [(text, Future, enqueued_at)]
+        self._cv = threading.Condition()
+        self._thread = None
+
+    def encode(self, text: str) -> np.ndarray:
+        if self.max_batch <= 1:
+            return self._encode([text])[0]
+        return self.submit(text).result()
+
+    def submit(self, text: str) -> Future:
+        fut = Future()
+        with self._cv:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append((text, fut, time.monotonic()))
+            metrics.EMBED_QUEUE_DEPTH.set(len(self._pending))
+            self._cv.notify()
+        return fut
+
+    def _take(self):
+        with self._cv:
+            while not self._pending:
+                self._cv.wait()
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cv.wait(left)
+            batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch:]
+            metrics.EMBED_QUEUE_DEPTH.set(len(self._pending))
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take()
+            try:
+                embs = self._encode([t for t, _, _ in batch])
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            for i, (_, fut, _) in enumerate(batch):
+                fut.set_result(embs[i])
+            metrics.EMBED_BATCH_SIZE.observe(len(batch))
+
+
+query_batcher = MicroBatcher()
 
 
 # -------- controller --------
@@ -112,43 +286,299 @@ def embed_texts(texts: Iterable[str]) -> np.ndarray:
 IMAGE_EXTS = {"png", "jpg", "jpeg", "webp", "bmp", "tif", "tiff"}
 
 
-def extract_and_chunk(path: str, filename: str):
+def extract_text(path: str, filename: str) -> Tuple[str, Optional[list]]:
+    """(full text, [(page_no, text)] for PDFs else None)."""
     ext = filename.lower().rsplit(".", 1)[-1]
-    pages_meta = None
-
     if ext == "pdf":
-        full, pages = extract_text_pdf(path)
-        pages_meta = pages
-        text = full
+        return extract_text_pdf(path)
     elif ext in ("docx",):
-        text = extract_text_docx(path)
+        return extract_text_docx(path), None
     elif ext in IMAGE_EXTS:
-        text = extract_text_image(path)
+        return extract_text_image(path), None
     else:
-        text = extract_text_plain(path)
+        return extract_text_plain(path), None
+
+
+def extract_and_chunk(path: str, filename: str):
+    text, pages_meta = extract_text(path, filename)
+    chunks, page_map, page_ends = chunk_extracted(text, pages_meta)
+    embeddings = embed_texts(chunks)
+    return chunks, embeddings, page_map, page_ends
+
 
+def chunk_extracted(text: str, pages_meta: Optional[list]) -> Tuple[List[str], list, list]:
+    """(chunks, first page, last page) per chunk; pages are None for images/docs."""
     # Guard against empty OCR/plain results to avoid empty chunk embeddings
     if not text.strip():
         text = "(No extractable text found)"
+    out = list(chunk_pages(pages_meta if pages_meta else [(None, text)]))
+    return [c for c, _, _ in out], [p for _, p, _ in out], [e for _, _, e in out]
 
-    chunks = list(chunk_text(text))
-    embeddings = embed_texts(chunks)
 
-    # crude page mapping (PDF only); images/docs return None
-    page_map = []
-    if pages_meta:
-        offsets = []
-        total = 0
-        for (pg, t) in pages_meta:
-            offsets.append((pg, total, total + len(t)))
-            total += len(t) + 2  # \n\n between pages
-        size = 900 * 4
-        step = size - (120 * 4)
-        for i, ch in enumerate(chunks):
-            idx = i * step
-            pg = next((pg for (pg, s, e) in offsets if s <= idx < e), None)
-            page_map.append(pg)
-    else:
-        page_map = [None] * len(chunks)
+# -------- streaming pipeline (large PDFs) --------
 
-    return chunks, embeddings, page_map
+# PDFs with at least this many pages are ingested page by page: extract ->
+# chunk -> embed INGEST_EMBED_BATCH chunks -> commit, so memory stays bounded
+# and chunks become searchable while the rest of the file is still being read.
+STREAM_MIN_PAGES = int(os.getenv("STREAM_MIN_PAGES", "50"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+
+
+def should_stream(path: str, filename: str) -> bool:
+    if filename.lower().rsplit(".", 1)[-1] != "pdf":
+        return False
+    try:
+        return pdf_page_count(path) >= STREAM_MIN_PAGES
+    except Exception:
+        return False  # let the regular path report the parse error
+
+
+def iter_pages(path: str, filename: str) -> Iterator[Tuple[Optional[int], str]]:
+    """(page_no, text) in order; PDF page ranges are read ahead on the extract pool."""
+    if filename.lower().rsplit(".", 1)[-1] != "pdf":
+        text, _ = extract_text(path, filename)
+        yield None, text
+        return
+    pool = get_extract_pool()
+    if pool is None:
+        with open(path, "rb") as f:
+            for i, page in enumerate(_pdf_reader(f).pages):
+                yield i + 1, page.extract_text() or ""
+        return
+    starts = iter(range(0, pdf_page_count(path), PDF_PAGES_PER_TASK))
+    ahead = deque()
+    for s in starts:
+        ahead.append(pool.submit(extract_pdf_pages, path, s, s + PDF_PAGES_PER_TASK))
+        if len(ahead) >= EXTRACT_WORKERS:
+            break
+    while ahead:
+        try:
+            with metrics.stage("extract"):
+                pages = ahead[0].result(timeout=EXTRACT_TIMEOUT)
+            ahead.popleft()
+        except FutureTimeout:
+            _retire_extract_pool(pool, ahead)  # includes the timed-out range
+            raise TimeoutError(f"page range took longer than {EXTRACT_TIMEOUT:.0f}s")
+        s = next(starts, None)
+        if s is not None:
+            ahead.append(pool.submit(extract_pdf_pages, path, s, s + PDF_PAGES_PER_TASK))
+        yield from pages
+
+
+def iter_embedded_batches(path: str, filename: str, batch_size: int = INGEST_EMBED_BATCH, skip: int = 0):
+    """
+    Yield (chunks, embeddings, pages, page_ends) batches for one file. The first
+    `skip` chunks (already stored by an earlier attempt) are chunked but not embedded.
+    """
+    batch = []
+    for n, item in enumerate(chunk_pages(iter_pages(path, filename))):
+        if n < skip:
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield _embed_batch(batch)
+            batch = []
+    if batch:
+        yield _embed_batch(batch)
+
+
+def _embed_batch(batch):
+    texts = [c for c, _, _ in batch]
+    return texts, embed_texts(texts), [p for _, p, _ in batch], [e for _, _, e in batch]
+
+
+# -------- parallel extraction --------
+
+# OCR and PDF parsing are CPU-bound; batches are spread over a process pool and
+# large PDFs are split into page ranges. 0 workers = extract in-process.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+# Seconds per file; a batch of files gets one deadline, EXTRACT_TIMEOUT per round of EXTRACT_WORKERS files
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "600"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+class _TrackedContext:
+    """The spawn context, remembering the worker processes it starts so their pool can be terminated."""
+
+    def __init__(self):
+        # spawn: the parent runs threads (ingest workers, torch) that don't survive fork
+        self._ctx = multiprocessing.get_context("spawn")
+        self.processes = []
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+    def Process(self, *args, **kwargs):
+        proc = self._ctx.Process(*args, **kwargs)
+        self.processes.append(proc)
+        return proc
+
+
+class ExtractPool:
+    """
+    A process pool shared by the ingest workers. When a file times out the pool
+    is retired: work not yet started moves to a fresh pool, the files other
+    threads still have running here finish, and only then are its (stuck)
+    workers terminated. Callers get their own Future, which survives the move.
+    """
+
+    def __init__(self, workers: int = EXTRACT_WORKERS):
+        self._ctx = _TrackedContext()
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=self._ctx)
+        self._lock = threading.Lock()
+        self._tasks = {}  # executor future -> (caller's future, fn, args)
+        self._retired = self._closed = False
+
+    def submit(self, fn, *args) -> Future:
+        fut = Future()
+        self._start(fut, fn, args)
+        return fut
+
+    def _start(self, fut: Future, fn, args):
+        inner = self._executor.submit(fn, *args)
+        with self._lock:
+            self._tasks[inner] = (fut, fn, args)
+        inner.add_done_callback(self._done)
+
+    def _done(self, inner: Future):
+        with self._lock:
+            task = self._tasks.pop(inner, None)
+            idle = self._retired and not self._tasks
+        # cancelled = moved to another pool by retire()
+        if task is not None and not inner.cancelled():
+            try:
+                if inner.exception() is None:
+                    task[0].set_result(inner.result())
+                else:
+                    task[0].set_exception(inner.exception())
+            except InvalidStateError:  # the caller cancelled it
+                pass
+        if idle:
+            self._terminate()
+
+    def retire(self, abandoned: Iterable[Future], successor: Optional["ExtractPool"]):
+        """Give up on `abandoned` (callers' futures that timed out) and close this pool once the rest is done."""
+        abandoned = set(abandoned)
+        with self._lock:
+            self._retired = True
+            tasks = list(self._tasks.items())
+        for inner, (fut, fn, args) in tasks:
+            if fut in abandoned:
+                fut.cancel()
+                inner.cancel()  # no-op once it runs: the worker goes down with the pool
+                with self._lock:
+                    self._tasks.pop(inner, None)
+            elif successor is not None and inner.cancel():  # not handed to a worker yet
+                successor._start(fut, fn, args)
+        with self._lock:
+            idle = not self._tasks
+        if idle:
+            self._terminate()
+
+    def _terminate(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for proc in self._ctx.processes:
+            if proc.is_alive():
+                proc.terminate()
+
+
+_extract_pool: Optional[ExtractPool] = None
+_extract_pool_lock = threading.Lock()
+
+
+def get_extract_pool() -> Optional[ExtractPool]:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None and EXTRACT_WORKERS > 0:
+            _extract_pool = ExtractPool()
+        return _extract_pool
+
+
+def _retire_extract_pool(pool: ExtractPool, abandoned: Iterable[Future]):
+    """New work goes to a fresh pool; `pool` closes once the other files on it are done."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    pool.retire(abandoned, get_extract_pool())
+
+
+def extract_many(items: List[Tuple[str, str]]) -> List[Union[Tuple[str, Optional[list]], Exception]]:
+    """
+    Extract [(path, filename)] in parallel. Returns, per item, (text, pages_meta)
+    or the exception that item failed with (including a TimeoutError).
+    """
+    pool = get_extract_pool()
+    if pool is None:
+        out = []
+        for path, filename in items:
+            try:
+                out.append(extract_text(path, filename))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    # one deadline for the whole batch, counted from submission rather than from each file's turn
+    budget = EXTRACT_TIMEOUT * -(-len(items) // EXTRACT_WORKERS)
+    deadline = time.monotonic() + budget
+    tasks = []
+    for path, filename in items:
+        try:
+            if filename.lower().rsplit(".", 1)[-1] == "pdf":
+                n = pdf_page_count(path)
+                futs = [pool.submit(extract_pdf_pages, path, s, s + PDF_PAGES_PER_TASK)
+                        for s in range(0, max(n, 1), PDF_PAGES_PER_TASK)]
+                tasks.append(("pdf", futs))
+            else:
+                tasks.append(("file", [pool.submit(extract_text, path, filename)]))
+        except Exception as e:
+            tasks.append(("error", e))
+
+    out, abandoned = [], []
+    for kind, futs in tasks:
+        if kind == "error":
+            out.append(futs)
+            continue
+        try:
+            parts = [f.result(timeout=max(0.0, deadline - time.monotonic())) for f in futs]
+        except FutureTimeout:
+            abandoned.extend(futs)
+            out.append(TimeoutError(f"extraction did not finish within {budget:.0f}s"))
+            continue
+        except Exception as e:
+            out.append(e)
+            continue
+        if kind == "pdf":
+            pages = [p for part in parts for p in part]
+            out.append(("\n\n".join(t for _, t in pages), pages))
+        else:
+            out.append(parts[0])
+    if abandoned:
+        _retire_extract_pool(pool, abandoned)
+    return out
+
+
+def extract_and_chunk_many(items: List[Tuple[str, str]]):
+    """
+    Batch version of extract_and_chunk: parallel extraction, then a single
+    shared embedding pass. Returns per item (chunks, embeddings, page_map,
+    page_ends) or the exception it failed with.
+    """
+    with metrics.stage("extract"):
+        extracted = extract_many(items)
+    with metrics.stage("chunk"):
+        chunked = [r if isinstance(r, Exception) else chunk_extracted(*r) for r in extracted]
+    all_chunks = [c for r in chunked if not isinstance(r, Exception) for c in r[0]]
+    embs = embed_texts(all_chunks) if all_chunks else np.zeros((0, 0), dtype=np.float32)
+    out, pos = [], 0
+    for r in chunked:
+        if isinstance(r, Exception):
+            out.append(r)
+            continue
+        chunks, page_map, page_ends = r
+        out.append((chunks, embs[pos: pos + len(chunks)], page_map, page_ends))
+        pos += len(chunks)
+    return out
@@ -0,0 +1,392 @@
+import os, time, threading, traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import numpy as np
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .models import Document, Chunk, IngestJob
+from .ingest import extract_and_chunk_many, should_stream, iter_embedded_batches, pdf_page_count
+from .index import user_indexes
+from . import answer_cache, metrics, pgvec, revenue, vecstore
+
+# Ingestion runs off the request path: uploads create a pending Document plus
+# an IngestJob row, and a pool of worker threads drains the table. The table
+# is the queue, so jobs survive restarts and can be shared by several processes.
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # 0 = ingest inline in the request
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "1.0"))
+# Jobs a worker claims at once; their files are extracted in parallel (ingest.extract_many)
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "16"))
+# A job left "running" this long (e.g. the process died) is handed out again
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "1800"))
+# How often a worker looks for such jobs
+INGEST_REQUEUE_SECONDS = float(os.getenv("INGEST_REQUEUE_SECONDS", "60"))
+# How often running jobs refresh updated_at while extraction or embedding blocks, so they never look stale
+INGEST_HEARTBEAT_SECONDS = float(os.getenv("INGEST_HEARTBEAT_SECONDS", "30"))
+# Chunk rows per multi-row INSERT statement
+CHUNK_INSERT_BATCH = int(os.getenv("CHUNK_INSERT_BATCH", "500"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _set(db: Session, job: Optional[IngestJob], **values):
+    if job is None:
+        return
+    values["updated_at"] = _now()
+    db.execute(update(IngestJob).where(IngestJob.id == job.id).values(**values))
+    db.commit()
+
+
+@contextmanager
+def _heartbeat(jobs: List[Optional[IngestJob]]):
+    """Touch the jobs' updated_at from a side thread while the body runs."""
+    job_ids = [job.id for job in jobs if job is not None]
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(INGEST_HEARTBEAT_SECONDS):
+            db = SessionLocal()
+            try:
+                db.execute(update(IngestJob)
+                           .where(IngestJob.id.in_(job_ids), IngestJob.status == "running")
+                           .values(updated_at=_now()))
+                db.commit()
+            except Exception as e:  # a missed beat is harmless well before INGEST_STALE_SECONDS
+                traceback.print_exception(e)
+            finally:
+                db.close()
+
+    t = threading.Thread(target=beat, name="ingest-heartbeat", daemon=True)
+    t.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        t.join()
+
+
+# --------------------------- ingestion ---------------------------
+
+def _begin(db: Session, doc: Document, job: Optional[IngestJob]):
+    doc.status = "processing"
+    db.commit()
+    _set(db, job, stage="extract", progress=0.1)
+
+
+def bulk_insert_chunks(db: Session, rows: List[dict]) -> List[int]:
+    """Core multi-row INSERT ... RETURNING id, in batches; ids come back in row order."""
+    ids = []
+    stmt = insert(Chunk).returning(Chunk.id, sort_by_parameter_order=True)
+    for s in range(0, len(rows), CHUNK_INSERT_BATCH):
+        ids.extend(db.scalars(stmt, rows[s: s + CHUNK_INSERT_BATCH]).all())
+    return ids
+
+
+def _insert_chunks(db: Session, doc: Document, start: int, chunks, embs, pages, page_ends=None) -> bool:
+    """Add chunks at positions start.. and index them; commits. False if the document is gone."""
+    # The document may have been deleted while we were extracting
+    if db.scalar(select(Document.id).where(Document.id == doc.id)) is None:
+        return False
+    pages = pages or [None] * len(chunks)
+    page_ends = page_ends or pages
+    in_store = vecstore.enabled() or pgvec.enabled()  # vectors go to the store, not the DB blob
+    rows = [{"document_id": doc.id, "position": start + i, "text": text,
+             "embedding": b"" if in_store else emb.tobytes(), "page": pages[i], "page_end": page_ends[i]}
+            for i, (text, emb) in enumerate(zip(chunks, embs))]
+    if pgvec.enabled():
+        for row, emb in zip(rows, embs):
+            row["vec"] = emb
+    with metrics.stage("db_write"):
+        chunk_ids = bulk_insert_chunks(db, rows)
+        # write the vector segment before the chunk rows become visible to other workers
+        segment = user_indexes.write_vectors(doc.user_id, chunk_ids, doc.id, pages, embs)
+        revenue.add_chunks(db, doc.user_id, doc.id, chunk_ids, chunks, pages)
+        answer_cache.bump_corpus_version(db, doc.user_id)
+        db.commit()
+    # the loaded index only learns about rows that committed, so it never runs ahead of the DB
+    user_indexes.add_chunks(doc.user_id, chunk_ids, doc.id, pages, embs, segment=segment)
+    return True
+
+
+def _finish(db: Session, doc: Document, job: Optional[IngestJob]):
+    doc.status = "ready"
+    db.commit()
+    _set(db, job, status="done", stage="done", progress=1.0, error=None)
+
+
+def _store(db: Session, doc: Document, job: Optional[IngestJob], chunks, embs, pages, page_ends=None):
+    _set(db, job, stage="index", progress=0.8)
+    if _insert_chunks(db, doc, 0, chunks, embs, pages, page_ends):
+        _finish(db, doc, job)
+
+
+def _stream(db: Session, doc: Document, job: Optional[IngestJob]):
+    """
+    Large PDFs: extract, embed and commit INGEST_EMBED_BATCH chunks at a time.
+    Committed chunks are searchable right away; a retry resumes after them.
+    """
+    done = db.scalar(select(func.count(Chunk.id)).where(Chunk.document_id == doc.id)) or 0
+    n_pages = max(pdf_page_count(doc.path), 1)
+    _set(db, job, stage="stream")
+    for chunks, embs, pages, page_ends in iter_embedded_batches(doc.path, doc.filename, skip=done):
+        if not _insert_chunks(db, doc, done, chunks, embs, pages, page_ends):
+            return
+        done += len(chunks)
+        last = max((p for p in page_ends if p is not None), default=0)
+        _set(db, job, progress=round(0.1 + 0.85 * last / n_pages, 3))
+    _finish(db, doc, job)
+
+
+def _reusable(db: Session, doc: Document):
+    """
+    (chunks, embeddings, pages, page_ends) copied from an already ingested Document with
+    the same bytes and file type (any user), or None.
+    """
+    if not doc.sha256:
+        return None
+    ext = doc.filename.lower().rsplit(".", 1)[-1]
+    donors = db.scalars(
+        select(Document).where(Document.sha256 == doc.sha256, Document.id != doc.id, Document.status == "ready")
+    ).all()
+    for donor in donors:
+        if donor.filename.lower().rsplit(".", 1)[-1] != ext:
+            continue
+        rows = db.execute(
+            select(Chunk.id, Chunk.text, Chunk.page, Chunk.page_end, Chunk.embedding)
+            .where(Chunk.document_id == donor.id).order_by(Chunk.position)
+        ).all()
+        if not rows:
+            continue
+        if all(r.embedding for r in rows):
+            embs = np.frombuffer(b"".join(r.embedding for r in rows), dtype=np.float32).reshape(len(rows), -1)
+        else:
+            vecs = (pgvec.vectors(db, [r.id for r in rows]) if pgvec.enabled()
+                    else vecstore.document_vectors(donor.user_id, donor.id))
+            if any(r.id not in vecs for r in rows):
+                continue
+            embs = np.stack([vecs[r.id] for r in rows])
+        return [r.text for r in rows], embs, [r.page for r in rows], [r.page_end for r in rows]
+    return None
+
+
+# --------------------------- queue ---------------------------
+
+def enqueue(db: Session, doc: Document) -> IngestJob:
+    job = IngestJob(document_id=doc.id, user_id=doc.user_id, status="pending", stage="queued",
+                    max_attempts=INGEST_MAX_ATTEMPTS, run_after=_now())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    pool.wake()
+    return job
+
+
+def submit(db: Session, doc: Document) -> Document:
+    """Queue a freshly stored document, or ingest it inline when no workers run."""
+    return submit_many(db, [doc])[0]
+
+
+def submit_many(db: Session, docs: List[Document]) -> List[Document]:
+    job_ids = []
+    for doc in docs:
+        doc.status = "pending"
+        db.commit()
+        job_ids.append(enqueue(db, doc).id)
+    if not pool.running:
+        # no worker will pick up a retry: use up the attempts here (without the backoff),
+        # so the caller gets "ready" or "failed" rather than a job nobody runs
+        while job_ids:
+            run_jobs(job_ids)
+            job_ids = db.scalars(
+                select(IngestJob.id).where(IngestJob.id.in_(job_ids), IngestJob.status == "pending")
+            ).all()
+        for doc in docs:
+            db.refresh(doc)
+    return docs
+
+
+def claim(db: Session) -> Optional[int]:
+    """Atomically move the oldest runnable job to running; safe across processes."""
+    now = _now()
+    for _ in range(5):
+        job_id = db.scalar(
+            select(IngestJob.id)
+            .where(IngestJob.status == "pending", IngestJob.run_after <= now)
+            .order_by(IngestJob.id).limit(1)
+        )
+        if job_id is None:
+            return None
+        res = db.execute(
+            update(IngestJob)
+            .where(IngestJob.id == job_id, IngestJob.status == "pending")
+            .values(status="running", attempts=IngestJob.attempts + 1, updated_at=now)
+        )
+        db.commit()
+        if res.rowcount == 1:
+            return job_id
+    return None
+
+
+def requeue_stale(db: Session):
+    cutoff = _now() - timedelta(seconds=INGEST_STALE_SECONDS)
+    db.execute(
+        update(IngestJob)
+        .where(IngestJob.status == "running", IngestJob.updated_at < cutoff)
+        .values(status="pending", stage="queued", run_after=_now())
+    )
+    db.commit()
+
+
+def claim_many(db: Session, limit: int = INGEST_BATCH) -> List[int]:
+    out = []
+    while len(out) < limit:
+        job_id = claim(db)
+        if job_id is None:
+            break
+        out.append(job_id)
+    return out
+
+
+def _fail(db: Session, job: IngestJob, doc: Document, e: Exception):
+    db.rollback()
+    retry = job.attempts < job.max_attempts
+    _set(db, job,
+         status="pending" if retry else "failed",
+         stage="retrying" if retry else "failed",
+         error=f"{type(e).__name__}: {e}",
+         run_after=_now() + timedelta(seconds=2 ** job.attempts))
+    if not retry:
+        db.execute(update(Document).where(Document.id == doc.id).values(status="failed"))
+        db.commit()
+
+
+def run_jobs(job_ids: List[int]):
+    """Reuse known files, batch the ordinary ones, then stream the large PDFs one by one."""
+    db = SessionLocal()
+    try:
+        work, streams = [], []
+        for job_id in job_ids:
+            job = db.get(IngestJob, job_id)
+            doc = db.get(Document, job.document_id) if job else None
+            if doc is None:
+                if job is not None:
+                    _set(db, job, status="failed", error="document deleted")
+                continue
+            try:
+                if job.status == "pending":  # inline mode never went through claim()
+                    _set(db, job, status="running", attempts=job.attempts + 1)
+                    db.refresh(job)
+                _begin(db, doc, job)
+            except Exception as e:  # e.g. "database is locked" while an upload commits
+                traceback.print_exception(e)
+                _fail(db, job, doc, e)
+                continue
+            try:
+                reused = _reusable(db, doc)
+                if reused is not None:
+                    _store(db, doc, job, *reused)
+                    continue
+            except Exception as e:
+                traceback.print_exception(e)
+                db.rollback()
+            (streams if should_stream(doc.path, doc.filename) else work).append((job, doc))
+
+        _run_batch(db, work)
+        for job, doc in streams:
+            try:
+                with _heartbeat([job]):
+                    _stream(db, doc, job)
+            except Exception as e:
+                traceback.print_exception(e)
+                _fail(db, job, doc, e)
+    finally:
+        db.close()
+
+
+def _run_batch(db: Session, work):
+    """Extract the files in parallel, embed them in one pass, then store each."""
+    if not work:
+        return
+
+    try:
+        with _heartbeat([job for job, _ in work]):
+            results = extract_and_chunk_many([(doc.path, doc.filename) for _, doc in work])
+    except Exception as e:  # shared embedding step failed: every job retries
+        traceback.print_exc()
+        for job, doc in work:
+            _fail(db, job, doc, e)
+        return
+
+    for (job, doc), res in zip(work, results):
+        try:
+            if isinstance(res, Exception):
+                raise res
+            _store(db, doc, job, *res)
+        except Exception as e:
+            traceback.print_exception(e)
+            _fail(db, job, doc, e)
+
+
+class IngestWorkerPool:
+    def __init__(self):
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self, workers: int = INGEST_WORKERS):
+        if workers <= 0 or self.running:
+            return
+        db = SessionLocal()
+        try:
+            requeue_stale(db)
+        finally:
+            db.close()
+        self._stop.clear()
+        for i in range(workers):
+            t = threading.Thread(target=self._loop, name=f"ingest-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        last_requeue = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                db = SessionLocal()
+                try:
+                    # jobs orphaned by a crashed worker (here or in another process) go back to the queue
+                    if time.monotonic() - last_requeue >= INGEST_REQUEUE_SECONDS:
+                        requeue_stale(db)
+                        last_requeue = time.monotonic()
+                    job_ids = claim_many(db)
+                finally:
+                    db.close()
+                if job_ids:
+                    run_jobs(job_ids)
+                    continue
+            except Exception as e:  # keep the worker alive; unfinished jobs are requeued once stale
+                traceback.print_exception(e)
+            self._wake.wait(INGEST_POLL_SECONDS)
+            self._wake.clear()
+
+
+pool = IngestWorkerPool()
@@ -1,11 +1,26 @@
-import os
-from groq import Groq
-from typing import List, Dict
+import os, time, random, asyncio
+import httpx
+from groq import Groq, AsyncGroq, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+from typing import List, Dict, AsyncIterator, Optional
+
+from . import admission, metrics, packer
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192")
 
+# Async client settings
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))           # seconds per attempt
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))          # base seconds, doubled per retry
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))     # in-flight completions per process
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "64"))         # shared HTTP connections
+
+_RETRYABLE = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
 _client = None
+_async_client = None
+_http_client = None
+_llm_sem = None
 
 
 def get_client():
@@ -15,6 +30,52 @@ def get_client():
     return _client
 
 
+def get_async_client() -> AsyncGroq:
+    global _async_client, _http_client
+    if _async_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        )
+        # retries are ours (with backoff, outside the semaphore), not the SDK's
+        _async_client = AsyncGroq(api_key=GROQ_API_KEY, http_client=_http_client,
+                                  timeout=LLM_TIMEOUT, max_retries=0)
+    return _async_client
+
+
+async def aclose_client():
+    global _async_client, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _async_client = _http_client = None
+
+
+async def warmup_async():
+    """Open a pooled keep-alive connection to Groq ahead of the first question."""
+    await get_async_client().models.list()
+
+
+def _record_usage(usage, out: Optional[Dict] = None):
+    if usage is None:
+        return
+    prompt, completion = getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    metrics.add_tokens(prompt, completion)
+    if out is not None:
+        out.update(prompt_tokens=prompt, completion_tokens=completion,
+                   total_tokens=getattr(usage, "total_tokens", None))
+
+
+def _semaphore() -> asyncio.Semaphore:
+    global _llm_sem
+    if _llm_sem is None:
+        _llm_sem = asyncio.Semaphore(LLM_CONCURRENCY)
+    return _llm_sem
+
+
+async def _backoff(attempt: int):
+    await asyncio.sleep(LLM_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+
+
 SYSTEM_PROMPT = """You are Business AI, a retrieval-augmented assistant.
 Use ONLY the text in the provided Context to answer. Do NOT use outside knowledge.
 If the Context does not contain the answer, clearly say you don’t have enough information.
@@ -55,55 +116,121 @@ Context: <chunked snippets with tags such as (Doc id:page) and metadata (filenam
 Use only that Context to answer the user’s Question, following the rules above."""
 
 
-def build_context(chunks: List[Dict]) -> str:
-    blocks = []
-    for c in chunks:
-        tag = f"(Doc {c['document_id']}:{c.get('page') or '?'})"
-        blocks.append(f"{tag}\n{c['text']}")
-    return "\n\n".join(blocks)
-
-
-def answer_with_groq(question: str, chunks: List[Dict], history: List[Dict] | None = None) -> str:
-    client = get_client()
-    context = build_context(chunks)
+def build_context(chunks: List[Dict], question: str = "", max_tokens: int = packer.CONTEXT_MAX_TOKENS) -> str:
+    """Chunks packed into max_tokens: overlapping neighbours merged, overflow trimmed (packer.py)."""
+    context, report = packer.pack_context(question, chunks, max_tokens)
+    metrics.add_context_tokens(report["tokens"], report["saved_tokens"])
+    return context
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
 
+def _history_turns(history) -> List[Dict]:
+    turns = []
     # Accept history as list of dicts or Pydantic models
-    if history:
-        for m in history[-8:]:
-            # pydantic v2 model -> dict
-            if hasattr(m, "model_dump"):
-                m = m.model_dump()
-            # pydantic v1 model -> dict
-            elif hasattr(m, "dict"):
-                m = m.dict()
-            # now try to read role/content
-            role = m.get("role") if isinstance(m, dict) else getattr(m, "role", None)
-            content = (m.get("content") if isinstance(m, dict) else getattr(m, "content", None)) or ""
-            content = content.strip()
-            if role in ("user", "assistant") and content:
-                messages.append({"role": role, "content": content})
-
+    for m in (history or [])[-8:]:
+        # pydantic v2 model -> dict
+        if hasattr(m, "model_dump"):
+            m = m.model_dump()
+        # pydantic v1 model -> dict
+        elif hasattr(m, "dict"):
+            m = m.dict()
+        # now try to read role/content
+        role = m.get("role") if isinstance(m, dict) else getattr(m, "role", None)
+        content = (m.get("content") if isinstance(m, dict) else getattr(m, "content", None)) or ""
+        content = content.strip()
+        if role in ("user", "assistant") and content:
+            turns.append({"role": role, "content": content})
+    return turns
+
+
+def build_messages(question: str, chunks: List[Dict], history: List[Dict] | None = None,
+                   model: str = GROQ_MODEL) -> List[Dict]:
+    """
+    System prompt, the history turns that fit, then context + question. History
+    may take HISTORY_SHARE of the model's budget; context gets the rest, up to
+    CONTEXT_MAX_TOKENS.
+    """
+    budget = packer.budget_for(model, packer.estimate_tokens(SYSTEM_PROMPT) + packer.estimate_tokens(question) + 16)
+    turns = packer.fit_history(_history_turns(history), int(budget * packer.HISTORY_SHARE))
+    budget -= sum(packer.estimate_tokens(m["content"]) + 4 for m in turns)
+    with metrics.stage("pack"):
+        context = build_context(chunks, question, min(budget, packer.CONTEXT_MAX_TOKENS))
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + turns
     messages.append({
         "role": "user",
         "content": f"Context:\n{context}\n\nQuestion: {question}"
     })
+    return messages
+
 
+def answer_with_groq(question: str, chunks: List[Dict], history: List[Dict] | None = None) -> str:
+    client = get_client()
+    messages = build_messages(question, chunks, history)
     resp = client.chat.completions.create(model=GROQ_MODEL, messages=messages, temperature=0.2)
     return resp.choices[0].message.content.strip()
 
 
 def stream_answer_with_groq(question, chunks, history=None):
     client = get_client()
-    context = build_context(chunks)
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    if history:
-        for m in history[-8:]:
-            messages.append({"role": m["role"], "content": m["content"]})
-    messages.append({"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"})
+    messages = build_messages(question, chunks, history)
     stream = client.chat.completions.create(model=GROQ_MODEL, messages=messages, stream=True, temperature=0.2)
     for event in stream:
         delta = getattr(getattr(event, "choices", [None])[0], "delta", None)
         if delta and getattr(delta, "content", None):
             yield delta.content
+
+
+# --------------------------- async ---------------------------
+
+async def answer_with_groq_async(question: str, chunks: List[Dict], history: List[Dict] | None = None) -> str:
+    client = get_async_client()
+    messages = build_messages(question, chunks, history)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with admission.async_stage("llm", _semaphore(), need=admission.LLM_MIN_SECONDS):
+                with metrics.stage("llm_total"):  # not streamed: the first token comes with the last
+                    resp = await client.chat.completions.create(model=GROQ_MODEL, messages=messages, temperature=0.2,
+                                                                timeout=admission.timeout(LLM_TIMEOUT))
+            _record_usage(getattr(resp, "usage", None))
+            return resp.choices[0].message.content.strip()
+        except _RETRYABLE:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+        await _backoff(attempt)
+
+
+async def stream_answer_with_groq_async(question, chunks, history=None,
+                                        usage: Optional[Dict] = None) -> AsyncIterator[str]:
+    """
+    Token stream; a failed attempt is retried only if nothing was yielded yet.
+    If given, `usage` is filled with the token counts Groq reports at the end.
+    """
+    client = get_async_client()
+    messages = build_messages(question, chunks, history)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        sent = False
+        try:
+            async with admission.async_stage("llm", _semaphore(), need=admission.LLM_MIN_SECONDS):
+                t0 = time.perf_counter()
+                stream = await client.chat.completions.create(model=GROQ_MODEL, messages=messages, stream=True,
+                                                              temperature=0.2, timeout=admission.timeout(LLM_TIMEOUT))
+                try:
+                    async for event in stream:
+                        # Groq reports usage on the last chunk under x_groq
+                        _record_usage(getattr(getattr(event, "x_groq", None), "usage", None), usage)
+                        delta = getattr(getattr(event, "choices", [None])[0], "delta", None)
+                        if delta and getattr(delta, "content", None):
+                            if not sent:
+                                metrics.record("llm_ttft", time.perf_counter() - t0)
+                            sent = True
+                            yield delta.content
+                finally:
+                    # a consumer that stops early (client disconnect) must not leave the completion
+                    # running upstream; shielded so a cancelled caller still closes the connection
+                    await asyncio.shield(stream.close())
+                metrics.record("llm_total", time.perf_counter() - t0)
+            return
+        except _RETRYABLE:
+            if sent or attempt == LLM_MAX_RETRIES:
+                raise
+        await _backoff(attempt)
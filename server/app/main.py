@@ -1,29 +1,126 @@
-import os
+import os, json, asyncio, traceback
+import anyio
+from contextlib import asynccontextmanager
 from typing import List, Dict, Optional, Tuple
 import numpy as np
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import select, delete
 from mimetypes import guess_type
 
-from .db import Base, engine
-from .models import User, Document, Chunk
-from .schemas import RegisterIn, LoginIn, DocumentOut, AskIn, AskOut, DeleteAccountIn
-from .utils import (
-    hash_password, verify_password,
-    extract_revenue_records, resolve_week_range, aggregate_week
+from .db import Base, SessionLocal, engine, ensure_columns, ensure_indexes
+from .models import User, Document, Chunk, IngestJob
+from .schemas import (
+    RegisterIn, LoginIn, DocumentOut, AskIn, AskOut, DeleteAccountIn, JobOut, DocumentStatusOut
 )
+from .utils import hash_password, verify_password, resolve_week_range, aggregate_week, mmr_select
 from .auth import create_token, get_current_user, get_db
-from .ingest import extract_and_chunk, embed_texts
-from .llm import answer_with_groq, stream_answer_with_groq
+from .ingest import embed_query
+from .llm import answer_with_groq_async, stream_answer_with_groq_async, aclose_client, warmup_async
+from .index import user_indexes
+from . import admission, answer_cache, fts, ingest, jobs, metrics, pgvec, revenue, storage
 
 STORAGE_DIR = os.getenv("STORAGE_DIR", "./storage")
 os.makedirs(STORAGE_DIR, exist_ok=True)
+# Default AskIn.retrieval: "vector" or "hybrid"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+# Default AskIn.diversity (MMR lambda; unset = no re-ranking) and AskIn.candidates
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA")) if os.getenv("MMR_LAMBDA") else None
+MMR_CANDIDATES = int(os.getenv("MMR_CANDIDATES", "20"))
+# Upper bound on the chunks MMR compares (it builds an n x n similarity matrix)
+MMR_MAX_CANDIDATES = int(os.getenv("MMR_MAX_CANDIDATES", "200"))
+# Threads for the blocking part of /ask (embedding, retrieval, DB); the LLM call itself is async
+ASK_THREADS = int(os.getenv("ASK_THREADS", "16"))
+# Seconds between keep-alive comments on /ask/events while the model is silent
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+# Load the embedder in the background at start-up (/readyz waits for it); WARMUP_LLM=1 also
+# opens the pooled Groq connection
+WARMUP = os.getenv("WARMUP", "1") == "1"
+WARMUP_LLM = os.getenv("WARMUP_LLM", "0") == "1"
+
+# "warm": the embedder warmup finished (or WARMUP=0); "llm": the optional Groq warmup succeeded
+_readiness = {"db": False, "warm": False, "llm": False, "error": None}
+
+
+def init_db():
+    """Create tables and run the additive migrations (new columns, indexes, FTS, pgvector, revenue backfill)."""
+    backfill_revenue = revenue.missing()
+    pgvec.ensure_extension()
+    Base.metadata.create_all(bind=engine)
+    ensure_columns("documents", {"status": "VARCHAR DEFAULT 'ready'", "sha256": "VARCHAR"})
+    ensure_columns("users", {"corpus_version": "INTEGER NOT NULL DEFAULT 0"})
+    ensure_columns("chunks", {"page_end": "INTEGER"})
+    ensure_indexes({"ix_chunks_document_id": ("chunks", "document_id"),
+                    "ix_documents_user_id": ("documents", "user_id")})
+    fts.ensure_fts()
+    if pgvec.ensure_schema():
+        pgvec.migrate()
+    if backfill_revenue:
+        with SessionLocal() as db:
+            revenue.backfill(db)
+
+
+async def _warmup():
+    try:
+        if WARMUP:
+            await anyio.to_thread.run_sync(ingest.warmup)
+        _readiness["warm"] = True
+    except Exception as e:
+        traceback.print_exception(e)
+        _readiness["error"] = f"embedder: {type(e).__name__}: {e}"
+        return
+    if WARMUP_LLM:
+        try:
+            await warmup_async()
+            _readiness["llm"] = True
+        except Exception as e:  # best effort: the first ask connects anyway
+            _readiness["error"] = f"llm: {type(e).__name__}: {e}"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema first (blocking, before any request); heavy imports and model load happen in the background
+    await anyio.to_thread.run_sync(init_db)
+    _readiness["db"] = True
+    jobs.pool.start()
+    warm = asyncio.create_task(_warmup())
+    try:
+        yield
+    finally:
+        warm.cancel()
+        jobs.pool.stop()
+        await aclose_client()
+
+
+app = FastAPI(title="Business AI MVP", lifespan=lifespan)
+
+
+class UploadSizeLimit:
+    """Refuse upload requests whose declared Content-Length is over MAX_REQUEST_MB before the body is read."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/api/documents/upload"):
+            length = dict(scope["headers"]).get(b"content-length", b"")
+            if length.isdigit() and int(length) > storage.max_request_bytes():
+                resp = JSONResponse({"detail": f"Upload exceeds {storage.MAX_REQUEST_MB:g} MB"}, status_code=413)
+                return await resp(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+@app.exception_handler(admission.Rejected)
+async def rejected_handler(request: Request, exc: admission.Rejected):
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status, headers=headers)
+
 
-app = FastAPI(title="Business AI MVP")
+app.add_middleware(UploadSizeLimit)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,35 +131,113 @@ app.add_middleware(
 
 # app.mount("/files", StaticFiles(directory=STORAGE_DIR), name="files")
 
-# create tables
-Base.metadata.create_all(bind=engine)
-
 
 # --------------------------- helpers ---------------------------
 
-def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    return float(np.dot(a, b))  # embeddings are normalized
+_ask_limiter = None
 
 
-def _save_and_ingest(filename: str, contents: bytes, user: User, db: Session) -> Document:
-    save_path = os.path.join(STORAGE_DIR, f"{user.id}_{filename}")
-    with open(save_path, "wb") as f:
-        f.write(contents)
-    size = os.path.getsize(save_path)
+async def _offload(fn, *args):
+    """Run blocking ask work on its own thread limiter, apart from Starlette's shared pool."""
+    global _ask_limiter
+    if _ask_limiter is None:
+        _ask_limiter = anyio.CapacityLimiter(ASK_THREADS)
+    return await anyio.to_thread.run_sync(fn, *args, limiter=_ask_limiter)
 
-    doc = Document(user_id=user.id, filename=filename, path=save_path, size=size, meta_json=None)
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
 
-    chunks, embs, pages = extract_and_chunk(save_path, filename)
-    for i, (text, emb) in enumerate(zip(chunks, embs)):
-        page = pages[i] if pages else None
-        db.add(Chunk(document_id=doc.id, position=i, text=text, embedding=emb.tobytes(), page=page))
-    db.commit()
+async def _stage_upload(file: UploadFile, limit: int) -> Tuple[str, str, int]:
+    """Spool an upload to a temp file in fixed-size chunks: (tmp_path, sha256, size)."""
+    if file.size is not None and file.size > limit:
+        raise HTTPException(413, f"{file.filename}: file exceeds {limit // (1024 * 1024)} MB")
+    try:
+        return await run_in_threadpool(storage.stage, file.file, limit)
+    except storage.UploadTooLarge as e:
+        raise HTTPException(413, f"{file.filename}: {e}")
+
+
+def _save_and_ingest(filename: str, staged: Tuple[str, str, int], user: User, db: Session) -> Document:
+    doc = _store_upload(filename, staged, user, db)
+    # extraction + embedding happen on the ingest workers (jobs.py)
+    return jobs.submit(db, doc)
+
+
+def _store_upload(filename: str, staged: Tuple[str, str, int], user: User, db: Session) -> Document:
+    # content-addressed: identical bytes share one file (and, in jobs.py, one extraction)
+    tmp, sha, size = staged
+    try:
+        doc = Document(user_id=user.id, filename=filename, path=storage.blob_path(sha), size=size,
+                       sha256=sha, meta_json=None, status="pending")
+        db.add(doc)
+        db.commit()
+        db.refresh(doc)
+    except Exception:
+        storage.discard(tmp)
+        raise
+    # moved into place after the row exists so a concurrent delete can't collect it
+    storage.commit(tmp, sha)
     return doc
 
 
+def _hybrid_hits(db: Session, user_id: int, q_emb: np.ndarray, question: str, top_k: int) -> List[Tuple[float, int]]:
+    """BM25 and cosine rankings fused with RRF; scores stay cosine so relevance thresholds keep working."""
+    n = max(fts.RRF_CANDIDATES, top_k)
+    dense = user_indexes.search(db, user_id, q_emb, n)
+    sparse = fts.search(db, user_id, question, n)
+    fused = fts.rrf([[cid for _, cid in dense], [cid for _, cid in sparse]])
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    cos = {cid: s for s, cid in dense}
+    cos.update(user_indexes.score(db, user_id, q_emb, [cid for cid in best if cid not in cos]))
+    return [(cos.get(cid, 0.0), cid) for cid in best]
+
+
+def _diversify(db: Session, user_id: int, q_emb: np.ndarray, hits: List[Tuple[float, int]], top_k: int,
+               lambda_mult: float) -> List[Tuple[float, int]]:
+    """MMR re-ranking of a candidate pool down to top_k, in pick order; drops overlapping near-duplicates."""
+    vecs = user_indexes.vectors(db, user_id, [cid for _, cid in hits])
+    hits = [h for h in hits if h[1] in vecs]
+    if len(hits) <= 1:
+        return hits[:top_k]
+    picked = mmr_select(q_emb, np.stack([vecs[cid] for _, cid in hits]), top_k, lambda_mult,
+                        relevance=np.array([s for s, _ in hits], dtype=np.float32))
+    return [hits[i] for i in picked]
+
+
+def _retrieve(db: Session, user_id: int, q_emb: np.ndarray, top_k: int, question: Optional[str] = None,
+              mode: str = "vector", diversity: Optional[float] = None,
+              candidates: Optional[int] = None) -> List[Tuple[float, Dict]]:
+    """Top-k chunks for the user as (score, source dict), best first (MMR pick order with diversity < 1)."""
+    mmr = diversity is not None and diversity < 1.0
+    n = min(max(candidates or MMR_CANDIDATES, top_k), MMR_MAX_CANDIDATES) if mmr else top_k
+    if mode == "hybrid" and question and fts.available():
+        hits = _hybrid_hits(db, user_id, q_emb, question, n)
+    else:
+        hits = user_indexes.search(db, user_id, q_emb, n)
+    if mmr:
+        hits = _diversify(db, user_id, q_emb, hits, top_k, diversity)
+    if not hits:
+        return []
+    by_id = _chunk_sources(db, [cid for _, cid in hits])
+    return [(score, by_id[cid]) for score, cid in hits if cid in by_id]
+
+
+def _chunk_sources(db: Session, chunk_ids: List[int]) -> Dict[int, Dict]:
+    """{chunk_id: source dict} for the chunks that still exist."""
+    rows = db.execute(
+        select(Chunk.id, Chunk.document_id, Chunk.page, Chunk.page_end, Chunk.text, Document.filename)
+        .join(Document, Chunk.document_id == Document.id)
+        .where(Chunk.id.in_(chunk_ids))
+    ).all()
+    return {r.id: {
+        "chunk_id": r.id,
+        "document_id": r.document_id,
+        "filename": r.filename,
+        "page": r.page,
+        "page_end": r.page_end,
+        "url": f"/api/documents/{r.document_id}/download",  # <-- protected
+        "text": (r.text or ""),
+    } for r in rows}
+
+
 # Map month names to numbers for quick parsing from the question
 _MONTHS = {
     "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
@@ -70,6 +245,11 @@ _MONTHS = {
 }
 
 
+def _mmr_options(payload: AskIn) -> Dict:
+    diversity = payload.diversity if payload.diversity is not None else MMR_LAMBDA
+    return {"diversity": diversity, "candidates": payload.candidates}
+
+
 def _month_from_question(q: str) -> Optional[int]:
     q = q.lower()
     for name, num in _MONTHS.items():
@@ -99,35 +279,56 @@ def _normalize_history(history) -> Optional[List[Dict[str, str]]]:
     return out or None
 
 
-def _find_month_sources(db: Session, user_id: int, month: int, year: Optional[int] = None, limit: int = 300):
+def _revenue_answer(db: Session, user_id: int, question: str) -> Optional[Dict]:
     """
-    Pull extra chunks that contain the month string so the weekly parser
-    sees *all* rows from the revenue table image, not just Top-K.
-    If year is None, we match '-MM-' and let the parser pick the year from rows.
+    Deterministic weekly revenue from revenue_records (parsed at ingest):
+    total, daily average and one bullet per day citing the chunk it came from.
+    None when the week can't be resolved or has no rows.
     """
-    if year:
-        pattern = f"{year}-{month:02d}-"
-        q = (db.query(Chunk, Document)
-             .join(Document, Document.id == Chunk.document_id)
-             .filter(Document.user_id == user_id, Chunk.text.contains(pattern))
-             .limit(limit))
-    else:
-        # looser: match '-MM-' to gather all candidate rows across years
-        pattern = f"-{month:02d}-"
-        q = (db.query(Chunk, Document)
-             .join(Document, Document.id == Chunk.document_id)
-             .filter(Document.user_id == user_id, Chunk.text.contains(pattern))
-             .limit(limit))
-    rows = q.all()
-    out = []
-    for ch, doc in rows:
-        out.append({
-            "document_id": doc.id,
-            "filename": doc.filename,
-            "page": ch.page,
-            "text": ch.text or ""
-        })
-    return out
+    records = revenue.month_records(db, user_id, _month_from_question(question))
+    rng = resolve_week_range(question, records)
+    if not rng:
+        return None
+    start, end = rng
+    week_rows = revenue.range_rows(db, user_id, start, end)
+    if not week_rows:
+        return None
+    agg = aggregate_week([(r.day, r.amount) for r in week_rows], start, end)
+
+    chunk_ids = list(dict.fromkeys(r.chunk_id for r in week_rows))
+    by_id = _chunk_sources(db, chunk_ids)
+    sources = [by_id[cid] for cid in chunk_ids if cid in by_id]
+    cite = {s["chunk_id"]: f"[{idx}]" for idx, s in enumerate(sources, 1)}
+    bullets = [f"- {r.day.isoformat()}: ${r.amount:,.2f} {cite.get(r.chunk_id, '')}" for r in week_rows]
+    answer = (
+            f"Sales in {start.strftime('%B')} {start.day}–{end.day}, {start.year}: "
+            f"**${agg['total']:,.2f}** (avg **${agg['avg']:,.2f}**/day).\n" +
+            "\n".join(bullets)
+    )
+    return {"answer": answer, "sources": sources}
+
+
+# --------------------------- HEALTH ---------------------------
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving."""
+    return {"ok": True}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: schema in place and the embedder loaded (WARMUP=0: schema only)."""
+    ready = _readiness["db"] and _readiness["warm"]
+    body = {"ready": ready, **_readiness, "embedder_loaded": ingest.embedder_loaded()}
+    return body if ready else JSONResponse(body, status_code=503)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus exposition of the latency, token, batcher and cache metrics (metrics.py)."""
+    body, content_type = metrics.exposition()
+    return Response(body, media_type=content_type)
 
 
 # --------------------------- AUTH ---------------------------
@@ -139,17 +340,20 @@ def delete_account(payload: DeleteAccountIn, user: User = Depends(get_current_us
 
     # 2) delete all user docs/chunks + files from disk
     docs = db.scalars(select(Document).where(Document.user_id == user.id)).all()
+    revenue.delete_documents(db, [doc.id for doc in docs])
     for doc in docs:
+        db.execute(delete(IngestJob).where(IngestJob.document_id == doc.id))
         db.execute(delete(Chunk).where(Chunk.document_id == doc.id))
         db.delete(doc)
-        try:
-            os.remove(doc.path)
-        except Exception:
-            pass
 
     # 3) finally delete the user
+    user_id = user.id
+    answer_cache.clear_user(db, user_id)
     db.delete(user)
     db.commit()
+    user_indexes.drop_user(user_id)
+    for doc in docs:
+        storage.release(db, doc)  # files shared with other users stay
 
     # Client should forget JWT locally; it’s stateless
     return {"ok": True}
@@ -201,8 +405,8 @@ async def upload_document(
         user: User = Depends(get_current_user),
         db: Session = Depends(get_db),
 ):
-    contents = await file.read()
-    doc = _save_and_ingest(file.filename, contents, user, db)
+    staged = await _stage_upload(file, storage.max_upload_bytes())
+    doc = await run_in_threadpool(_save_and_ingest, file.filename, staged, user, db)
     return doc
 
 
@@ -214,11 +418,21 @@ async def upload_documents_batch(
 ):
     if not files:
         raise HTTPException(400, "No files provided")
+    staged: List[Tuple[str, str, int]] = []
+    budget = storage.max_request_bytes()
+    try:
+        for f in files:
+            staged.append(await _stage_upload(f, min(storage.max_upload_bytes(), budget)))
+            budget -= staged[-1][2]
+    except BaseException:
+        for tmp, _, _ in staged:
+            storage.discard(tmp)
+        raise
     docs: List[Document] = []
-    for f in files:
-        contents = await f.read()
-        docs.append(_save_and_ingest(f.filename, contents, user, db))
-    return docs
+    for f, st in zip(files, staged):
+        docs.append(await run_in_threadpool(_store_upload, f.filename, st, user, db))
+    # one submission so the files are extracted in parallel and embedded together
+    return await run_in_threadpool(jobs.submit_many, db, docs)
 
 
 @app.get("/api/documents", response_model=List[DocumentOut])
@@ -229,113 +443,82 @@ def list_documents(user: User = Depends(get_current_user), db: Session = Depends
     return docs
 
 
+@app.get("/api/documents/{doc_id}/status", response_model=DocumentStatusOut)
+def document_status(doc_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    doc = db.get(Document, doc_id)
+    if not doc or doc.user_id != user.id:
+        raise HTTPException(404, "Not found")
+    job = db.scalar(select(IngestJob).where(IngestJob.document_id == doc.id).order_by(IngestJob.id.desc()))
+    return {"document_id": doc.id, "status": doc.status or "ready", "job": job}
+
+
+@app.get("/api/jobs", response_model=List[JobOut])
+def list_jobs(status: Optional[str] = None, limit: int = 50,
+              user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    q = select(IngestJob).where(IngestJob.user_id == user.id)
+    if status:
+        q = q.where(IngestJob.status == status)
+    return db.scalars(q.order_by(IngestJob.id.desc()).limit(min(limit, 500))).all()
+
+
 @app.delete("/api/documents/{doc_id}")
 def delete_document(doc_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     doc = db.get(Document, doc_id)
     if not doc or doc.user_id != user.id:
         raise HTTPException(404, "Not found")
+    db.execute(delete(IngestJob).where(IngestJob.document_id == doc.id))
+    revenue.delete_documents(db, [doc.id])
     db.execute(delete(Chunk).where(Chunk.document_id == doc.id))
     db.delete(doc)
+    answer_cache.bump_corpus_version(db, user.id)
     db.commit()
-    try:
-        os.remove(doc.path)
-    except Exception:
-        pass
+    user_indexes.drop_document(user.id, doc.id)
+    storage.release(db, doc)
     return {"ok": True}
 
 
 # --------------------------- ASK ---------------------------
 
-@app.post("/api/knowledge/ask", response_model=AskOut)
-def ask(payload: AskIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def _prepare_ask(payload: AskIn, user: User, db: Session) -> dict:
+    """
+    Blocking half of /ask. Returns {"result": ..., "cache": ...} when the answer
+    is already known (revenue path, not-enough-info, cache hit), otherwise the
+    sources/history/cache_key for the LLM call.
+    """
     q_text = payload.question
     q_lower = q_text.lower()
     is_sales_q = ("sales" in q_lower or "revenue" in q_lower) and ("week" in q_lower)
-    month_hint = _month_from_question(q_lower)
+
+    # ---------- Deterministic weekly revenue path ----------
+    if is_sales_q:
+        with metrics.stage("revenue"):
+            result = _revenue_answer(db, user.id, payload.question)
+        if result:
+            metrics.set_path("deterministic")
+            return {"result": result}
 
     # Embed question (bias slightly for sales table lookups)
     if is_sales_q:
         q_text += " monthly revenue record total revenue transactions table"
-    q_emb = embed_texts([q_text])[0]
-
-    # Load candidate chunks for this user
-    rows = db.scalars(
-        select(Chunk).join(Document, Chunk.document_id == Document.id).where(Document.user_id == user.id)
-    ).all()
-    if not rows:
+    with admission.stage("embed"):
+        q_emb = embed_query(q_text)
+
+    # Rank this user's chunks by cosine
+    with admission.stage("retrieve"), metrics.stage("retrieve"):
+        top = _retrieve(db, user.id, q_emb, payload.top_k, question=payload.question,
+                        mode=payload.retrieval or RETRIEVAL_MODE, **_mmr_options(payload))
+    if not top:
         raise HTTPException(400, "No documents ingested yet. Upload first.")
 
-    # Rank by cosine
-    scored = [(cosine_sim(q_emb, np.frombuffer(r.embedding, dtype=np.float32)), r) for r in rows]
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top = scored[: payload.top_k]
-
     THRESHOLD = 0.28
-    sources = [
-        {
-            "document_id": r.document_id,
-            "filename": r.document.filename,
-            "page": r.page,
-            "url": f"/api/documents/{r.document_id}/download",  # <-- protected
-            "text": (r.text or ""),
-        }
-        for _, r in top
-    ]
-
-    # If relevance is weak and it's a sales week question, don't bail yet—expand sources by month.
-    if (not top or top[0][0] < THRESHOLD) and is_sales_q and month_hint:
-        sources.extend(_find_month_sources(db, user.id, month_hint, year=None))
+    top_score = max(s for s, _ in top)  # hybrid order isn't by cosine
+    sources = [s for _, s in top]
 
-    # ---------- Deterministic weekly revenue path ----------
-    if is_sales_q:
-        context_text = "\n\n".join(s.get("text", "") for s in sources)
-        records = extract_revenue_records(context_text)
-
-        # If we didn't capture enough rows, expand from DB by month and retry
-        if month_hint and len(records) < 7:
-            extra = _find_month_sources(db, user.id, month_hint, year=None)
-            # Deduplicate quickly
-            seen = {(s["document_id"], s.get("page"), (s.get("text", "")[:64])) for s in sources}
-            for e in extra:
-                key = (e["document_id"], e.get("page"), (e.get("text", "")[:64]))
-                if key not in seen:
-                    sources.append(e);
-                    seen.add(key)
-            context_text = "\n\n".join(s.get("text", "") for s in sources)
-            records = extract_revenue_records(context_text)
-
-        rng = resolve_week_range(payload.question, records)
-        if rng:
-            start, end = rng
-            week_rows = [(dt, val) for dt, val in records if start <= dt <= end]
-            if week_rows:
-                agg = aggregate_week(records, start, end)
-
-                index_by_id_page = {}
-                for idx, s in enumerate(sources, 1):
-                    index_by_id_page[(s["document_id"], s.get("page"))] = idx
-
-                def cite_for(dt_str: str) -> str:
-                    for idx, s in enumerate(sources, 1):
-                        if dt_str in (s.get("text") or ""):
-                            return f"[{idx}]"
-                    return ""
-
-                bullets = [
-                    f"- {dt.isoformat()}: ${val:,.2f} {cite_for(dt.isoformat())}"
-                    for dt, val in sorted(week_rows, key=lambda x: x[0])
-                ]
-                answer = (
-                        f"Sales in {start.strftime('%B')} {start.day}–{end.day}, {start.year}: "
-                        f"**${agg['total']:,.2f}** (avg **${agg['avg']:,.2f}**/day).\n" +
-                        "\n".join(bullets)
-                )
-                return {"answer": answer, "sources": sources}
-
-        # If still nothing concrete, and relevance was truly low, fall through to graceful not-enough-info
-        if not top or top[0][0] < THRESHOLD:
-            return {"answer": "I don’t have enough information in your documents to answer that.", "sources": []}
-        # else we’ll let LLM attempt with whatever sources we have
+    # No rows for that week and weak relevance: graceful not-enough-info instead of an LLM guess
+    if is_sales_q and top_score < THRESHOLD:
+        metrics.set_path("not_enough_info")
+        return {"result": {"answer": "I don’t have enough information in your documents to answer that.",
+                           "sources": []}}
 
     # ---------- RAG path (LLM) ----------
     # Prepend previous context if provided
@@ -345,34 +528,62 @@ def ask(payload: AskIn, user: User = Depends(get_current_user), db: Session = De
         sources = ([{"document_id": 0, "filename": "previous-context", "page": None, "text": carry}] + sources)
 
     history = _normalize_history(payload.history)
-    answer = answer_with_groq(payload.question, sources, history=history)
-    return {"answer": answer, "sources": sources}
 
+    cache_key = None
+    if answer_cache.ANSWER_CACHE_ENABLED:
+        cache_key = answer_cache.make_key(
+            payload.question, [s["chunk_id"] for _, s in top], user.corpus_version or 0,
+            prev_context=carry, history=history,
+        )
+        with metrics.stage("cache_lookup"):
+            cached = answer_cache.lookup(db, user.id, cache_key)
+        if cached is not None:
+            metrics.set_path("cache")
+            return {"result": cached, "cache": "hit"}
 
-@app.post("/api/knowledge/ask/stream")
-def ask_stream(payload: AskIn, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    q_emb = embed_texts([payload.question])[0]
+    return {"sources": sources, "history": history, "cache_key": cache_key}
 
-    rows = db.scalars(
-        select(Chunk).join(Document, Chunk.document_id == Document.id).where(Document.user_id == user.id)
-    ).all()
-    if not rows:
+
+@app.post("/api/knowledge/ask", response_model=AskOut)
+async def ask(payload: AskIn, response: Response, user: User = Depends(get_current_user),
+              db: Session = Depends(get_db), x_request_timeout: Optional[float] = Header(None)):
+    timer = metrics.begin("ask")
+    admission.start_deadline(x_request_timeout)
+    try:
+        async with admission.admitted(user.id):
+            result = await _answer(payload, response, user, db)
+        response.headers["Server-Timing"] = timer.header()
+        return result
+    finally:
+        timer.finish()
+
+
+async def _answer(payload: AskIn, response: Response, user: User, db: Session) -> dict:
+    plan = await _offload(_prepare_ask, payload, user, db)
+    if "result" in plan:
+        if plan.get("cache"):
+            response.headers["X-Answer-Cache"] = plan["cache"]
+        return plan["result"]
+
+    answer = await answer_with_groq_async(payload.question, plan["sources"], history=plan["history"])
+    result = {"answer": answer, "sources": plan["sources"]}
+    if plan["cache_key"]:
+        await _offload(answer_cache.store, db, user.id, plan["cache_key"], result)
+        response.headers["X-Answer-Cache"] = "miss"
+    return result
+
+
+def _prepare_stream(payload: AskIn, user: User, db: Session):
+    with admission.stage("embed"):
+        q_emb = embed_query(payload.question)
+
+    with admission.stage("retrieve"), metrics.stage("retrieve"):
+        top = _retrieve(db, user.id, q_emb, payload.top_k, question=payload.question,
+                        mode=payload.retrieval or RETRIEVAL_MODE, **_mmr_options(payload))
+    if not top:
         raise HTTPException(400, "No documents ingested yet. Upload first.")
 
-    scored = [(cosine_sim(q_emb, np.frombuffer(r.embedding, dtype=np.float32)), r) for r in rows]
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top = scored[: payload.top_k]
-
-    sources = [
-        {
-            "document_id": r.document_id,
-            "filename": r.document.filename,
-            "page": r.page,
-            "url": f"/api/documents/{r.document_id}/download",  # <-- protected
-            "text": (r.text or ""),
-        }
-        for _, r in top
-    ]
+    sources = [s for _, s in top]
 
     carry = (payload.prev_context or "").strip()
     if carry:
@@ -380,9 +591,142 @@ def ask_stream(payload: AskIn, user: User = Depends(get_current_user), db: Sessi
         sources = ([{"document_id": 0, "filename": "previous-context", "page": None, "text": carry}] + sources)
 
     history = _normalize_history(payload.history)
+    return sources, history
+
 
-    def gen():
-        for chunk in stream_answer_with_groq(payload.question, sources, history=history):
+@app.post("/api/knowledge/ask/stream")
+async def ask_stream(payload: AskIn, user: User = Depends(get_current_user), db: Session = Depends(get_db),
+                     x_request_timeout: Optional[float] = Header(None)):
+    timer = metrics.begin("ask_stream")
+    admission.start_deadline(x_request_timeout)
+    user_id = user.id
+    try:
+        await admission.enter(user_id)
+    except BaseException:
+        timer.finish()
+        raise
+    try:
+        sources, history = await _offload(_prepare_stream, payload, user, db)
+    except BaseException:
+        admission.leave(user_id)
+        timer.finish()
+        raise
+
+    async def gen():
+        async for chunk in stream_answer_with_groq_async(payload.question, sources, history=history):
             yield chunk
 
-    return StreamingResponse(gen(), media_type="text/plain")
+    def done():
+        admission.leave(user_id)
+        timer.finish()
+
+    # headers go out before the LLM runs: Server-Timing covers embedding and retrieval
+    return _ClosingStream(gen(), done, media_type="text/plain", headers={"Server-Timing": timer.header()})
+
+
+class _ClosingStream(StreamingResponse):
+    """StreamingResponse that calls on_close when the response is over, even if the body was never iterated."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _store_answer(user_id: int, key: str, result: dict):
+    # the request's session may already be closed once the response is streaming
+    with SessionLocal() as db:
+        answer_cache.store(db, user_id, key, result)
+
+
+@app.post("/api/knowledge/ask/events")
+async def ask_events(payload: AskIn, user: User = Depends(get_current_user), db: Session = Depends(get_db),
+                     x_request_timeout: Optional[float] = Header(None)):
+    """
+    Server-Sent Events version of /ask: a `sources` event as soon as retrieval
+    is done, `token` events as the model writes, then `done` with token usage.
+    Revenue, not-enough-info and cached answers take the same paths as /ask
+    and never reach the LLM.
+    """
+    timer = metrics.begin("ask_events")
+    admission.start_deadline(x_request_timeout)
+    try:
+        await admission.enter(user.id)
+    except BaseException:
+        timer.finish()
+        raise
+    try:
+        plan = await _offload(_prepare_ask, payload, user, db)
+    except BaseException:
+        admission.leave(user.id)
+        timer.finish()
+        raise
+    user_id = user.id
+
+    def done():
+        admission.leave(user_id)
+        timer.finish()
+
+    headers = {"Server-Timing": timer.header(), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return _ClosingStream(_ask_events(payload, plan, user_id, timer), done, media_type="text/event-stream",
+                          headers=headers)
+
+
+async def _ask_events(payload: AskIn, plan: dict, user_id: int, timer: metrics.RequestTimer):
+    if "result" in plan:
+        result = plan["result"]
+        yield _sse("sources", result["sources"])
+        yield _sse("token", {"text": result["answer"]})
+        yield _sse("done", {"path": timer.path, "cache": plan.get("cache"), "usage": None})
+        return
+
+    yield _sse("sources", plan["sources"])
+    usage: Dict = {}
+    parts: List[str] = []
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for token in stream_answer_with_groq_async(payload.question, plan["sources"],
+                                                             history=plan["history"], usage=usage):
+                queue.put_nowait(("token", token))
+            queue.put_nowait(("end", None))
+        except Exception as e:
+            queue.put_nowait(("error", e))
+
+    # The model runs in its own task so heartbeats keep flowing while it is silent. When the
+    # client disconnects, Starlette cancels this generator and the finally cancels the task,
+    # which closes the upstream Groq stream instead of paying for the rest of the answer.
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                kind, value = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if kind == "error":
+                yield _sse("error", {"detail": f"{type(value).__name__}: {value}"})
+                return
+            if kind == "end":
+                break
+            parts.append(value)
+            yield _sse("token", {"text": value})
+    finally:
+        task.cancel()
+
+    cache = None
+    if plan["cache_key"]:
+        result = {"answer": "".join(parts).strip(), "sources": plan["sources"]}
+        await _offload(_store_answer, user_id, plan["cache_key"], result)
+        cache = "miss"
+    yield _sse("done", {"path": timer.path, "cache": cache, "usage": usage or None})
@@ -0,0 +1,131 @@
+import os, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# Per-stage latency for ask, ask_stream and ingestion. A request carries a
+# RequestTimer in a context variable (anyio copies it into the worker
+# threads), so any layer can time a stage with `with stage("embed"):`
+# without passing the timer around. The timer observes its stages into the
+# histograms once the request knows which path it took (deterministic, cache,
+# rag, ...) and renders the same numbers as a Server-Timing header.
+# Stages outside a request (ingest workers) are observed right away as route
+# "ingest".
+
+_SECONDS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_TOKENS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+STAGE_SECONDS = Histogram("bai_stage_seconds", "Time spent in one stage of a request or ingest job",
+                          ["route", "path", "stage"], buckets=_SECONDS)
+REQUEST_SECONDS = Histogram("bai_request_seconds", "End-to-end time of an ask request",
+                            ["route", "path"], buckets=_SECONDS)
+LLM_TOKENS = Histogram("bai_llm_tokens", "Prompt / completion / packed-context tokens per LLM call",
+                       ["route", "path", "kind"], buckets=_TOKENS)
+# question-embedding micro-batcher (ingest.MicroBatcher)
+EMBED_QUEUE_DEPTH = Gauge("bai_embed_queue_depth", "Question embeddings waiting for a batch",
+                          multiprocess_mode="livesum")
+EMBED_BATCH_SIZE = Histogram("bai_embed_batch_size", "Questions encoded per micro-batch",
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+# embedding caches (embcache.py); cache is "query" (in-process LRU) or "chunks" (embedding_cache table)
+EMB_CACHE_HITS = Counter("bai_emb_cache_hits", "Embedding cache hits", ["cache"])
+EMB_CACHE_MISSES = Counter("bai_emb_cache_misses", "Embedding cache misses", ["cache"])
+EMB_CACHE_EVICTIONS = Counter("bai_emb_cache_evictions", "Rows evicted from the embedding cache", ["cache"])
+
+_current: ContextVar[Optional["RequestTimer"]] = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    def __init__(self, route: str):
+        self.route = route
+        self.path = "rag"
+        self.start = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.tokens: Dict[str, int] = {}
+        self._done = False
+
+    def add(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
+
+    def header(self) -> str:
+        """Server-Timing value; repeated stages (e.g. several embed batches) are summed."""
+        totals: Dict[str, float] = {}
+        for name, sec in self.stages:
+            totals[name] = totals.get(name, 0.0) + sec
+        parts = [f"{name};dur={sec * 1000:.1f}" for name, sec in totals.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        parts.append(f'path;desc="{self.path}"')
+        return ", ".join(parts)
+
+    def finish(self):
+        if self._done:
+            return
+        self._done = True
+        for name, sec in self.stages:
+            STAGE_SECONDS.labels(self.route, self.path, name).observe(sec)
+        for kind, n in self.tokens.items():
+            LLM_TOKENS.labels(self.route, self.path, kind).observe(n)
+        REQUEST_SECONDS.labels(self.route, self.path).observe(time.perf_counter() - self.start)
+
+
+def begin(route: str) -> RequestTimer:
+    timer = RequestTimer(route)
+    _current.set(timer)
+    return timer
+
+
+def current() -> Optional[RequestTimer]:
+    return _current.get()
+
+
+def record(name: str, seconds: float):
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+    else:
+        STAGE_SECONDS.labels("ingest", "-", name).observe(seconds)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+
+def set_path(path: str):
+    timer = _current.get()
+    if timer is not None:
+        timer.path = path
+
+
+def add_tokens(prompt: Optional[int], completion: Optional[int]):
+    timer = _current.get()
+    if timer is None:
+        return
+    if prompt is not None:
+        timer.tokens["prompt"] = prompt
+    if completion is not None:
+        timer.tokens["completion"] = completion
+
+
+def add_context_tokens(sent: int, saved: int):
+    """Context tokens the packer sent, and those it saved by merging overlaps and trimming."""
+    timer = _current.get()
+    if timer is None:
+        return
+    timer.tokens["context"] = sent
+    timer.tokens["context_saved"] = saved
+
+
+def exposition() -> Tuple[bytes, str]:
+    """(body, content type) for /metrics; aggregates all workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
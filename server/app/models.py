@@ -1,7 +1,12 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, Text
+from sqlalchemy import (
+    Column, Integer, String, Date, DateTime, ForeignKey, LargeBinary, Text, Float, Index, UniqueConstraint
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from .db import Base
+from .db import Base, PGVECTOR, PGVECTOR_DIM
+
+if PGVECTOR:
+    from pgvector.sqlalchemy import Vector
 
 
 class User(Base):
@@ -10,6 +15,8 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
     role = Column(String, default="user")
+    # bumped on every upload/delete; part of the answer cache key (answer_cache.py)
+    corpus_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     documents = relationship("Document", back_populates="owner")
@@ -18,11 +25,15 @@ class User(Base):
 class Document(Base):
     __tablename__ = "documents"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
     filename = Column(String, nullable=False)
     path = Column(String, nullable=False)
     size = Column(Integer)
+    # content hash of the upload; Documents sharing it share the stored file (storage.py)
+    sha256 = Column(String, index=True)
     meta_json = Column(Text)
+    # pending -> processing -> ready | failed (see jobs.py)
+    status = Column(String, default="ready", server_default="ready")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="documents")
@@ -32,17 +43,59 @@ class Document(Base):
 class Chunk(Base):
     __tablename__ = "chunks"
     id = Column(Integer, primary_key=True)
-    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True, nullable=False)
     position = Column(Integer, nullable=False)
     text = Column(Text, nullable=False)
-    # Store embedding as raw bytes (float32 array)
+    # Store embedding as raw bytes (float32 array); empty when VECTOR_STORE=memmap or pgvector
     embedding = Column(LargeBinary, nullable=False)
+    if PGVECTOR:
+        vec = Column(Vector(PGVECTOR_DIM))  # searched in Postgres, see pgvec.py
     page = Column(Integer)
+    page_end = Column(Integer)  # last page the chunk spills onto (PDF only)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     document = relationship("Document", back_populates="chunks")
 
 
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True, nullable=False)
+    user_id = Column(Integer, index=True, nullable=False)
+    status = Column(String, index=True, default="pending")  # pending | running | done | failed
+    stage = Column(String, default="queued")
+    progress = Column(Float, default=0.0)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    error = Column(Text)
+    run_after = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+    __table_args__ = (UniqueConstraint("model", "text_hash"),)
+    id = Column(Integer, primary_key=True)
+    model = Column(String, nullable=False)
+    text_hash = Column(String, nullable=False)  # sha256 of normalized chunk text
+    vector = Column(LargeBinary, nullable=False)
+    last_used = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class RevenueRecord(Base):
+    """One dated revenue row parsed from a chunk at ingest time (revenue.py)."""
+    __tablename__ = "revenue_records"
+    __table_args__ = (Index("ix_revenue_records_user_day", "user_id", "day"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True, nullable=False)
+    chunk_id = Column(Integer, ForeignKey("chunks.id"), nullable=False)
+    page = Column(Integer)
+    day = Column(Date, nullable=False)
+    amount = Column(Float, nullable=False)
+
+
 # models.py
 class AnswerCache(Base):
     __tablename__="answer_cache"
@@ -0,0 +1,166 @@
+import os, re
+from typing import Dict, List, Optional, Tuple
+
+# Fits retrieved chunks into a per-model token budget before they go to the
+# LLM. Adjacent chunks of one document are merged and their overlap (120
+# tokens with the default chunking) sent once; chunks that don't fit whole
+# are cut down to the sentences sharing the most words with the question,
+# lower-ranked chunks first. Tokens are estimated like chunk_text does (~4
+# chars per token), which is close enough for budgeting.
+
+CHARS_PER_TOKEN = 4
+# Context windows of the Groq models we use; anything else gets DEFAULT_WINDOW
+MODEL_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+}
+DEFAULT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+# Tokens kept free for the answer
+ANSWER_RESERVE_TOKENS = int(os.getenv("ANSWER_RESERVE_TOKENS", "1024"))
+# Cap on context tokens even when the window is larger (prompt size drives latency and cost)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+# Share of the remaining budget chat history may take; oldest turns go first
+HISTORY_SHARE = float(os.getenv("HISTORY_SHARE", "0.25"))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_MIN_OVERLAP = 32  # chars; shorter shared edges are coincidence, not chunk overlap
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text or "") // CHARS_PER_TOKEN)
+
+
+def budget_for(model: str, fixed_tokens: int = 0) -> int:
+    """Tokens available for context + history once the prompt's fixed parts and the answer are set aside."""
+    window = MODEL_WINDOWS.get(model, DEFAULT_WINDOW)
+    return max(window - ANSWER_RESERVE_TOKENS - fixed_tokens, 0)
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 below _MIN_OVERLAP)."""
+    if len(a) < _MIN_OVERLAP or len(b) < _MIN_OVERLAP:
+        return 0
+    head = b[:_MIN_OVERLAP]
+    start = max(len(a) - len(b), 0)
+    pos = a.find(head, start)
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(head, pos + 1)
+    return 0
+
+
+class _Block:
+    def __init__(self, rank: int, document_id, text: str, pages: List[int]):
+        self.rank = rank
+        self.document_id = document_id
+        self.text = text
+        self.pages = pages
+
+    @classmethod
+    def of(cls, rank: int, chunk: Dict) -> "_Block":
+        pages = [p for p in (chunk.get("page"), chunk.get("page_end")) if p is not None]
+        return cls(rank, chunk.get("document_id"), chunk.get("text") or "", pages)
+
+    def absorb(self, other: "_Block") -> bool:
+        """Merge a neighbouring block of the same document, dropping the shared text."""
+        if other.document_id != self.document_id:
+            return False
+        if other.text in self.text:
+            pass
+        elif (ov := _overlap(self.text, other.text)):
+            self.text += other.text[ov:]
+        elif (ov := _overlap(other.text, self.text)):
+            self.text = other.text + self.text[ov:]
+        else:
+            return False
+        self.pages += other.pages
+        self.rank = min(self.rank, other.rank)
+        return True
+
+    def tag(self) -> str:
+        if not self.pages:
+            return f"(Doc {self.document_id}:?)"
+        lo, hi = min(self.pages), max(self.pages)
+        return f"(Doc {self.document_id}:{lo})" if lo == hi else f"(Doc {self.document_id}:{lo}-{hi})"
+
+
+def merge_chunks(chunks: List[Dict]) -> List[_Block]:
+    """One block per run of overlapping chunks, ranked by its best chunk; exact repeats dropped."""
+    blocks: List[_Block] = []
+    for rank, c in enumerate(chunks):
+        new = _Block.of(rank, c)
+        if any(new.text in b.text for b in blocks):
+            continue
+        # a chunk can bridge two blocks of its document: fold every block it touches into one
+        for b in [b for b in blocks if new.absorb(b)]:
+            blocks.remove(b)
+        blocks.append(new)
+    return sorted(blocks, key=lambda b: b.rank)
+
+
+def best_sentences(text: str, question: str, max_tokens: int) -> str:
+    """The sentences (or table lines) sharing most words with the question, in document order."""
+    if max_tokens <= 0:
+        return ""
+    terms = {t for t in _WORD.findall(question.lower()) if len(t) > 2}
+    sents = [s.strip() for s in _SENTENCE.split(text) if s.strip()]
+    scored = sorted(range(len(sents)),
+                    key=lambda i: (-len(terms & set(_WORD.findall(sents[i].lower()))), i))
+    keep, used = [], 0
+    for i in scored:
+        cost = estimate_tokens(sents[i]) + 1
+        if used + cost > max_tokens:
+            continue
+        keep.append(i)
+        used += cost
+    out, last = [], None
+    for i in sorted(keep):
+        if last is not None and i != last + 1:
+            out.append("…")
+        out.append(sents[i])
+        last = i
+    return "\n".join(out)
+
+
+def pack_context(question: str, chunks: List[Dict], max_tokens: int) -> Tuple[str, Dict]:
+    """(context text, {"tokens", "raw_tokens", "saved_tokens", "blocks", "trimmed"}) within max_tokens."""
+    raw = "\n\n".join(f"(Doc {c.get('document_id')}:{c.get('page') or '?'})\n{c.get('text') or ''}" for c in chunks)
+    out, used, trimmed = [], 0, 0
+    blocks = merge_chunks(chunks)
+    for b in blocks:
+        tag = b.tag()
+        room = max_tokens - used - estimate_tokens(tag) - 1
+        body = b.text
+        if estimate_tokens(body) > room:
+            # a single over-long line (OCR'd table without breaks) is cut instead
+            body = best_sentences(body, question, room) or body[: max(room, 0) * CHARS_PER_TOKEN]
+            trimmed += 1
+        if not body:
+            continue
+        block = f"{tag}\n{body}"
+        out.append(block)
+        used += estimate_tokens(block) + 1
+    text = "\n\n".join(out)
+    raw_tokens, tokens = estimate_tokens(raw), estimate_tokens(text)
+    report = {"tokens": tokens, "raw_tokens": raw_tokens, "saved_tokens": max(raw_tokens - tokens, 0),
+              "blocks": len(out), "trimmed": trimmed}
+    return text, report
+
+
+def fit_history(history: Optional[List[Dict]], max_tokens: int) -> List[Dict]:
+    """Most recent turns that fit max_tokens, in order."""
+    kept, used = [], 0
+    for m in reversed(history or []):
+        cost = estimate_tokens(m["content"]) + 4
+        if used + cost > max_tokens:
+            break
+        kept.append(m)
+        used += cost
+    return kept[::-1]
+
@@ -0,0 +1,144 @@
+"""
+Server-side vector search on Postgres (DB_URL=postgresql..., VECTOR_STORE
+unset or "pgvector").
+
+Chunk vectors are stored in chunks.vec (pgvector, PGVECTOR_DIM dims) under
+an HNSW or IVFFlat cosine index. A query is one ORDER BY vec <=> :q LIMIT k
+filtered by the owner's documents, so only the top-k ids cross the wire
+and any number of API workers can share the store.
+
+  python -m app.pgvec migrate    # copy chunks.embedding blobs into chunks.vec
+"""
+import os, argparse
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import Session
+
+from .db import PGVECTOR, PGVECTOR_DIM, SessionLocal, engine
+from .models import Chunk, Document
+
+PGVECTOR_INDEX = os.getenv("PGVECTOR_INDEX", "hnsw")  # hnsw | ivfflat
+PGVECTOR_HNSW_M = int(os.getenv("PGVECTOR_HNSW_M", "16"))
+PGVECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("PGVECTOR_HNSW_EF_CONSTRUCTION", "64"))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "100"))
+PGVECTOR_LISTS = int(os.getenv("PGVECTOR_LISTS", "100"))
+PGVECTOR_PROBES = int(os.getenv("PGVECTOR_PROBES", "10"))
+# pgvector >= 0.8: keep scanning the index until LIMIT rows pass the user filter ("relaxed_order")
+PGVECTOR_ITERATIVE_SCAN = os.getenv("PGVECTOR_ITERATIVE_SCAN", "")
+
+_INDEX = "ix_chunks_vec"
+MIGRATE_BATCH = 1000
+
+
+def enabled() -> bool:
+    return PGVECTOR
+
+
+def ensure_extension():
+    """CREATE EXTENSION vector; must run before create_all() creates the vec column."""
+    if not enabled():
+        return
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+
+def ensure_schema() -> bool:
+    """Add chunks.vec to an existing table and build the ANN index. True if the column was new."""
+    if not enabled():
+        return False
+    with engine.begin() as conn:
+        added = conn.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'chunks' AND column_name = 'vec'"
+        )).first() is None
+        if added:
+            conn.execute(text(f"ALTER TABLE chunks ADD COLUMN vec vector({PGVECTOR_DIM})"))
+        if PGVECTOR_INDEX == "ivfflat":
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {_INDEX} ON chunks USING ivfflat (vec vector_cosine_ops) "
+                              f"WITH (lists = {PGVECTOR_LISTS})"))
+        else:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {_INDEX} ON chunks USING hnsw (vec vector_cosine_ops) "
+                              f"WITH (m = {PGVECTOR_HNSW_M}, ef_construction = {PGVECTOR_HNSW_EF_CONSTRUCTION})"))
+    return added
+
+
+def _tune(db: Session, top_k: int):
+    """Per-transaction search knobs; ef_search / probes below top_k would cap the result size."""
+    if PGVECTOR_INDEX == "ivfflat":
+        db.execute(text("SELECT set_config('ivfflat.probes', :v, true)"), {"v": str(PGVECTOR_PROBES)})
+    else:
+        db.execute(text("SELECT set_config('hnsw.ef_search', :v, true)"),
+                   {"v": str(max(PGVECTOR_EF_SEARCH, top_k))})
+    if PGVECTOR_ITERATIVE_SCAN:
+        prefix = "ivfflat" if PGVECTOR_INDEX == "ivfflat" else "hnsw"
+        db.execute(text(f"SELECT set_config('{prefix}.iterative_scan', :v, true)"), {"v": PGVECTOR_ITERATIVE_SCAN})
+
+
+def search(db: Session, user_id: int, q: np.ndarray, top_k: int) -> List[Tuple[float, int]]:
+    """[(cosine, chunk_id)] best first, computed in Postgres."""
+    if top_k <= 0:
+        return []
+    q = np.asarray(q, dtype=np.float32)
+    dist = Chunk.vec.cosine_distance(q)
+    stmt = (select(Chunk.id, dist.label("dist"))
+            .join(Document, Chunk.document_id == Document.id)
+            .where(Document.user_id == user_id, Chunk.vec.isnot(None)))
+    _tune(db, top_k)
+    rows = db.execute(stmt.order_by(dist).limit(top_k)).all()
+    if len(rows) < top_k:
+        # The ANN index filters by user after the scan, so a small tenant in a
+        # big table can come back short; "+ 0" keeps the planner off the index.
+        rows = db.execute(stmt.order_by(dist + 0).limit(top_k)).all()
+    return [(1.0 - float(r.dist), int(r.id)) for r in rows]
+
+
+def score(db: Session, user_id: int, q: np.ndarray, chunk_ids: Sequence[int]) -> Dict[int, float]:
+    if not len(chunk_ids):
+        return {}
+    dist = Chunk.vec.cosine_distance(np.asarray(q, dtype=np.float32))
+    rows = db.execute(
+        select(Chunk.id, dist.label("dist")).join(Document, Chunk.document_id == Document.id)
+        .where(Document.user_id == user_id, Chunk.id.in_(list(chunk_ids)), Chunk.vec.isnot(None))
+    ).all()
+    return {int(r.id): 1.0 - float(r.dist) for r in rows}
+
+
+def vectors(db: Session, chunk_ids: Sequence[int]) -> Dict[int, np.ndarray]:
+    if not len(chunk_ids):
+        return {}
+    rows = db.execute(select(Chunk.id, Chunk.vec).where(Chunk.id.in_(list(chunk_ids)), Chunk.vec.isnot(None))).all()
+    return {int(r.id): np.asarray(r.vec, dtype=np.float32) for r in rows}
+
+
+def migrate(batch: int = MIGRATE_BATCH) -> int:
+    """Fill chunks.vec from the float32 blobs (chunks ingested before pgvector); returns rows copied."""
+    done = 0
+    with SessionLocal() as db:
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(Chunk.id, Chunk.embedding)
+                .where(Chunk.id > last_id, Chunk.vec.is_(None))
+                .order_by(Chunk.id).limit(batch)
+            ).all()
+            if not rows:
+                break
+            params = [{"id": r.id, "vec": np.frombuffer(r.embedding, dtype=np.float32)}
+                      for r in rows if r.embedding]
+            if params:
+                db.execute(update(Chunk), params)  # ORM bulk UPDATE by primary key
+            db.commit()
+            done += len(params)
+            last_id = rows[-1].id
+    return done
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(prog="python -m app.pgvec")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("migrate", help="copy chunks.embedding blobs into the pgvector column")
+    args = ap.parse_args()
+    if args.cmd == "migrate":
+        ensure_extension()
+        ensure_schema()
+        print({"copied": migrate()})
@@ -0,0 +1,92 @@
+import os
+from typing import Optional
+import numpy as np
+
+# Quantized copies of the embeddings for a cheap first-pass scan.
+# The top INDEX_RESCORE candidates are rescored with exact float32 vectors.
+
+INDEX_QUANT = os.getenv("INDEX_QUANT", "none")  # none | float16 | int8 | binary
+INDEX_RESCORE = int(os.getenv("INDEX_RESCORE", "200"))
+
+_BLOCK = 16384
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class Codec:
+    name = "none"
+    dtype = np.float32
+
+    def code_dim(self, dim: int) -> int:
+        return dim
+
+    def encode(self, x: np.ndarray):
+        """Return (codes, per-row scales)."""
+        raise NotImplementedError
+
+    def decode(self, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def score(self, codes: np.ndarray, scales: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # Upcast in blocks so the temporary float32 copy stays small
+        out = np.empty(len(codes), dtype=np.float32)
+        for s in range(0, len(codes), _BLOCK):
+            out[s: s + _BLOCK] = codes[s: s + _BLOCK].astype(np.float32) @ q
+        return out * scales
+
+
+class Float16Codec(Codec):
+    name = "float16"
+    dtype = np.float16
+
+    def encode(self, x):
+        return x.astype(np.float16), np.ones(len(x), dtype=np.float32)
+
+    def decode(self, codes, scales):
+        return codes.astype(np.float32)
+
+
+class Int8Codec(Codec):
+    """Symmetric per-row scale: x ~= codes * scale."""
+    name = "int8"
+    dtype = np.int8
+
+    def encode(self, x):
+        scales = np.maximum(np.abs(x).max(axis=1), 1e-12) / 127.0
+        codes = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def decode(self, codes, scales):
+        return codes.astype(np.float32) * scales[:, None]
+
+
+class BinaryCodec(Codec):
+    """Sign bits packed 8 per byte; scored by Hamming similarity."""
+    name = "binary"
+    dtype = np.uint8
+
+    def code_dim(self, dim: int) -> int:
+        return (dim + 7) // 8
+
+    def encode(self, x):
+        return np.packbits(x > 0, axis=1), np.ones(len(x), dtype=np.float32)
+
+    def decode(self, codes, scales):
+        bits = np.unpackbits(codes, axis=1).astype(np.float32)
+        x = bits * 2 - 1
+        return x / np.sqrt(x.shape[1])
+
+    def score(self, codes, scales, q):
+        qbits = np.packbits(q > 0)
+        out = np.empty(len(codes), dtype=np.float32)
+        nbits = codes.shape[1] * 8
+        for s in range(0, len(codes), _BLOCK):
+            ham = _POPCOUNT[np.bitwise_xor(codes[s: s + _BLOCK], qbits)].sum(axis=1, dtype=np.int32)
+            out[s: s + _BLOCK] = 1.0 - 2.0 * ham / nbits
+        return out
+
+
+_CODECS = {c.name: c for c in (Float16Codec(), Int8Codec(), BinaryCodec())}
+
+
+def get_codec(name: Optional[str] = None) -> Optional[Codec]:
+    return _CODECS.get(name or INDEX_QUANT)
@@ -0,0 +1,103 @@
+import calendar
+from datetime import date
+from typing import List, Optional, Sequence, Tuple
+from sqlalchemy import select, delete, insert, extract, func
+from sqlalchemy.orm import Session
+
+from .db import engine
+from .models import Chunk, Document, RevenueRecord
+from .utils import extract_revenue_records
+
+# Revenue rows ('YYYY-MM-DD ... $1,234.56') are parsed once per chunk at ingest
+# time into revenue_records, indexed on (user_id, day). Weekly revenue
+# questions become a range query with the exact chunk of every row for
+# citations. Overlapping chunks (and re-uploads of the same table) yield the
+# same row more than once; reads keep one row per (day, amount).
+
+BACKFILL_BATCH = 2000
+
+
+def rows_for_chunks(user_id: int, document_id: int, chunk_ids: Sequence[int], texts: Sequence[str],
+                    pages: Optional[Sequence[Optional[int]]] = None) -> List[dict]:
+    pages = pages or [None] * len(chunk_ids)
+    return [{"user_id": user_id, "document_id": document_id, "chunk_id": cid, "page": page,
+             "day": day, "amount": amount}
+            for cid, text, page in zip(chunk_ids, texts, pages)
+            for day, amount in extract_revenue_records(text or "")]
+
+
+def add_chunks(db: Session, user_id: int, document_id: int, chunk_ids: Sequence[int], texts: Sequence[str],
+               pages: Optional[Sequence[Optional[int]]] = None) -> int:
+    """Parse and store the revenue rows of freshly inserted chunks; caller commits."""
+    rows = rows_for_chunks(user_id, document_id, chunk_ids, texts, pages)
+    if rows:
+        db.execute(insert(RevenueRecord), rows)
+    return len(rows)
+
+
+def delete_documents(db: Session, doc_ids: Sequence[int]):
+    """Caller commits."""
+    db.execute(delete(RevenueRecord).where(RevenueRecord.document_id.in_(list(doc_ids))))
+
+
+def missing() -> bool:
+    """True before the table exists; call ahead of create_all() to know whether to backfill()."""
+    with engine.connect() as conn:
+        return not engine.dialect.has_table(conn, RevenueRecord.__tablename__)
+
+
+def backfill(db: Session, batch: int = BACKFILL_BATCH) -> int:
+    """Parse every existing chunk once (first start after the table was added)."""
+    last_id, total = 0, 0
+    while True:
+        rows = db.execute(
+            select(Chunk.id, Chunk.document_id, Chunk.page, Chunk.text, Document.user_id)
+            .join(Document, Chunk.document_id == Document.id)
+            .where(Chunk.id > last_id).order_by(Chunk.id).limit(batch)
+        ).all()
+        if not rows:
+            break
+        for r in rows:
+            total += add_chunks(db, r.user_id, r.document_id, [r.id], [r.text], [r.page])
+        db.commit()
+        last_id = rows[-1].id
+    return total
+
+
+def _distinct(rows) -> list:
+    seen, out = set(), []
+    for r in rows:
+        key = (r.day, round(r.amount, 2))
+        if key not in seen:
+            seen.add(key)
+            out.append(r)
+    return out
+
+
+def month_records(db: Session, user_id: int, month: Optional[int]) -> List[Tuple[date, float]]:
+    """
+    (day, amount) rows for `month` across years, or for the latest month on
+    record when month is None; the input resolve_week_range expects.
+    """
+    q = select(RevenueRecord.day, RevenueRecord.amount).where(RevenueRecord.user_id == user_id)
+    if month is None:
+        latest = db.scalar(select(func.max(RevenueRecord.day)).where(RevenueRecord.user_id == user_id))
+        if latest is None:
+            return []
+        _, last_day = calendar.monthrange(latest.year, latest.month)
+        q = q.where(RevenueRecord.day.between(date(latest.year, latest.month, 1),
+                                              date(latest.year, latest.month, last_day)))
+    else:
+        q = q.where(extract("month", RevenueRecord.day) == month)
+    return [(r.day, r.amount) for r in _distinct(db.execute(q.order_by(RevenueRecord.day)).all())]
+
+
+def range_rows(db: Session, user_id: int, start: date, end: date) -> list:
+    """Rows with start <= day <= end, one per (day, amount), each with the chunk it came from."""
+    rows = db.execute(
+        select(RevenueRecord.day, RevenueRecord.amount, RevenueRecord.chunk_id,
+               RevenueRecord.document_id, RevenueRecord.page)
+        .where(RevenueRecord.user_id == user_id, RevenueRecord.day.between(start, end))
+        .order_by(RevenueRecord.day, RevenueRecord.id)
+    ).all()
+    return _distinct(rows)
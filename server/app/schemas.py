@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional, Literal
+from datetime import datetime
 
 
 class RegisterIn(BaseModel):
@@ -16,11 +17,34 @@ class DocumentOut(BaseModel):
     id: int
     filename: str
     size: int
+    status: Optional[str] = "ready"
 
     class Config:
         from_attributes = True
 
 
+class JobOut(BaseModel):
+    id: int
+    document_id: int
+    status: str
+    stage: Optional[str] = None
+    progress: Optional[float] = None
+    attempts: int
+    max_attempts: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class DocumentStatusOut(BaseModel):
+    document_id: int
+    status: str
+    job: Optional[JobOut] = None
+
+
 class AskIn(BaseModel):
     question: str
     top_k: int = 4
@@ -41,6 +65,12 @@ class AskIn(BaseModel):
     top_k: int = 4
     prev_context: Optional[str] = None
     history: Optional[List[ChatMsg]] = None
+    # "vector" (cosine) or "hybrid" (BM25 + cosine, fused by reciprocal rank); default: RETRIEVAL_MODE
+    retrieval: Optional[Literal["vector", "hybrid"]] = None
+    # MMR lambda in [0, 1]: 1 = pure relevance, lower trades relevance for diversity; default: MMR_LAMBDA
+    diversity: Optional[float] = Field(None, ge=0, le=1)
+    # chunks retrieved and re-ranked by MMR down to top_k; default: MMR_CANDIDATES, at most MMR_MAX_CANDIDATES
+    candidates: Optional[int] = Field(None, ge=1)
 
 
 class DeleteAccountIn(BaseModel):
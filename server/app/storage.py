@@ -0,0 +1,110 @@
+import os, tempfile, hashlib, fcntl
+from contextlib import contextmanager
+from typing import BinaryIO, Tuple
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import Document
+
+# Uploads are stored once per content hash: BLOB_DIR/ab/abcdef....
+# Document rows are the reference count; a blob is deleted with its last Document.
+# commit() and release() hold a file lock on the blob's directory, so a delete
+# can't remove a blob that a concurrent upload of the same bytes just reused.
+
+STORAGE_DIR = os.getenv("STORAGE_DIR", "./storage")
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(STORAGE_DIR, "blobs"))
+# Upload limits; an upload is copied to disk in UPLOAD_CHUNK_BYTES pieces, never held whole in memory
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "200"))      # per file
+MAX_REQUEST_MB = float(os.getenv("MAX_REQUEST_MB", "1024"))   # per request (batch uploads)
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1 << 20)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def max_upload_bytes() -> int:
+    return int(MAX_UPLOAD_MB * 1024 * 1024)
+
+
+def max_request_bytes() -> int:
+    return int(MAX_REQUEST_MB * 1024 * 1024)
+
+
+def blob_path(sha: str) -> str:
+    return os.path.join(BLOB_DIR, sha[:2], sha)
+
+
+def stage(src: BinaryIO, limit: int | None = None) -> Tuple[str, str, int]:
+    """
+    Copy src into a temp file under BLOB_DIR chunk by chunk, hashing as it goes.
+    Returns (tmp_path, sha256, size); raises UploadTooLarge past limit bytes.
+    """
+    limit = max_upload_bytes() if limit is None else limit
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=BLOB_DIR, prefix=".upload-")
+    sha, size = hashlib.sha256(), 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: src.read(UPLOAD_CHUNK_BYTES), b""):
+                size += len(chunk)
+                if size > limit:
+                    raise UploadTooLarge(f"file exceeds {limit // (1024 * 1024)} MB")
+                sha.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        discard(tmp)
+        raise
+    return tmp, sha.hexdigest(), size
+
+
+@contextmanager
+def _locked(path: str):
+    """Exclusive lock for a blob (and its BLOB_DIR/ab/ neighbours), across threads and processes."""
+    d = os.path.dirname(path)
+    os.makedirs(d, exist_ok=True)
+    with open(os.path.join(d, ".lock"), "a+") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def commit(tmp: str, sha: str) -> str:
+    """
+    Atomically move a staged file to its blob path (dropping it if that blob already exists).
+    Call after the Document row is committed, so a concurrent release() sees the reference.
+    """
+    path = blob_path(sha)
+    with _locked(path):
+        if os.path.exists(path):
+            discard(tmp)
+            return path
+        os.replace(tmp, path)
+    return path
+
+
+def discard(tmp: str):
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+
+
+def refcount(db: Session, doc: Document) -> int:
+    if doc.sha256:
+        return db.scalar(select(func.count(Document.id)).where(Document.sha256 == doc.sha256)) or 0
+    # legacy rows are keyed by path
+    return db.scalar(select(func.count(Document.id)).where(Document.path == doc.path)) or 0
+
+
+def release(db: Session, doc: Document):
+    """Call after doc's row is deleted and committed: drop the file if nothing else uses it."""
+    with _locked(doc.path):
+        if refcount(db, doc):
+            return
+        try:
+            os.remove(doc.path)
+        except OSError:
+            pass
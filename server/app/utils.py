@@ -2,8 +2,8 @@ import hashlib
 from passlib.context import CryptContext
 import re, calendar
 from datetime import date, timedelta
+import numpy as np
 from typing import List, Tuple, Dict, Optional
-from .models import Chunk, Document
 
 pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -24,7 +24,10 @@ def extract_revenue_records(text: str) -> List[Tuple[date, float]]:
                      int(m.group("date")[5:7]),
                      int(m.group("date")[8:10]))
         val = float(m.group("rev").replace(",", ""))
-        out.append((date(y, mth, d), val))
+        try:
+            out.append((date(y, mth, d), val))
+        except ValueError:  # OCR noise like 2024-04-31
+            continue
     return out
 
 
@@ -105,40 +108,32 @@ def file_sha256(fp) -> str:
     return sha.hexdigest()
 
 
-def mmr_select(candidates, embeddings, k=4, lambda_mult=0.7):
-    selected, selected_idx = [], []
-    if not candidates: return []
-    selected_idx.append(0);
-    selected.append(candidates[0])
-    import numpy as np
-    emb = np.stack(embeddings)
-    for _ in range(1, min(k, len(candidates))):
-        best, best_i, best_score = None, None, -1
-        for i in range(len(candidates)):
-            if i in selected_idx: continue
-            sim_to_query = float(np.dot(emb[0], emb[i]))
-            sim_to_selected = max(float(np.dot(emb[i], emb[j])) for j in selected_idx)
-            score = lambda_mult * sim_to_query - (1 - lambda_mult) * sim_to_selected
-            if score > best_score: best, best_i, best_score = candidates[i], i, score
-        selected_idx.append(best_i);
-        selected.append(best)
+def mmr_select(q_emb: np.ndarray, embeddings: np.ndarray, k: int = 4, lambda_mult: float = 0.7,
+               relevance: Optional[np.ndarray] = None) -> List[int]:
+    """
+    Indices of k rows picked by maximal marginal relevance: each step takes the
+    row maximizing lambda * sim(query) - (1 - lambda) * max sim(already picked).
+    The pairwise similarity matrix is computed once and the max-similarity
+    vector updated incrementally, so a pick is one vectorized pass over n rows.
+    `relevance` overrides embeddings @ q_emb (e.g. exact rescored cosines).
+    """
+    emb = np.asarray(embeddings, dtype=np.float32)
+    n = len(emb)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    rel = np.asarray(relevance, dtype=np.float32) if relevance is not None else emb @ np.asarray(q_emb, np.float32)
+    sim = emb @ emb.T
+    first = int(np.argmax(rel))
+    selected = [first]
+    taken = np.zeros(n, dtype=bool)
+    taken[first] = True
+    max_sim = sim[first].copy()
+    while len(selected) < k:
+        score = lambda_mult * rel - (1 - lambda_mult) * max_sim
+        score[taken] = -np.inf
+        i = int(np.argmax(score))
+        selected.append(i)
+        taken[i] = True
+        np.maximum(max_sim, sim[i], out=max_sim)
     return selected
-
-
-def find_month_sources(db, user_id: int, year: int, month: int, limit: int = 80):
-    pattern = f"{year}-{month:02d}-"
-    rows = (db.query(Chunk, Document)
-            .join(Document, Document.id == Chunk.document_id)
-            .filter(Document.user_id == user_id,
-                    Chunk.text.contains(pattern))
-            .limit(limit)
-            .all())
-    sources = []
-    for ch, doc in rows:
-        sources.append({
-            "document_id": doc.id,
-            "filename": doc.filename,
-            "page": ch.page,
-            "text": ch.text or ""
-        })
-    return sources
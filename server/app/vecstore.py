@@ -0,0 +1,262 @@
+"""
+Append-only, memory-mapped embedding store (VECTOR_STORE=memmap).
+
+Layout per user under VECTOR_DIR/<user_id>/:
+  seg-000001.f32      raw float32 rows (n x dim), opened with np.memmap
+  seg-000001.ids.npy  int64 (n x 3): chunk_id, document_id, page (-1 = none)
+  tombstones.npy      document ids deleted since the last compaction
+
+Every ingest writes one new segment. Segments are never modified in place,
+so several uvicorn workers can map the same files and share the page cache.
+Compaction rewrites the live rows into a single segment.
+
+  python -m app.vecstore migrate [--clear-blobs]   # export chunks.embedding
+  python -m app.vecstore compact [--user ID]
+"""
+import os, re, glob, shutil, fcntl, argparse
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "db")
+VECTOR_DIR = os.getenv("VECTOR_DIR", os.path.join(os.getenv("STORAGE_DIR", "./storage"), "vectors"))
+# Auto-compact once this share of rows is tombstoned, or this many segments exist
+COMPACT_DEAD_RATIO = float(os.getenv("VECTOR_COMPACT_RATIO", "0.25"))
+COMPACT_MAX_SEGMENTS = int(os.getenv("VECTOR_COMPACT_SEGMENTS", "32"))
+
+_SEG = re.compile(r"seg-(\d{6})\.ids\.npy$")
+
+
+def enabled() -> bool:
+    return VECTOR_STORE == "memmap"
+
+
+def _user_dir(user_id: int) -> str:
+    return os.path.join(VECTOR_DIR, str(user_id))
+
+
+@contextmanager
+def _locked(user_id: int):
+    d = _user_dir(user_id)
+    os.makedirs(d, exist_ok=True)
+    with open(os.path.join(d, ".lock"), "a+") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield d
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _segment_names(d: str) -> List[str]:
+    names = []
+    for p in glob.glob(os.path.join(d, "seg-*.ids.npy")):
+        m = _SEG.search(p)
+        if m:
+            names.append(f"seg-{m.group(1)}")
+    return sorted(names)
+
+
+def _write_segment(d: str, ids: np.ndarray, embs: np.ndarray) -> str:
+    names = _segment_names(d)
+    seq = int(names[-1][4:]) + 1 if names else 1
+    name = f"seg-{seq:06d}"
+    base = os.path.join(d, name)
+    np.ascontiguousarray(embs, dtype=np.float32).tofile(base + ".f32.tmp")
+    os.replace(base + ".f32.tmp", base + ".f32")
+    # ids file last: a segment only exists once its id map is in place
+    with open(base + ".ids.tmp", "wb") as f:
+        np.save(f, ids.astype(np.int64))
+    os.replace(base + ".ids.tmp", base + ".ids.npy")
+    return name
+
+
+def _tombstones(d: str) -> np.ndarray:
+    try:
+        return np.load(os.path.join(d, "tombstones.npy"))
+    except (OSError, ValueError):
+        return np.zeros(0, dtype=np.int64)
+
+
+def _write_tombstones(d: str, doc_ids: np.ndarray):
+    tmp = os.path.join(d, "tombstones.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, doc_ids.astype(np.int64))
+    os.replace(tmp, os.path.join(d, "tombstones.npy"))
+
+
+def open_segment(user_id: int, name: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(memmap of n x dim float32, ids n x 3). Pages are shared via the OS cache, not copied."""
+    base = os.path.join(_user_dir(user_id), name)
+    ids = np.load(base + ".ids.npy")
+    if not len(ids):
+        return np.zeros((0, 0), dtype=np.float32), ids
+    dim = os.path.getsize(base + ".f32") // (4 * len(ids))
+    emb = np.memmap(base + ".f32", dtype=np.float32, mode="r", shape=(len(ids), dim))
+    return emb, ids
+
+
+def open_segments(user_id: int) -> Tuple[List[Tuple[str, np.ndarray, np.ndarray]], np.ndarray]:
+    d = _user_dir(user_id)
+    if not os.path.isdir(d):
+        return [], np.zeros(0, dtype=np.int64)
+    segs = []
+    for name in _segment_names(d):
+        try:
+            emb, ids = open_segment(user_id, name)
+        except (OSError, ValueError):
+            continue  # removed by a concurrent compaction
+        if len(ids):
+            segs.append((name, emb, ids))
+    return segs, _tombstones(d)
+
+
+def document_vectors(user_id: int, doc_id: int) -> dict:
+    """{chunk_id: vector} for one live document."""
+    segs, dead_docs = open_segments(user_id)
+    if doc_id in set(dead_docs.tolist()):
+        return {}
+    out = {}
+    for _, emb, ids in segs:
+        for row in np.flatnonzero(ids[:, 1] == doc_id):
+            out[int(ids[row, 0])] = np.array(emb[row])
+    return out
+
+
+def append(user_id: int, chunk_ids: Sequence[int], doc_ids: Sequence[int], pages: Sequence[Optional[int]],
+           embs: np.ndarray) -> str:
+    ids = np.column_stack([
+        np.asarray(chunk_ids, dtype=np.int64),
+        np.asarray(doc_ids, dtype=np.int64),
+        np.asarray([-1 if p is None else p for p in pages], dtype=np.int64),
+    ])
+    with _locked(user_id) as d:
+        return _write_segment(d, ids, embs)
+
+
+def delete_documents(user_id: int, doc_ids: Sequence[int]):
+    with _locked(user_id) as d:
+        _write_tombstones(d, np.union1d(_tombstones(d), np.asarray(doc_ids, dtype=np.int64)))
+    maybe_compact(user_id)
+
+
+def drop_user(user_id: int):
+    shutil.rmtree(_user_dir(user_id), ignore_errors=True)
+
+
+def compact(user_id: int, keep_chunk_ids: Optional[np.ndarray] = None) -> dict:
+    """
+    Rewrite live rows into one segment. Rows of tombstoned documents (and,
+    if given, rows whose chunk id is not in keep_chunk_ids) are dropped.
+    """
+    with _locked(user_id) as d:
+        names = _segment_names(d)
+        dead_docs = _tombstones(d)
+        embs, ids, before = [], [], 0
+        for name in names:
+            emb, seg_ids = open_segment(user_id, name)
+            before += len(seg_ids)
+            if not len(seg_ids):
+                continue
+            keep = ~np.isin(seg_ids[:, 1], dead_docs)
+            if keep_chunk_ids is not None:
+                keep &= np.isin(seg_ids[:, 0], keep_chunk_ids)
+            embs.append(np.asarray(emb[keep]))
+            ids.append(seg_ids[keep])
+        new = None
+        if ids and sum(len(i) for i in ids):
+            new = _write_segment(d, np.concatenate(ids), np.concatenate(embs))
+        for name in names:
+            for ext in (".ids.npy", ".f32"):
+                try:
+                    os.remove(os.path.join(d, name + ext))
+                except OSError:
+                    pass
+        _write_tombstones(d, np.zeros(0, dtype=np.int64))
+        after = sum(len(i) for i in ids)
+    return {"user_id": user_id, "segments": len(names), "rows_before": before, "rows_after": after,
+            "segment": new}
+
+
+def maybe_compact(user_id: int):
+    d = _user_dir(user_id)
+    names = _segment_names(d)
+    if len(names) > COMPACT_MAX_SEGMENTS:
+        compact(user_id)
+        return
+    dead_docs = _tombstones(d)
+    if not len(dead_docs):
+        return
+    total = dead = 0
+    for name in names:
+        ids = np.load(os.path.join(d, name + ".ids.npy"))
+        total += len(ids)
+        dead += int(np.isin(ids[:, 1], dead_docs).sum()) if len(ids) else 0
+    if total and dead > COMPACT_DEAD_RATIO * total:
+        compact(user_id)
+
+
+# --------------------------- CLI ---------------------------
+
+def migrate(clear_blobs: bool = False, batch: int = 5000) -> List[dict]:
+    """Export existing chunks.embedding blobs into per-user segments."""
+    from sqlalchemy import select, update
+    from .db import SessionLocal
+    from .models import Chunk, Document
+
+    out = []
+    db = SessionLocal()
+    try:
+        user_ids = db.scalars(select(Document.user_id).distinct()).all()
+        for uid in user_ids:
+            done = {int(c) for name, _, ids in open_segments(uid)[0] for c in ids[:, 0]}
+            last_id, exported = 0, 0
+            while True:
+                rows = db.execute(
+                    select(Chunk.id, Chunk.document_id, Chunk.page, Chunk.embedding)
+                    .join(Document, Chunk.document_id == Document.id)
+                    .where(Document.user_id == uid, Chunk.id > last_id)
+                    .order_by(Chunk.id).limit(batch)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                rows = [r for r in rows if r.embedding and r.id not in done]
+                if not rows:
+                    continue
+                mat = np.frombuffer(b"".join(r.embedding for r in rows), dtype=np.float32).reshape(len(rows), -1)
+                append(uid, [r.id for r in rows], [r.document_id for r in rows], [r.page for r in rows], mat)
+                if clear_blobs:
+                    db.execute(update(Chunk).where(Chunk.id.in_([r.id for r in rows])).values(embedding=b""))
+                    db.commit()
+                exported += len(rows)
+            if exported:
+                keep = np.asarray(db.scalars(
+                    select(Chunk.id).join(Document, Chunk.document_id == Document.id).where(Document.user_id == uid)
+                ).all(), dtype=np.int64)
+                compact(uid, keep_chunk_ids=keep)
+            out.append({"user_id": uid, "exported": exported})
+    finally:
+        db.close()
+    return out
+
+
+def _all_users() -> List[int]:
+    if not os.path.isdir(VECTOR_DIR):
+        return []
+    return sorted(int(n) for n in os.listdir(VECTOR_DIR) if n.isdigit())
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(prog="python -m app.vecstore")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate", help="export chunks.embedding blobs into the memmap store")
+    m.add_argument("--clear-blobs", action="store_true", help="empty the DB blobs once exported")
+    c = sub.add_parser("compact", help="drop deleted documents and merge segments")
+    c.add_argument("--user", type=int)
+    args = ap.parse_args()
+    if args.cmd == "migrate":
+        for r in migrate(clear_blobs=args.clear_blobs):
+            print(r)
+    else:
+        for uid in ([args.user] if args.user else _all_users()):
+            print(compact(uid))
@@ -0,0 +1,107 @@
+"""
+Chunk insert throughput: ORM unit of work vs core bulk INSERT, on SQLite's
+default settings vs SQLITE_PROFILE=tuned. A reader thread queries the table
+during the writes to show how long it waits behind the writer.
+
+  python -m bench.bench_inserts --rows 20000
+  python -m bench.bench_inserts --rows 50000 --per-doc 500 --dim 384
+
+Every run uses a fresh database file in a temp directory (under --dir if given).
+"""
+import argparse, json, os, tempfile, threading, time
+import numpy as np
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.db import Base, apply_sqlite_profile
+from app.models import User, Document, Chunk
+from app.jobs import bulk_insert_chunks
+
+
+def _setup(path: str, profile: str):
+    eng = create_engine(f"sqlite:///{path}", future=True, connect_args={"check_same_thread": False})
+    apply_sqlite_profile(eng, profile)
+    Base.metadata.create_all(eng)
+    Session = sessionmaker(bind=eng, autoflush=False, future=True)
+    db = Session()
+    user = User(email="bench@example.com", password_hash="x")
+    db.add(user)
+    db.commit()
+    return eng, Session, db, user.id
+
+
+def _write_orm(db, doc_id, texts, embs, start):
+    db.add_all([Chunk(document_id=doc_id, position=start + i, text=t, embedding=e.tobytes(), page=None)
+                for i, (t, e) in enumerate(zip(texts, embs))])
+    db.flush()
+    db.commit()
+
+
+def _write_bulk(db, doc_id, texts, embs, start):
+    bulk_insert_chunks(db, [{"document_id": doc_id, "position": start + i, "text": t, "embedding": e.tobytes(),
+                             "page": None, "page_end": None} for i, (t, e) in enumerate(zip(texts, embs))])
+    db.commit()
+
+
+def _reader(Session, stop: threading.Event, lat: list):
+    db = Session()
+    try:
+        while not stop.is_set():
+            t = time.perf_counter()
+            db.scalar(select(func.count(Chunk.id)).where(Chunk.document_id == 1))
+            db.rollback()
+            lat.append(time.perf_counter() - t)
+            time.sleep(0.002)
+    finally:
+        db.close()
+
+
+def run(method: str, profile: str, rows: int, per_doc: int, dim: int, text_chars: int, where=None) -> dict:
+    rng = np.random.default_rng(0)
+    text = "x" * text_chars
+    with tempfile.TemporaryDirectory(dir=where) as d:
+        eng, Session, db, user_id = _setup(os.path.join(d, "bench.db"), profile)
+        write = _write_orm if method == "orm" else _write_bulk
+        stop, lat = threading.Event(), []
+        reader = threading.Thread(target=_reader, args=(Session, stop, lat), daemon=True)
+        reader.start()
+        t0 = time.perf_counter()
+        done = 0
+        while done < rows:
+            n = min(per_doc, rows - done)
+            doc = Document(user_id=user_id, filename="bench.pdf", path="-", size=0)
+            db.add(doc)
+            db.commit()
+            embs = rng.normal(size=(n, dim)).astype(np.float32)
+            write(db, doc.id, [text] * n, embs, 0)
+            done += n
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        reader.join()
+        db.close()
+        eng.dispose()
+    lat_ms = np.array(lat) * 1000 if lat else np.zeros(1)
+    return {
+        "method": method, "profile": profile, "rows": rows,
+        "seconds": round(elapsed, 3), "rows_per_sec": round(rows / elapsed),
+        "reader_queries": len(lat), "reader_p50_ms": round(float(np.percentile(lat_ms, 50)), 2),
+        "reader_max_ms": round(float(lat_ms.max()), 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--per-doc", type=int, default=200, help="chunks committed together (one document)")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--text-chars", type=int, default=3600)
+    ap.add_argument("--dir", help="where to create the database (use the real data disk; /tmp may be RAM)")
+    args = ap.parse_args()
+
+    for profile in ("default", "tuned"):
+        for method in ("orm", "bulk"):
+            print(json.dumps(run(method, profile, args.rows, args.per_doc, args.dim, args.text_chars, args.dir)))
+
+
+if __name__ == "__main__":
+    main()
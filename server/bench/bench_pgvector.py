@@ -0,0 +1,120 @@
+"""
+pgvector retrieval against a local Postgres: latency and recall@k of the
+in-database search (pgvec.search) vs exact NumPy search, with --threads
+concurrent askers sharing the connection pool.
+
+  docker run -d --name pgv -e POSTGRES_PASSWORD=pg -p 5432:5432 pgvector/pgvector:pg16
+  DB_URL=postgresql+psycopg://postgres:pg@localhost:5432/postgres \\
+      python -m bench.bench_pgvector --rows 100000 --users 20
+
+Seeds synthetic users/documents/chunks into DB_URL (use a throwaway database)
+and removes them afterwards unless --keep.
+"""
+import argparse, json, threading, time
+import numpy as np
+from sqlalchemy import delete, select
+
+from app.db import Base, SessionLocal, engine
+from app.jobs import bulk_insert_chunks
+from app.models import Chunk, Document, User
+from app import pgvec
+
+
+def _seed(rows: int, users: int, dim: int, per_doc: int):
+    rng = np.random.default_rng(0)
+    owners = {}
+    with SessionLocal() as db:
+        uids = []
+        for u in range(users):
+            user = User(email=f"pgbench-{u}@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            uids.append(user.id)
+        done = 0
+        while done < rows:
+            uid = uids[(done // per_doc) % users]
+            n = min(per_doc, rows - done)
+            doc = Document(user_id=uid, filename="bench.txt", path="-", size=0)
+            db.add(doc)
+            db.commit()
+            embs = rng.normal(size=(n, dim)).astype(np.float32)
+            embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+            ids = bulk_insert_chunks(db, [{"document_id": doc.id, "position": i, "text": "-", "embedding": b"",
+                                           "page": None, "page_end": None, "vec": e} for i, e in enumerate(embs)])
+            db.commit()
+            owners.setdefault(uid, ([], []))
+            owners[uid][0].extend(ids)
+            owners[uid][1].append(embs)
+            done += n
+    return {uid: (np.asarray(ids), np.concatenate(mats)) for uid, (ids, mats) in owners.items()}
+
+
+def _cleanup(uids):
+    with SessionLocal() as db:
+        docs = select(Document.id).where(Document.user_id.in_(uids))
+        db.execute(delete(Chunk).where(Chunk.document_id.in_(docs)))
+        db.execute(delete(Document).where(Document.user_id.in_(uids)))
+        db.execute(delete(User).where(User.id.in_(uids)))
+        db.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--users", type=int, default=10)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--per-doc", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--top-k", type=int, default=6)
+    ap.add_argument("--keep", action="store_true")
+    args = ap.parse_args()
+    if not pgvec.enabled():
+        raise SystemExit("set DB_URL=postgresql+psycopg://... (and leave VECTOR_STORE unset or 'pgvector')")
+
+    pgvec.ensure_extension()
+    Base.metadata.create_all(bind=engine)
+    pgvec.ensure_schema()
+    t = time.perf_counter()
+    data = _seed(args.rows, args.users, args.dim, args.per_doc)
+    seed_s = time.perf_counter() - t
+    try:
+        rng = np.random.default_rng(1)
+        uids = list(data)
+        work = [(uids[i % len(uids)], rng.normal(size=args.dim).astype(np.float32)) for i in range(args.queries)]
+        lat, recall, lock = [], [], threading.Lock()
+
+        def worker(items):
+            with SessionLocal() as db:
+                for uid, q in items:
+                    q = q / np.linalg.norm(q)
+                    s = time.perf_counter()
+                    got = {cid for _, cid in pgvec.search(db, uid, q, args.top_k)}
+                    ms = (time.perf_counter() - s) * 1000
+                    db.rollback()
+                    ids, mat = data[uid]
+                    exact = set(ids[np.argsort(-(mat @ q))[: args.top_k]].tolist())
+                    with lock:
+                        lat.append(ms)
+                        recall.append(len(got & exact) / len(exact))
+
+        threads = [threading.Thread(target=worker, args=(work[i:: args.threads],)) for i in range(args.threads)]
+        t = time.perf_counter()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        wall = time.perf_counter() - t
+        lat = np.array(lat)
+        print(json.dumps({
+            "rows": args.rows, "users": args.users, "index": pgvec.PGVECTOR_INDEX, "seed_s": round(seed_s, 1),
+            "qps": round(len(lat) / wall, 1), "p50_ms": round(float(np.percentile(lat, 50)), 2),
+            "p95_ms": round(float(np.percentile(lat, 95)), 2), f"recall@{args.top_k}": round(float(np.mean(recall)), 4),
+        }))
+    finally:
+        if not args.keep:
+            _cleanup(list(data))
+
+
+if __name__ == "__main__":
+    main()
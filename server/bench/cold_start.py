@@ -0,0 +1,74 @@
+"""
+Cold start: launch the API in a fresh process and time, from process start,
+when it answers /healthz, when /readyz turns 200, the first upload (ingested
+inline) and the first answer. Runs once with background warmup and once with
+WARMUP=0, each against a fresh database and storage dir.
+
+  python -m bench.cold_start
+  python -m bench.cold_start --modes warm --question "Top customer complaints?"   # LLM question, needs GROQ_API_KEY
+
+The default question hits the deterministic weekly-revenue path, so no LLM
+key is needed for it.
+"""
+import argparse, json, os, subprocess, sys, tempfile, time
+import httpx
+
+_TABLE = "\n".join(f"2024-04-{d:02d}  orders {d * 3}  ${1000 + d * 17:,.2f}" for d in range(1, 31))
+
+
+def _wait(client: httpx.Client, path: str, t0: float, timeout: float, proc) -> float:
+    while time.perf_counter() - t0 < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter() - t0
+        except httpx.TransportError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{path} not 200 after {timeout:.0f}s")
+
+
+def run(mode: str, port: int, question: str, timeout: float, where=None) -> dict:
+    with tempfile.TemporaryDirectory(dir=where) as d:
+        env = dict(os.environ, DB_URL=f"sqlite:///{os.path.join(d, 'app.db')}", STORAGE_DIR=d,
+                   INGEST_WORKERS="0", EXTRACT_WORKERS="0", WARMUP="1" if mode == "warm" else "0")
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+                alive = _wait(client, "/healthz", t0, timeout, proc)
+                ready = _wait(client, "/readyz", t0, timeout, proc)
+                token = client.post("/api/auth/register", json={"email": "bench@example.com",
+                                                                "password": "bench-pass"}).json()["token"]
+                auth = {"Authorization": f"Bearer {token}"}
+                r = client.post("/api/documents/upload", headers=auth,
+                                files={"file": ("april.txt", _TABLE.encode(), "text/plain")})
+                r.raise_for_status()
+                uploaded = time.perf_counter() - t0
+                r = client.post("/api/knowledge/ask", headers=auth, json={"question": question})
+                r.raise_for_status()
+                answered = time.perf_counter() - t0
+        finally:
+            proc.terminate()
+            proc.wait()
+    return {"mode": mode, "alive_s": round(alive, 3), "ready_s": round(ready, 3),
+            "first_upload_s": round(uploaded, 3), "first_answer_s": round(answered, 3)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--modes", default="warm,cold", help="comma-separated: warm (WARMUP=1), cold (WARMUP=0)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--question", default="What was the revenue in the first week of April?")
+    ap.add_argument("--timeout", type=float, default=300)
+    ap.add_argument("--dir", help="where to create the temporary database and storage")
+    args = ap.parse_args()
+
+    for mode in args.modes.split(","):
+        print(json.dumps(run(mode.strip(), args.port, args.question, args.timeout, args.dir)))
+
+
+if __name__ == "__main__":
+    main()
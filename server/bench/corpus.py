@@ -0,0 +1,177 @@
+"""
+Synthetic, seeded corpus for the benchmarks: PDFs (customer feedback plus a
+daily revenue table), DOCX files (policies and a customer list) and PNG
+scans of revenue tables for the OCR path. Revenue lines use the
+"YYYY-MM-DD ... $1,234.56" layout that utils._ROW parses, so the weekly
+revenue fast path has rows to answer from.
+
+  python -m bench.corpus --out /tmp/corpus --docs 30
+  python -m bench.corpus --out /tmp/corpus --docs 9 --kinds pdf,png --pages 40
+
+The same --seed always produces the same bytes. bench/load.py imports
+make_document() to build unique uploads on the fly.
+"""
+import argparse, io, json, os, random
+from datetime import date, timedelta
+from typing import List, Tuple
+
+KINDS = ("pdf", "docx", "png")
+
+_CUSTOMERS = ["Acme Corp", "Globex", "Initech", "Umbrella", "Stark Industries", "Wayne Enterprises",
+              "Hooli", "Vandelay Imports", "Soylent", "Wonka Industries", "Tyrell Corp", "Cyberdyne"]
+_TOPICS = ["late delivery", "damaged packaging", "billing error", "great support", "missing items",
+           "slow refunds", "website checkout bug", "friendly driver", "wrong size", "price increase"]
+_POLICIES = ["Refunds are issued within {n} business days of receiving the returned item.",
+             "Orders above ${n},000.00 require a manager approval before shipping.",
+             "Support tickets are answered within {n} hours on weekdays.",
+             "Warehouse staff perform a stock count every {n} weeks.",
+             "Invoices are due {n} days after the delivery date."]
+
+
+def revenue_lines(rng: random.Random, month_start: date, days: int = 30) -> List[str]:
+    """One "YYYY-MM-DD  orders N  $X,XXX.XX" row per day (the _ROW format)."""
+    out = []
+    for i in range(days):
+        day = month_start + timedelta(days=i)
+        if day.month != month_start.month:
+            break
+        out.append(f"{day.isoformat()}  orders {rng.randint(5, 90)}  ${rng.uniform(400, 9000):,.2f}")
+    return out
+
+
+def feedback_lines(rng: random.Random, n: int, tag: str = "") -> List[str]:
+    out = []
+    for i in range(n):
+        who, topic = rng.choice(_CUSTOMERS), rng.choice(_TOPICS)
+        out.append(f"Ticket {tag}{i:04d}: {who} reported {topic}; rating {rng.randint(1, 5)}/5.")
+    return out
+
+
+def _month(rng: random.Random) -> date:
+    return date(rng.choice([2023, 2024]), rng.randint(1, 12), 1)
+
+
+# --------------------------- writers ---------------------------
+
+def _pdf_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def pdf_bytes(lines: List[str], lines_per_page: int = 55) -> bytes:
+    """Minimal text PDF (Helvetica, one content stream per page); no PDF library needed to write it."""
+    pages = [lines[i: i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    font_id, pages_id = 3, 2
+    kids = []
+    objs: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+                         b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for page in pages:
+        text = "BT /F1 10 Tf 13 TL 50 790 Td " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in page) + " ET"
+        stream = text.encode("latin-1", "replace")
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objs)
+        objs.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+                    b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (content_id, font_id))
+        kids.append(len(objs))  # object n is objs[n - 1]
+    objs[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for n, obj in enumerate(objs, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % n + obj + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref))
+    return out.getvalue()
+
+
+def docx_bytes(title: str, paragraphs: List[str]) -> bytes:
+    import docx
+    d = docx.Document()
+    d.add_heading(title, level=1)
+    for p in paragraphs:
+        d.add_paragraph(p)
+    buf = io.BytesIO()
+    d.save(buf)
+    return buf.getvalue()
+
+
+def _font(size: int):
+    from PIL import ImageFont
+    for name in ("DejaVuSansMono.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)  # Pillow >= 10.1
+
+
+def png_bytes(lines: List[str], font_size: int = 22) -> bytes:
+    """A clean black-on-white "scan" of the lines, large enough for tesseract."""
+    from PIL import Image, ImageDraw
+    font = _font(font_size)
+    step = int(font_size * 1.6)
+    img = Image.new("L", (1100, 60 + step * len(lines)), 255)
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines):
+        draw.text((40, 30 + i * step), line, fill=0, font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# --------------------------- documents ---------------------------
+
+def make_document(kind: str, seed: int, pages: int = 3) -> Tuple[str, bytes, dict]:
+    """(filename, bytes, facts) for one synthetic document; facts lists the revenue month it contains, if any."""
+    rng = random.Random(f"{kind}-{seed}")
+    tag = f"{seed}-"
+    if kind == "pdf":
+        month = _month(rng)
+        lines = [f"Quarterly report #{seed}", ""] + feedback_lines(rng, max(0, pages * 55 - 40), tag)
+        lines += ["", f"Daily sales for {month:%B %Y}"] + revenue_lines(rng, month)
+        return f"report-{seed}.pdf", pdf_bytes(lines), {"revenue_month": month.isoformat()[:7]}
+    if kind == "docx":
+        paras = [p.format(n=rng.randint(2, 14)) for p in _POLICIES]
+        paras += [f"Key account: {c}, contact since {rng.randint(2012, 2023)}." for c in rng.sample(_CUSTOMERS, 5)]
+        paras += feedback_lines(rng, pages * 20, tag)
+        return f"policies-{seed}.docx", docx_bytes(f"Operations handbook #{seed}", paras), {}
+    if kind == "png":
+        month = _month(rng)
+        lines = [f"Sales {month:%B %Y}"] + revenue_lines(rng, month)
+        return f"sales-{seed}.png", png_bytes(lines), {"revenue_month": month.isoformat()[:7]}
+    raise ValueError(f"unknown kind {kind!r} ({', '.join(KINDS)})")
+
+
+def generate(out_dir: str, docs: int, kinds=KINDS, seed: int = 0, pages: int = 3) -> List[dict]:
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = []
+    for i in range(docs):
+        kind = kinds[i % len(kinds)]
+        name, data, facts = make_document(kind, seed + i, pages)
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(data)
+        manifest.append({"file": name, "kind": kind, "bytes": len(data), **facts})
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--docs", type=int, default=30)
+    ap.add_argument("--kinds", default=",".join(KINDS))
+    ap.add_argument("--pages", type=int, default=3, help="approximate pages of text per PDF/DOCX")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    manifest = generate(args.out, args.docs, [k.strip() for k in args.kinds.split(",")], args.seed, args.pages)
+    print(json.dumps({"out": args.out, "docs": len(manifest), "bytes": sum(m["bytes"] for m in manifest)}))
+
+
+if __name__ == "__main__":
+    main()
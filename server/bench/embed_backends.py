@@ -0,0 +1,83 @@
+"""
+Embedding backends side by side: parity of each backend against torch
+(cosine between the two vectors of the same text) and encode throughput.
+
+  python -m bench.embed_backends
+  python -m bench.embed_backends --texts 2000 --batch 64 --backends torch,onnx,onnx-int8 --min-cos 0.99
+
+Exits non-zero when a backend's minimum cosine to torch is below --min-cos,
+so it can gate a switch of EMB_BACKEND. Texts are chunk-sized slices of
+--corpus (any text file) or generated sentences.
+"""
+import argparse, json, random, sys, time
+import numpy as np
+
+from app import embedders
+from app.ingest import EMB_MODEL_NAME, chunk_text
+
+_WORDS = ("revenue invoice customer refund shipping order april march total tax discount complaint "
+          "delivery product feedback quarter margin supplier payment balance week daily store").split()
+
+
+def _texts(n: int, corpus=None) -> list:
+    if corpus:
+        with open(corpus, encoding="utf-8", errors="ignore") as f:
+            chunks = [c for c in chunk_text(f.read(), max_tokens=220, overlap=20) if c.strip()]
+        return (chunks * (n // max(len(chunks), 1) + 1))[:n]
+    rng = random.Random(0)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 600))) for _ in range(n)]
+
+
+def _load(name: str, model: str):
+    if name == "torch":
+        return embedders.TorchEmbedder(model)
+    if name == "onnx":
+        return embedders.OnnxEmbedder(model, quantize=False)
+    if name == "onnx-int8":
+        return embedders.OnnxEmbedder(model, quantize=True)
+    raise ValueError(name)
+
+
+def _throughput(emb, texts, batch: int) -> float:
+    emb.encode(texts[:batch])  # warm
+    t = time.perf_counter()
+    for s in range(0, len(texts), batch):
+        emb.encode(texts[s: s + batch])
+    return len(texts) / (time.perf_counter() - t)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default=EMB_MODEL_NAME)
+    ap.add_argument("--backends", default="torch,onnx,onnx-int8")
+    ap.add_argument("--texts", type=int, default=1000)
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--corpus", help="text file to slice into chunks instead of generated text")
+    ap.add_argument("--min-cos", type=float, default=0.99)
+    args = ap.parse_args()
+
+    texts = _texts(args.texts, args.corpus)
+    names = [b.strip() for b in args.backends.split(",")]
+    ref = None
+    ok = True
+    for name in ["torch"] + [b for b in names if b != "torch"]:
+        t = time.perf_counter()
+        emb = _load(name, args.model)
+        load_s = time.perf_counter() - t
+        vecs = emb.encode(texts)
+        row = {"backend": name, "load_s": round(load_s, 2),
+               "texts_per_sec": round(_throughput(emb, texts, args.batch), 1),
+               "norm_err": round(float(np.abs(np.linalg.norm(vecs, axis=1) - 1).max()), 6)}
+        if ref is None:
+            ref = vecs
+        else:
+            cos = (vecs * ref).sum(axis=1)
+            row.update(cos_mean=round(float(cos.mean()), 5), cos_min=round(float(cos.min()), 5))
+            ok &= float(cos.min()) >= args.min_cos
+        if name in names:
+            print(json.dumps(row))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
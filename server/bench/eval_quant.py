@@ -0,0 +1,92 @@
+"""
+Recall / memory / latency of the quantized first pass versus exact search.
+
+  python -m bench.eval_quant --synthetic 50000
+  python -m bench.eval_quant --user 1          # a real tenant from DB_URL / VECTOR_STORE
+
+Queries are perturbed copies of stored vectors. Recall@k is measured
+against exact float32 brute force, for each codec both with and without
+the float32 rescoring pass.
+"""
+import argparse, json, time
+import numpy as np
+
+from app import quant
+from app.index import UserIndex
+
+
+def synthetic(n: int, dim: int = 384, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def from_db(user_id: int) -> np.ndarray:
+    from app.db import SessionLocal
+    from app.index import load_index
+    db = SessionLocal()
+    try:
+        idx = load_index(db, user_id)
+    finally:
+        db.close()
+    if idx is None:
+        raise SystemExit(f"user {user_id} has no chunks")
+    return np.concatenate([s.vectors(np.flatnonzero(s.alive[: s.n])) for s in idx.segments])
+
+
+def build(x: np.ndarray, codec: str) -> UserIndex:
+    quant_before = quant.INDEX_QUANT
+    quant.INDEX_QUANT = codec
+    try:
+        idx = UserIndex(x.shape[1], capacity=len(x))
+    finally:
+        quant.INDEX_QUANT = quant_before
+    idx.add(np.arange(len(x)), np.zeros(len(x)), [None] * len(x), x)
+    return idx
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--synthetic", type=int, default=0, help="number of random clustered vectors")
+    ap.add_argument("--user", type=int, help="evaluate a real tenant instead")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--rescore", type=int, default=quant.INDEX_RESCORE)
+    args = ap.parse_args()
+
+    x = from_db(args.user) if args.user else synthetic(args.synthetic or 20000)
+    rng = np.random.default_rng(1)
+    q = x[rng.integers(0, len(x), args.queries)] + 0.05 * rng.normal(size=(args.queries, x.shape[1]))
+    q = (q / np.linalg.norm(q, axis=1, keepdims=True)).astype(np.float32)
+    x = x.astype(np.float32)
+    # rescoring of in-memory segments fetches exact vectors by chunk id (= row here)
+    fetch = lambda ids: {i: x[i] for i in ids}
+
+    exact = build(x, "none")
+    truth = [{c for _, c in exact.search(v, args.k)} for v in q]
+    t = time.perf_counter()
+    for v in q:
+        exact.search(v, args.k)
+    report = {"n": len(x), "dim": x.shape[1], "k": args.k, "queries": len(q), "results": [{
+        "codec": "none", "rescore": 0, "recall": 1.0, "bytes_per_vector": x.shape[1] * 4,
+        "ms_per_query": round((time.perf_counter() - t) * 1000 / len(q), 3),
+    }]}
+
+    for name in ("float16", "int8", "binary"):
+        idx = build(x, name)
+        seg = idx.segments[0]
+        bpv = seg.codes[: seg.n].nbytes / seg.n + 4
+        for rescore in (0, args.rescore):
+            quant.INDEX_RESCORE = max(rescore, args.k)
+            t = time.perf_counter()
+            got = [{c for _, c in idx.search(v, args.k, fetch_exact=fetch if rescore else None)} for v in q]
+            dt = (time.perf_counter() - t) * 1000 / len(q)
+            recall = float(np.mean([len(a & b) / len(a) for a, b in zip(truth, got)]))
+            report["results"].append({"codec": name, "rescore": rescore, "recall": round(recall, 4),
+                                       "bytes_per_vector": round(bpv, 1), "ms_per_query": round(dt, 3)})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
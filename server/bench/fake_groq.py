@@ -0,0 +1,120 @@
+"""
+Local stand-in for Groq's OpenAI-compatible chat-completions API, so load
+tests measure this server rather than a remote model. Point the app at it
+with GROQ_BASE_URL (read by the groq SDK):
+
+  python -m bench.fake_groq --port 8899 --ttft-ms 300 --tps 80 --tokens 120
+  GROQ_BASE_URL=http://127.0.0.1:8899 GROQ_API_KEY=fake uvicorn app.main:app
+
+Non-streaming calls sleep ttft + tokens / tps and return one completion;
+streaming calls send the first delta after ttft and one token every 1 / tps
+seconds, with usage on the final chunk under x_groq like the real API.
+--jitter adds +/- that fraction of randomness to both delays.
+"""
+import argparse, asyncio, json, random, time, uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+_WORDS = ("revenue grew steadily while support tickets about late delivery fell; the strongest week "
+          "was driven by repeat orders from key accounts and the main complaint remains billing errors").split()
+
+config = {"ttft_ms": 300.0, "tps": 80.0, "tokens": 120, "jitter": 0.1}
+stats = {"requests": 0, "streams": 0, "cancelled": 0, "in_flight": 0, "peak_in_flight": 0}
+
+app = FastAPI(title="fake groq")
+
+
+def _jit(x: float) -> float:
+    j = config["jitter"]
+    return max(0.0, x * (1 + random.uniform(-j, j)))
+
+
+def _prompt_tokens(messages) -> int:
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + 4 * len(messages)
+
+
+def _usage(prompt: int, completion: int, elapsed: float) -> dict:
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+            "total_time": round(elapsed, 4)}
+
+
+def _answer_tokens(n: int):
+    return [("" if i == 0 else " ") + _WORDS[i % len(_WORDS)] for i in range(n)]
+
+
+@app.get("/openai/v1/models")
+def models():
+    return {"object": "list", "data": [{"id": "llama3-70b-8192", "object": "model", "owned_by": "fake"}]}
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat(request: Request):
+    body = await request.json()
+    model = body.get("model", "llama3-70b-8192")
+    n = int(body.get("max_tokens") or config["tokens"])
+    prompt = _prompt_tokens(body.get("messages", []))
+    cid, created = f"chatcmpl-{uuid.uuid4().hex[:12]}", int(time.time())
+    stats["requests"] += 1
+
+    if not body.get("stream"):
+        t0 = time.perf_counter()
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(_jit(config["ttft_ms"] / 1000) + _jit(n / config["tps"]))
+        finally:
+            stats["in_flight"] -= 1
+        return {"id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(_answer_tokens(n))}}],
+                "usage": _usage(prompt, n, time.perf_counter() - t0)}
+
+    async def events():
+        t0 = time.perf_counter()
+        stats["streams"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        sent = 0
+        try:
+            await asyncio.sleep(_jit(config["ttft_ms"] / 1000))
+            for tok in _answer_tokens(n):
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                sent += 1
+                await asyncio.sleep(_jit(1 / config["tps"]))
+            last = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "x_groq": {"id": cid, "usage": _usage(prompt, sent, time.perf_counter() - t0)}}
+            yield f"data: {json.dumps(last)}\n\n"
+            yield "data: [DONE]\n\n"
+        except asyncio.CancelledError:  # the client went away mid-stream
+            stats["cancelled"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main():
+    import uvicorn
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8899)
+    ap.add_argument("--ttft-ms", type=float, default=config["ttft_ms"], help="delay before the first token")
+    ap.add_argument("--tps", type=float, default=config["tps"], help="tokens per second after the first")
+    ap.add_argument("--tokens", type=int, default=config["tokens"], help="completion length unless max_tokens is set")
+    ap.add_argument("--jitter", type=float, default=config["jitter"])
+    args = ap.parse_args()
+    config.update(ttft_ms=args.ttft_ms, tps=args.tps, tokens=args.tokens, jitter=args.jitter)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Load harness: drives upload, upload/batch, ask and ask/stream at a fixed
+concurrency and prints one JSON line per scenario (p50/p95/p99 latency,
+throughput, errors, peak RSS of the API process tree), so runs can be
+diffed across commits.
+
+  python -m bench.load                                   # everything, 8 concurrent, 100 requests each
+  python -m bench.load --scenarios ask,ask_stream --concurrency 32 --requests 500 --ttft-ms 400 --tps 60
+  python -m bench.load --url http://127.0.0.1:8000 --pid 1234 --scenarios ask   # an already running API
+
+By default it starts bench/fake_groq.py and a fresh API (sqlite + storage in
+a temp dir, answer cache off so every ask reaches the LLM stand-in), seeds
+--users accounts with a synthetic corpus (bench/corpus.py) and waits until
+ingestion is done before the ask scenarios. Upload scenarios also report
+drain_s: time until the background workers finished every uploaded file.
+Peak RSS is sampled from /proc (Linux) every 100 ms over the API process and
+its children (extraction workers).
+"""
+import argparse, asyncio, json, os, random, subprocess, sys, tempfile, threading, time
+from typing import Dict, List, Optional
+import httpx
+import numpy as np
+
+from bench.corpus import KINDS, make_document
+
+SCENARIOS = ("upload", "upload_batch", "ask", "ask_stream")
+
+_RAG_QUESTIONS = ["What did {c} report in their tickets?", "What is the refund policy?",
+                  "Summarize the main customer complaints.", "When are invoices due?",
+                  "Which key accounts do we have and since when?", "How fast are support tickets answered?"]
+_CUSTOMERS = ["Acme Corp", "Globex", "Initech", "Umbrella", "Hooli", "Soylent"]
+_ORDINALS = ["first", "second", "third", "fourth"]
+
+
+# --------------------------- process helpers ---------------------------
+
+def _children() -> Dict[int, List[int]]:
+    tree: Dict[int, List[int]] = {}
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        tree.setdefault(ppid, []).append(int(d))
+    return tree
+
+
+def tree_rss_mb(pid: int) -> float:
+    tree, todo, total = _children(), [pid], 0
+    while todo:
+        p = todo.pop()
+        todo.extend(tree.get(p, []))
+        try:
+            with open(f"/proc/{p}/status") as f:
+                total += next(int(l.split()[1]) for l in f if l.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            continue
+    return total / 1024
+
+
+class RssSampler:
+    """Peak RSS of a process tree between start() and stop(); None when /proc or the pid is unavailable."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        self.pid, self.interval = pid, interval
+        self.peak: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = tree_rss_mb(self.pid)
+            if rss:
+                self.peak = max(self.peak or 0.0, rss)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.pid and os.path.isdir("/proc"):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> Optional[float]:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        return round(self.peak, 1) if self.peak is not None else None
+
+
+def _wait_http(url: str, proc, timeout: float):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"{url}: process exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} not 200 after {timeout:.0f}s")
+
+
+def start_stack(args, workdir: str):
+    """(api_url, api_proc, groq_proc) for a fresh API wired to a fresh fake Groq."""
+    groq_proc = None
+    groq_url = args.groq_url
+    if not groq_url:
+        groq_url = f"http://127.0.0.1:{args.groq_port}"
+        groq_proc = subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_groq", "--port", str(args.groq_port), "--ttft-ms", str(args.ttft_ms),
+             "--tps", str(args.tps), "--tokens", str(args.tokens)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _wait_http(f"{groq_url}/openai/v1/models", groq_proc, 60)
+    env = dict(os.environ, DB_URL=f"sqlite:///{os.path.join(workdir, 'app.db')}", STORAGE_DIR=workdir,
+               GROQ_BASE_URL=groq_url, GROQ_API_KEY=os.getenv("GROQ_API_KEY", "fake"),
+               ANSWER_CACHE="1" if args.answer_cache else "0")
+    api_proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port)],
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}"
+    _wait_http(f"{url}/readyz", api_proc, args.timeout)
+    return url, api_proc, groq_proc
+
+
+# --------------------------- scenarios ---------------------------
+
+class Run:
+    def __init__(self, name: str):
+        self.name = name
+        self.lat: List[float] = []
+        self.ttfb: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.doc_ids: Dict[str, List[int]] = {}
+        self.docs = []  # pre-built uploads, so document generation stays out of the timings
+
+    def error(self, what):
+        self.errors[str(what)] = self.errors.get(str(what), 0) + 1
+
+
+def _pct(xs: List[float]) -> dict:
+    if not xs:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    a = np.asarray(xs) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(a, p)), 1) for p in (50, 95, 99)}
+
+
+def _question(rng: random.Random, months: List[str]) -> str:
+    if months and rng.random() < 0.3:  # deterministic weekly-revenue path
+        y, m = rng.choice(months).split("-")
+        month = time.strftime("%B", time.strptime(m, "%m"))
+        return f"What was the revenue in the {rng.choice(_ORDINALS)} week of {month} {y}?"
+    return rng.choice(_RAG_QUESTIONS).format(c=rng.choice(_CUSTOMERS))
+
+
+async def _upload(client, token, i, args, run):
+    name, data, _ = run.docs[i]
+    r = await client.post("/api/documents/upload", headers={"Authorization": f"Bearer {token}"},
+                          files={"file": (name, data)})
+    r.raise_for_status()
+    run.doc_ids.setdefault(token, []).append(r.json()["id"])
+
+
+async def _upload_batch(client, token, i, args, run):
+    docs = run.docs[i * args.batch_size: (i + 1) * args.batch_size]
+    r = await client.post("/api/documents/upload/batch", headers={"Authorization": f"Bearer {token}"},
+                          files=[("files", (name, data)) for name, data, _ in docs])
+    r.raise_for_status()
+    run.doc_ids.setdefault(token, []).extend(d["id"] for d in r.json())
+
+
+async def _ask(client, token, i, args, run):
+    q = _question(random.Random(i), args.months)
+    r = await client.post("/api/knowledge/ask", headers={"Authorization": f"Bearer {token}"},
+                          json={"question": q, "top_k": args.top_k})
+    r.raise_for_status()
+
+
+async def _ask_stream(client, token, i, args, run):
+    q = _question(random.Random(i), args.months)
+    t0 = time.perf_counter()
+    async with client.stream("POST", "/api/knowledge/ask/stream", headers={"Authorization": f"Bearer {token}"},
+                             json={"question": q, "top_k": args.top_k}) as r:
+        r.raise_for_status()
+        first = None
+        async for chunk in r.aiter_bytes():
+            if first is None and chunk:
+                first = time.perf_counter() - t0
+        if first is not None:
+            run.ttfb.append(first)
+
+
+_OPS = {"upload": _upload, "upload_batch": _upload_batch, "ask": _ask, "ask_stream": _ask_stream}
+
+
+async def _drain(client: httpx.AsyncClient, doc_ids: Dict[str, List[int]], timeout: float) -> dict:
+    """Wait until every uploaded document left pending/processing; returns the final status counts."""
+    pending = {tok: set(ids) for tok, ids in doc_ids.items()}
+    counts: Dict[str, int] = {}
+    t0 = time.perf_counter()
+    while any(pending.values()) and time.perf_counter() - t0 < timeout:
+        for tok, ids in pending.items():
+            if not ids:
+                continue
+            r = await client.get("/api/documents", headers={"Authorization": f"Bearer {tok}"})
+            for d in r.json():
+                if d["id"] in ids and d["status"] not in ("pending", "processing"):
+                    ids.discard(d["id"])
+                    counts[d["status"]] = counts.get(d["status"], 0) + 1
+        await asyncio.sleep(0.2)
+    if any(pending.values()):
+        counts["timeout"] = sum(len(v) for v in pending.values())
+    return counts
+
+
+async def run_scenario(name: str, url: str, tokens: List[str], args, pid: Optional[int]) -> dict:
+    run, op = Run(name), _OPS[name]
+    total = args.requests if name != "upload_batch" else max(1, args.requests // args.batch_size)
+    todo = iter(range(total))
+    if name.startswith("upload"):
+        files = total * (args.batch_size if name == "upload_batch" else 1)
+        run.docs = [make_document(KINDS[j % len(KINDS)], args.doc_seed + j, args.pages) for j in range(files)]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        async def worker():
+            for i in todo:
+                t0 = time.perf_counter()
+                try:
+                    await op(client, tokens[i % len(tokens)], i, args, run)
+                    run.lat.append(time.perf_counter() - t0)
+                except httpx.HTTPStatusError as e:
+                    run.error(e.response.status_code)
+                except httpx.HTTPError as e:
+                    run.error(type(e).__name__)
+
+        rss = RssSampler(pid).start()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - t0
+        out = {"scenario": name, "concurrency": args.concurrency, "requests": total, "ok": len(run.lat),
+               "errors": run.errors, "rps": round(len(run.lat) / wall, 2) if wall else None, **_pct(run.lat)}
+        if run.ttfb:
+            out["ttfb"] = _pct(run.ttfb)
+        if run.doc_ids:
+            t1 = time.perf_counter()
+            out["ingest"] = await _drain(client, run.doc_ids, args.timeout)
+            out["drain_s"] = round(time.perf_counter() - t1, 2)
+            docs = sum(len(v) for v in run.doc_ids.values())
+            out["docs_per_s"] = round(docs / (time.perf_counter() - t0), 2)
+        out["peak_rss_mb"] = rss.stop()
+    return out
+
+
+async def seed(url: str, args) -> List[str]:
+    """Register --users accounts and ingest --seed-docs documents into each; returns their tokens."""
+    tokens = []
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout) as client:
+        for u in range(args.users):
+            email = f"load-{args.tag}-{u}@example.com"
+            r = await client.post("/api/auth/register", json={"email": email, "password": "load-pass"})
+            if r.status_code >= 400:
+                r = await client.post("/api/auth/login", json={"email": email, "password": "load-pass"})
+            r.raise_for_status()
+            tokens.append(r.json()["token"])
+        ids: Dict[str, List[int]] = {}
+        for u, tok in enumerate(tokens):
+            docs = [make_document(KINDS[j % len(KINDS)], 10_000 * (u + 1) + j, args.pages)
+                    for j in range(args.seed_docs)]
+            args.months.extend(f["revenue_month"] for _, _, f in docs if "revenue_month" in f)
+            for s in range(0, len(docs), args.batch_size):
+                r = await client.post("/api/documents/upload/batch", headers={"Authorization": f"Bearer {tok}"},
+                                      files=[("files", (n, d)) for n, d, _ in docs[s: s + args.batch_size]])
+                r.raise_for_status()
+                ids.setdefault(tok, []).extend(d["id"] for d in r.json())
+        await _drain(client, ids, args.timeout)
+    return tokens
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated: {', '.join(SCENARIOS)}")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=100, help="per scenario (upload_batch: files)")
+    ap.add_argument("--batch-size", type=int, default=8, help="files per upload/batch request")
+    ap.add_argument("--users", type=int, default=4)
+    ap.add_argument("--seed-docs", type=int, default=6, help="documents ingested per user before the ask scenarios")
+    ap.add_argument("--pages", type=int, default=3)
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--url", help="use a running API instead of starting one")
+    ap.add_argument("--pid", type=int, help="with --url: API pid to sample RSS from")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--groq-url", help="use a running fake (or real) Groq instead of starting bench.fake_groq")
+    ap.add_argument("--groq-port", type=int, default=8899)
+    ap.add_argument("--ttft-ms", type=float, default=300)
+    ap.add_argument("--tps", type=float, default=80)
+    ap.add_argument("--tokens", type=int, default=120)
+    ap.add_argument("--answer-cache", action="store_true", help="leave the answer cache on")
+    ap.add_argument("--timeout", type=float, default=600)
+    ap.add_argument("--dir", help="where to create the temporary database and storage")
+    ap.add_argument("--out", help="also append the JSON lines to this file")
+    args = ap.parse_args()
+    args.months, args.tag = [], f"{os.getpid()}-{int(time.time())}"
+    args.doc_seed = 1_000_000
+
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    for s in names:
+        if s not in _OPS:
+            raise SystemExit(f"unknown scenario {s!r} ({', '.join(SCENARIOS)})")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+        api = groq = None
+        url, pid = args.url, args.pid
+        try:
+            if not url:
+                url, api, groq = start_stack(args, workdir)
+                pid = api.pid
+            tokens = asyncio.run(seed(url, args))
+            llm = None if args.groq_url or args.url else {"ttft_ms": args.ttft_ms, "tps": args.tps, "tokens": args.tokens}
+            meta = {"commit": _commit(), "users": args.users, "seed_docs": args.seed_docs, "fake_llm": llm,
+                    "idle_rss_mb": round(tree_rss_mb(pid), 1) if pid else None}
+            for name in names:
+                result = asyncio.run(run_scenario(name, url, tokens, args, pid))
+                args.doc_seed += args.requests  # fresh bytes for the next upload scenario (no dedup)
+                line = json.dumps({**meta, **result})
+                print(line, flush=True)
+                if args.out:
+                    with open(args.out, "a") as f:
+                        f.write(line + "\n")
+        finally:
+            for proc in (api, groq):
+                if proc is not None:
+                    proc.terminate()
+                    proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os, sys, tempfile
+
+# A throwaway SQLite database and storage dir; set before app modules read their config
+_tmp = tempfile.mkdtemp(prefix="bai-tests-")
+os.environ.setdefault("DB_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("STORAGE_DIR", os.path.join(_tmp, "storage"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
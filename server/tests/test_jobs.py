@@ -0,0 +1,29 @@
+from sqlalchemy import select
+
+from app import jobs
+from app.db import SessionLocal
+from app.main import init_db
+from app.models import Document, IngestJob, User
+
+
+def test_inline_ingest_failure_marks_document_failed(tmp_path):
+    """INGEST_WORKERS=0: no worker would run a retry, so submit uses up the attempts itself."""
+    init_db()
+    assert not jobs.pool.running
+    bad = tmp_path / "bad.docx"
+    bad.write_bytes(b"not a zip archive")
+    with SessionLocal() as db:
+        user = User(email="inline-failure@example.com", password_hash="x")
+        db.add(user)
+        db.commit()
+        doc = Document(user_id=user.id, filename="bad.docx", path=str(bad), size=bad.stat().st_size)
+        db.add(doc)
+        db.commit()
+
+        [doc] = jobs.submit_many(db, [doc])
+
+        job = db.scalar(select(IngestJob).where(IngestJob.document_id == doc.id))
+        assert doc.status == "failed"
+        assert job.status == "failed"
+        assert job.attempts == job.max_attempts
+        assert job.error